@@ -0,0 +1,41 @@
+"""Add created_at and expires_at to urls
+
+Revision ID: 2c6e9b4d1a87
+Revises: 9e1d5b3a7c68
+Create Date: 2026-10-18 17:32:08.441906
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c6e9b4d1a87'
+down_revision: Union[str, Sequence[str], None] = '9e1d5b3a7c68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('urls', sa.Column('created_at', sa.DateTime(), nullable=True))
+    op.add_column('urls', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    # Partial: links that never expire stay out of the index.
+    # CONCURRENTLY keeps Postgres taking writes during the build, and cannot run in a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_urls_expires_at', 'urls', ['expires_at'], unique=False,
+            postgresql_where=sa.text('expires_at IS NOT NULL'),
+            sqlite_where=sa.text('expires_at IS NOT NULL'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_urls_expires_at', table_name='urls', postgresql_concurrently=True)
+    op.drop_column('urls', 'expires_at')
+    op.drop_column('urls', 'created_at')
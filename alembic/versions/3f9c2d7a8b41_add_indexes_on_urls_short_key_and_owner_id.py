@@ -0,0 +1,44 @@
+"""Add indexes on urls short_key and owner_id
+
+Revision ID: 3f9c2d7a8b41
+Revises: b12ab7d1e56d
+Create Date: 2026-10-18 10:12:45.204113
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2d7a8b41'
+down_revision: Union[str, Sequence[str], None] = 'b12ab7d1e56d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not context.is_offline_mode():
+        duplicates = op.get_bind().execute(sa.text(
+            "SELECT short_key, COUNT(*) FROM urls GROUP BY short_key HAVING COUNT(*) > 1 ORDER BY COUNT(*) DESC LIMIT 10"
+        )).all()
+        if duplicates:
+            raise RuntimeError(
+                "urls.short_key has duplicates, so its unique index cannot be built: "
+                + ", ".join(f"{key!r} ({count} rows)" for key, count in duplicates)
+                + ". Give those rows new keys or delete them, then run the migration again."
+            )
+    # Redirects and key collision checks look rows up by short_key.
+    # CONCURRENTLY keeps Postgres taking writes during the build, and cannot run in a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_urls_short_key'), 'urls', ['short_key'], unique=True, postgresql_concurrently=True)
+        op.create_index(op.f('ix_urls_owner_id'), 'urls', ['owner_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(op.f('ix_urls_owner_id'), table_name='urls', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_urls_short_key'), table_name='urls', postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""Add keyset listing indexes on urls
+
+Revision ID: 4b7f0e2a6c13
+Revises: c5a8e3f1d902
+Create Date: 2026-10-18 15:22:09.361857
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7f0e2a6c13'
+down_revision: Union[str, Sequence[str], None] = 'c5a8e3f1d902'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps Postgres taking writes during the build, and cannot run in a transaction.
+    # (owner_id, id) covers everything ix_urls_owner_id did
+    with op.get_context().autocommit_block():
+        op.create_index('ix_urls_owner_id_id', 'urls', ['owner_id', 'id'], unique=False,
+                        postgresql_include=['short_key', 'target_url', 'clicks'], postgresql_concurrently=True)
+        op.create_index('ix_urls_owner_id_clicks_id', 'urls', ['owner_id', 'clicks', 'id'], unique=False,
+                        postgresql_concurrently=True)
+        op.drop_index('ix_urls_owner_id', table_name='urls', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_urls_owner_id', 'urls', ['owner_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_urls_owner_id_clicks_id', table_name='urls', postgresql_concurrently=True)
+        op.drop_index('ix_urls_owner_id_id', table_name='urls', postgresql_concurrently=True)
@@ -0,0 +1,35 @@
+"""Add target_hash to urls
+
+Revision ID: 6a1f3c8e5b20
+Revises: 2c6e9b4d1a87
+Create Date: 2026-10-18 18:05:41.702318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6a1f3c8e5b20'
+down_revision: Union[str, Sequence[str], None] = '2c6e9b4d1a87'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('urls', sa.Column('target_hash', sa.String(length=64), nullable=True))
+    # Existing rows have no hash and NULLs never conflict, so there are no duplicates to check for.
+    # CONCURRENTLY keeps Postgres taking writes during the build, and cannot run in a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_urls_owner_id_target_hash', 'urls', ['owner_id', 'target_hash'], unique=True,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_urls_owner_id_target_hash', table_name='urls', postgresql_concurrently=True)
+    op.drop_column('urls', 'target_hash')
@@ -0,0 +1,33 @@
+"""Add key_blocks table
+
+Revision ID: 7d4e1a9c0f25
+Revises: 3f9c2d7a8b41
+Create Date: 2026-10-18 11:40:02.518730
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d4e1a9c0f25'
+down_revision: Union[str, Sequence[str], None] = '3f9c2d7a8b41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    key_blocks = op.create_table('key_blocks',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('next_id', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(key_blocks, [{'name': 'urls', 'next_id': 0}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('key_blocks')
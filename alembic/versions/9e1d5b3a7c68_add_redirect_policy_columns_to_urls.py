@@ -0,0 +1,30 @@
+"""Add redirect policy columns to urls
+
+Revision ID: 9e1d5b3a7c68
+Revises: 4b7f0e2a6c13
+Create Date: 2026-10-18 16:48:50.113294
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e1d5b3a7c68'
+down_revision: Union[str, Sequence[str], None] = '4b7f0e2a6c13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('urls', sa.Column('redirect_status', sa.SmallInteger(), nullable=True))
+    op.add_column('urls', sa.Column('cache_max_age', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('urls', 'cache_max_age')
+    op.drop_column('urls', 'redirect_status')
@@ -0,0 +1,66 @@
+"""Add click_events and rollup tables
+
+Revision ID: c5a8e3f1d902
+Revises: 7d4e1a9c0f25
+Create Date: 2026-10-18 14:05:31.772410
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a8e3f1d902'
+down_revision: Union[str, Sequence[str], None] = '7d4e1a9c0f25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        # Range-partitioned by month; the click event consumer creates each
+        # month's partition before writing into it
+        op.execute(
+            'CREATE TABLE click_events ('
+            ' short_key VARCHAR NOT NULL,'
+            ' occurred_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,'
+            ' referrer VARCHAR,'
+            ' agent VARCHAR'
+            ') PARTITION BY RANGE (occurred_at)'
+        )
+    else:
+        op.create_table('click_events',
+            sa.Column('short_key', sa.String(), nullable=False),
+            sa.Column('occurred_at', sa.DateTime(), nullable=False),
+            sa.Column('referrer', sa.String(), nullable=True),
+            sa.Column('agent', sa.String(), nullable=True)
+        )
+    op.create_index('ix_click_events_short_key_occurred_at', 'click_events', ['short_key', 'occurred_at'], unique=False)
+
+    for name in ('click_rollups_hourly', 'click_rollups_daily'):
+        op.create_table(name,
+            sa.Column('short_key', sa.String(), nullable=False),
+            sa.Column('bucket', sa.DateTime(), nullable=False),
+            sa.Column('clicks', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('short_key', 'bucket')
+        )
+    op.create_table('click_rollups_dimensions',
+        sa.Column('short_key', sa.String(), nullable=False),
+        sa.Column('bucket', sa.DateTime(), nullable=False),
+        sa.Column('dimension', sa.String(), nullable=False),
+        sa.Column('value', sa.String(), nullable=False),
+        sa.Column('clicks', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('short_key', 'bucket', 'dimension', 'value')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('click_rollups_dimensions')
+    op.drop_table('click_rollups_daily')
+    op.drop_table('click_rollups_hourly')
+    op.drop_index('ix_click_events_short_key_occurred_at', table_name='click_events')
+    op.drop_table('click_events')
@@ -1,19 +1,100 @@
 from datetime import datetime, timedelta, timezone
-from passlib.context import CryptContext
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import jwt
+import redis
+from starlette.concurrency import run_in_threadpool
+
+import cache
+from cache import LocalCache
+
+
+logger = logging.getLogger(__name__)
 
 # --- Password Hashing ---
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+
+@functools.lru_cache(maxsize=None)
+def get_pwd_context():
+    """The CryptContext, built when a password is first hashed rather than at import"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def verify_password(
     plain_password: str,
     hashed_password: str
 ) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+
+class HasherBusy(Exception):
+    """Raised when the password hashing pool has no free worker or queue slot"""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated, bounded thread pool.
+
+    bcrypt releases the GIL, so threads hash in parallel without tying up the
+    request threadpool. At most `workers + queue_limit` jobs are admitted;
+    beyond that callers get HasherBusy instead of waiting.
+    """
+
+    def __init__(self, workers: int = HASH_POOL_SIZE, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.seconds_total = 0.0
+
+    async def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        with self._lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.seconds_total += time.perf_counter() - start
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": max(0, self.in_flight - self.workers),
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "seconds_total": self.seconds_total,
+            }
+
+
+hasher = PasswordHasher()
 
 
 # --- JWT Handling ---
@@ -35,3 +116,70 @@ def create_access_token(username: str):
     encoded_jwt = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
     
     return encoded_jwt
+
+
+# --- Token and principal caches ---
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+
+decoded_tokens = LocalCache(maxsize=TOKEN_CACHE_SIZE)
+principal_cache = LocalCache(maxsize=TOKEN_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+def _seconds_left(payload: dict) -> float:
+    return payload["exp"] - time.time() if "exp" in payload else PRINCIPAL_CACHE_TTL
+
+def decode_access_token(token: str) -> dict:
+    """Verify and decode a token, memoized until the token expires"""
+    payload = decoded_tokens.get(token, None)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        decoded_tokens.set(token, payload, ttl=_seconds_left(payload))
+    return payload
+
+def principal_version(username: str):
+    """The user's change counter, shared through Redis by every process.
+
+    0 when there is no Redis, so the cache is per process as before; None
+    when Redis can't be reached, so nothing cached is trusted.
+    """
+    if cache.redis_client is None:
+        return 0
+    try:
+        return int(cache.redis_client.get(f"principal-version:{username}") or 0)
+    except redis.RedisError:
+        return None
+
+async def principal_version_async(username: str):
+    if cache.redis_client is None:
+        return 0
+    return await run_in_threadpool(principal_version, username)
+
+def get_cached_principal(payload: dict, version):
+    """The principal cached for this token, if the user hasn't changed since"""
+    if version is None:
+        return None
+    entry = principal_cache.get((payload.get("sub"), payload.get("iat")), None)
+    if entry is None or entry[0] != version:
+        return None
+    return entry[1]
+
+def cache_principal(payload: dict, principal, version):
+    """Cache the principal read at `version`, which must be read before the user row"""
+    if version is None:
+        return
+    ttl = min(PRINCIPAL_CACHE_TTL, _seconds_left(payload))
+    principal_cache.set((payload.get("sub"), payload.get("iat")), (version, principal), ttl=ttl)
+
+def invalidate_principal(username: str):
+    """Forget cached principals for a user whose row changed, here and in every other process"""
+    principal_cache.delete_matching(lambda key: key[0] == username)
+    if cache.redis_client is None:
+        return
+    name = f"principal-version:{username}"
+    try:
+        cache.redis_client.incr(name)
+        # Outlives every entry cached under the old version, so it can safely go back to 0
+        cache.redis_client.expire(name, PRINCIPAL_CACHE_TTL + 1)
+    except redis.RedisError as exc:
+        logger.warning("could not publish the change to user %r: %s", username, exc)
@@ -0,0 +1,85 @@
+"""Bulk shorten against N single POST /shorten calls.
+
+Runs the app in-process through TestClient against a scratch SQLite
+database and reports links/sec for both paths:
+
+    python benchmarks/bench_bulk.py --count 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# Thousands of single /shorten calls from one user would hit the per-user limit
+os.environ.setdefault("RATE_LIMITS", "false")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from main import app
+
+
+def make_client(path: str) -> TestClient:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    crud.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(class_=crud.AppSession, autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def override_get_read_db():
+        db = session_factory(info={"read_only": True})
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # Every session dependency, as in conftest.py, or requests reach the default DATABASE_URL
+    app.dependency_overrides[crud.get_db] = override_get_db
+    app.dependency_overrides[crud.get_read_db] = override_get_read_db
+    app.dependency_overrides[crud.get_session_factory] = lambda: session_factory
+    return TestClient(app)
+
+
+def auth_headers(client: TestClient) -> dict:
+    user_data = {"username": "bench", "password": "benchpass"}
+    client.post("/register", json=user_data)
+    token = client.post("/token", data=user_data).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=2_000)
+    args = parser.parse_args()
+    targets = [f"https://example.com/{i}" for i in range(args.count)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_client(os.path.join(tmp, "bench.db"))
+        headers = auth_headers(client)
+
+        start = time.perf_counter()
+        for target in targets:
+            client.post("/shorten", json={"target_url": target}, headers=headers)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = client.post("/shorten/bulk", json=targets, headers=headers)
+        assert response.text.count("\n") == args.count
+        bulk = time.perf_counter() - start
+
+    print(f"single: {args.count / single:>10.0f} links/s ({single:.2f}s)")
+    print(f"bulk:   {args.count / bulk:>10.0f} links/s ({bulk:.2f}s)")
+    print(f"speedup: {single / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Redirect lookup latency against table size.
+
+Fills a scratch SQLite database with N rows for each size and times
+crud.get_url_by_key for random existing keys. With the unique index on
+urls.short_key the per-lookup latency should stay flat as N grows:
+
+    python benchmarks/bench_lookup.py --sizes 10000 100000 1000000 10000000
+    python benchmarks/bench_lookup.py --output base.json
+    python benchmarks/bench_lookup.py --compare base.json
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from common import compare, percentiles, save_results
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import crud
+
+
+def fill(engine, rows: int, chunk: int = 50_000):
+    crud.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(crud.USER.__table__), [{"id": 1, "username": "bench", "hashed_password": "x"}])
+        for start in range(0, rows, chunk):
+            conn.execute(
+                insert(crud.URL.__table__),
+                [
+                    {"target_url": f"https://example.com/{i}", "short_key": f"k{i:x}", "owner_id": 1, "clicks": 0}
+                    for i in range(start, min(start + chunk, rows))
+                ],
+            )
+
+
+def measure(session_factory, rows: int, lookups: int) -> list:
+    keys = [f"k{random.randrange(rows):x}" for _ in range(lookups)]
+    timings = []
+    db = session_factory()
+    try:
+        for key in keys:
+            start = time.perf_counter()
+            assert crud.get_url_by_key(db, key) is not None
+            timings.append((time.perf_counter() - start) * 1e6)
+            db.expunge_all()
+    finally:
+        db.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=2_000)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/lookup-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'rows':>12} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10}")
+    for rows in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            fill(engine, rows)
+            timings = measure(sessionmaker(bind=engine), rows, args.lookups)
+            engine.dispose()
+        r = results[str(rows)] = {f"{k}_us": v for k, v in percentiles(timings).items()}
+        print(f"{rows:>12} {r['p50_us']:>10.1f} {r['p95_us']:>10.1f} {r['p99_us']:>10.1f}")
+    print(f"saved {save_results('lookup', results, args.output)}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
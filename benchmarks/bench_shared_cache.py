@@ -0,0 +1,111 @@
+"""Redirect cache hit rate and memory: one cache per worker vs one shared cache.
+
+Starts --workers processes that each serve --lookups requests for keys
+drawn from a Zipf-like distribution over --keys links, filling the cache
+on every miss, as the redirect route does. "local" gives each process its
+own LocalCache of --size entries; "shared" gives them one SharedCache of
+--size slots between them, and "pooled" one with the local caches' total,
+--size x --workers. Reports the overall hit rate, lookups per second and
+the memory the caches added (RSS, and PSS on Linux, which splits the
+shared segment between the processes mapping it):
+
+    python benchmarks/bench_shared_cache.py --workers 4 --size 10000
+    python benchmarks/bench_shared_cache.py --output base.json
+    python benchmarks/bench_shared_cache.py --compare base.json
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from common import compare, memory_kb, save_results
+
+import cache
+
+
+def zipf_keys(keys: int, lookups: int, s: float, seed: int) -> list:
+    weights = [1 / (rank ** s) for rank in range(1, keys + 1)]
+    cumulative = list(itertools.accumulate(weights))
+    return [f"k{i:x}" for i in random.Random(seed).choices(range(keys), cum_weights=cumulative, k=lookups)]
+
+
+def worker(mode: str, name: str, size: int, requests: list, barrier, results):
+    before = memory_kb()
+    local = cache.LocalCache(maxsize=size) if mode == "local" else cache.SharedCache(name, slots=size)
+    barrier.wait()
+    hits = 0
+    started = time.perf_counter()
+    for key in requests:
+        if local.get(key) is not cache.MISSING:
+            hits += 1
+        else:
+            local.set(key, cache.CachedURL(f"https://example.com/{key}"))
+    elapsed = time.perf_counter() - started
+    barrier.wait()
+    after = memory_kb()
+    barrier.wait()
+    memory = {name: (after[name] - before[name]) if after[name] is not None else None for name in after}
+    results.put({"hits": hits, "lookups": len(requests), "seconds": elapsed, **memory})
+
+
+def run(mode: str, args) -> dict:
+    size = args.size * args.workers if mode == "pooled" else args.size
+    name = f"bench-redirects-{uuid.uuid4().hex[:8]}"
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(args.workers)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=worker,
+            args=(mode, name, size, zipf_keys(args.keys, args.lookups, args.zipf, seed), barrier, results),
+        )
+        for seed in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    if mode != "local":
+        shared = cache.SharedCache(name, slots=size)
+        shared.unlink()
+        shared.close()
+        os.remove(os.path.join(tempfile.gettempdir(), f"{name}.lock"))
+    lookups = sum(report["lookups"] for report in reports)
+    pss = [report["pss_kb"] for report in reports]
+    return {
+        "hit_rate": sum(report["hits"] for report in reports) / lookups,
+        "lookups_per_sec": lookups / max(report["seconds"] for report in reports),
+        "total_rss_kb": sum(report["rss_kb"] for report in reports),
+        "total_pss_kb": None if None in pss else sum(pss),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--size", type=int, default=10_000, help="cache entries per worker")
+    parser.add_argument("--keys", type=int, default=200_000)
+    parser.add_argument("--lookups", type=int, default=100_000, help="lookups per worker")
+    parser.add_argument("--zipf", type=float, default=1.0, help="skew of the key distribution")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/shared_cache-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    results = {mode: run(mode, args) for mode in ("local", "shared", "pooled")}
+
+    print(f"{'cache':<8} {'hit rate':>9} {'lookups/s':>12} {'RSS MB':>9} {'PSS MB':>9}   ({args.workers} workers)")
+    for name, r in results.items():
+        pss = "n/a" if r["total_pss_kb"] is None else f"{r['total_pss_kb'] / 1024:.1f}"
+        print(f"{name:<8} {r['hit_rate']:>9.1%} {r['lookups_per_sec']:>12.0f} {r['total_rss_kb'] / 1024:>9.1f} {pss:>9}")
+    print(f"saved {save_results('shared_cache', results, args.output)}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
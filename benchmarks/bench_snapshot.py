@@ -0,0 +1,139 @@
+"""Redirect snapshot: lookup latency and memory per worker.
+
+Fills a scratch SQLite database with --rows links, exports them with
+snapshot.export_from_db and compares per-lookup latency of the mapped file
+against crud.get_url_by_key and a plain dict. Then starts --workers
+processes that each either map the snapshot or load every link into a
+dict, touch every entry, and report their RSS and PSS (Linux only; PSS
+splits shared pages between the processes mapping them):
+
+    python benchmarks/bench_snapshot.py --rows 1000000 --workers 4
+    python benchmarks/bench_snapshot.py --output base.json
+    python benchmarks/bench_snapshot.py --compare base.json
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from common import compare, memory_kb, percentiles, save_results
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import cache
+import crud
+import snapshot
+
+
+def fill(engine, rows: int, chunk: int = 50_000):
+    crud.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(crud.USER.__table__), [{"id": 1, "username": "bench", "hashed_password": "x"}])
+        for start in range(0, rows, chunk):
+            conn.execute(
+                insert(crud.URL.__table__),
+                [
+                    {"target_url": f"https://example.com/{i}", "short_key": f"k{i:x}", "owner_id": 1, "clicks": 0}
+                    for i in range(start, min(start + chunk, rows))
+                ],
+            )
+
+
+def timed(func, keys: list) -> dict:
+    samples = []
+    for key in keys:
+        t = time.perf_counter()
+        func(key)
+        samples.append((time.perf_counter() - t) * 1e6)
+    return {f"{k}_us": v for k, v in percentiles(samples).items()}
+
+
+def worker(mode: str, path: str, database: str, rows: int, barrier, results):
+    before = memory_kb()
+    if mode == "snapshot":
+        table = snapshot.Snapshot(path)
+        lookup = table.get
+    else:
+        db = sessionmaker(bind=create_engine(database))()
+        table = {row.short_key: cache.CachedURL.from_url(row) for row in crud.iter_redirect_rows(db)}
+        db.close()
+        lookup = table.get
+    for i in range(rows):
+        assert lookup(f"k{i:x}") is not None
+    barrier.wait()
+    after = memory_kb()
+    barrier.wait()
+    results.put({name: (after[name] - before[name]) if after[name] is not None else None for name in after})
+
+
+def memory(mode: str, path: str, database: str, rows: int, workers: int) -> dict:
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, path, database, rows, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    total = {name: sum(report[name] for report in reports) if reports[0][name] is not None else None for name in reports[0]}
+    return {f"total_{name}": value for name, value in total.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--lookups", type=int, default=5_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/snapshot-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database = f"sqlite:///{os.path.join(tmp, 'snapshot.db')}"
+        engine = create_engine(database)
+        fill(engine, args.rows)
+        path = os.path.join(tmp, "urls.snap")
+        started = time.perf_counter()
+        snapshot.export_from_db(path, sessionmaker(bind=engine))
+        results["export"] = {"seconds": time.perf_counter() - started, "bytes": os.path.getsize(path)}
+
+        keys = [f"k{random.randrange(args.rows):x}" for _ in range(args.lookups)]
+        mapped = snapshot.Snapshot(path)
+        table = {f"k{i:x}": cache.CachedURL(f"https://example.com/{i}") for i in range(args.rows)}
+        db = sessionmaker(bind=engine)()
+
+        def query(key):
+            crud.get_url_by_key(db, key)
+            db.expunge_all()
+
+        results["lookup"] = {
+            "snapshot": timed(mapped.get, keys),
+            "database": timed(query, keys),
+            "dict": timed(table.get, keys),
+        }
+        db.close()
+        engine.dispose()
+        del table
+
+        results["memory"] = {mode: memory(mode, path, database, args.rows, args.workers) for mode in ("snapshot", "dict")}
+
+    print(f"export: {results['export']['seconds']:.2f}s, {results['export']['bytes'] / 1e6:.1f} MB for {args.rows} links")
+    print(f"{'lookup':<10} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10}")
+    for name, r in results["lookup"].items():
+        print(f"{name:<10} {r['p50_us']:>10.1f} {r['p95_us']:>10.1f} {r['p99_us']:>10.1f}")
+    print(f"{'memory':<10} {'RSS MB':>10} {'PSS MB':>10}   ({args.workers} workers, growth after loading)")
+    for name, r in results["memory"].items():
+        pss = "n/a" if r["total_pss_kb"] is None else f"{r['total_pss_kb'] / 1024:.1f}"
+        print(f"{name:<10} {r['total_rss_kb'] / 1024:>10.1f} {pss:>10}")
+    print(f"saved {save_results('snapshot', results, args.output)}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
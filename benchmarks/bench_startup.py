@@ -0,0 +1,110 @@
+"""Cold-start benchmark: import time and time to first redirect.
+
+Measures how long `import main` takes in a fresh interpreter, then starts
+uvicorn on a scratch SQLite database holding --links links and times how
+long after spawning the process the first redirect is served and /readyz
+turns 200. With --budget-ms the script exits non-zero when the first
+redirect takes longer, so it can gate CI:
+
+    python benchmarks/bench_startup.py --budget-ms 3000
+    python benchmarks/bench_startup.py --output base.json
+    python benchmarks/bench_startup.py --compare base.json
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, compare, free_port, save_results
+
+import httpx
+
+
+IMPORT_MAIN = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def import_seconds(env: dict) -> float:
+    return float(subprocess.check_output([sys.executable, "-c", IMPORT_MAIN], cwd=ROOT, env=env, text=True))
+
+
+def seed(env: dict, links: int) -> str:
+    """Create the schema and --links links; return one of the keys"""
+    script = (
+        "import crud, keys\n"
+        "crud.Base.metadata.create_all(bind=crud.engine)\n"
+        "db = crud.SessionLocal()\n"
+        "db.add(crud.USER(id=1, username='startup', hashed_password='x'))\n"
+        "db.commit()\n"
+        f"print(keys.create_urls(db, [f'https://example.com/{{i}}' for i in range({links})], 1)[0]['short_key'])\n"
+    )
+    return subprocess.check_output([sys.executable, "-c", script], cwd=ROOT, env=env, text=True).strip()
+
+
+def wait_for(client: httpx.Client, path: str, statuses: tuple, started: float, timeout: float = 60) -> float:
+    while time.perf_counter() - started < timeout:
+        try:
+            if client.get(path).status_code in statuses:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{path} did not answer {statuses} within {timeout}s")
+
+
+def cold_start(env: dict, key: str) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"], cwd=ROOT, env=env
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", follow_redirects=False) as client:
+            first_redirect = wait_for(client, f"/{key}", (307,), started)
+            ready = wait_for(client, "/readyz", (200,), started)
+    finally:
+        server.terminate()
+        server.wait()
+    return {"first_redirect_ms": first_redirect * 1e3, "ready_ms": ready * 1e3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=10_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, help="fail when the median time to first redirect exceeds this")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/startup-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+            "BCRYPT_ROUNDS": "4",
+        }
+        key = seed(env, args.links)
+        imports = [import_seconds(env) * 1e3 for _ in range(args.runs)]
+        starts = [cold_start(env, key) for _ in range(args.runs)]
+
+    results = {
+        "config": {"links": args.links, "runs": args.runs},
+        "import_main_ms": statistics.median(imports),
+        "first_redirect_ms": statistics.median(run["first_redirect_ms"] for run in starts),
+        "ready_ms": statistics.median(run["ready_ms"] for run in starts),
+    }
+    print(f"import main:       {results['import_main_ms']:8.1f} ms")
+    print(f"first redirect:    {results['first_redirect_ms']:8.1f} ms")
+    print(f"ready:             {results['ready_ms']:8.1f} ms")
+    print(f"saved {save_results('startup', results, args.output)}")
+    if args.compare:
+        compare(args.compare, results)
+    if args.budget_ms is not None and results["first_redirect_ms"] > args.budget_ms:
+        print(f"over budget: {results['first_redirect_ms']:.1f} ms > {args.budget_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Target URL validation throughput, for sizing bulk imports.
+
+Runs --urls URLs of each kind through targets.normalize: "normal" URLs
+that take the precompiled fast path, "messy" ones that are taken apart and
+rebuilt (upper case, default ports, IDNA hosts, spaces) and "invalid"
+ones. Each kind is timed with no lists and with a blocklist of --domains
+domains, and compared with urlsplit alone and the
+full crud.URLBase model that /shorten/bulk and transfer.py validate with:
+
+    python benchmarks/bench_targets.py --urls 200000 --domains 1000000
+    python benchmarks/bench_targets.py --output base.json
+    python benchmarks/bench_targets.py --compare base.json
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from common import compare, save_results
+
+import crud
+import targets
+
+
+def make_urls(kind: str, count: int, rng: random.Random) -> list:
+    def host():
+        return f"{rng.choice(['www.', 'docs.', ''])}site{rng.randrange(100_000)}.{rng.choice(['com', 'org', 'io'])}"
+
+    def path():
+        return "/".join(f"p{rng.randrange(1000)}" for _ in range(rng.randrange(1, 4)))
+
+    if kind == "normal":
+        return [f"https://{host()}/{path()}?id={rng.randrange(10**6)}" for _ in range(count)]
+    if kind == "messy":
+        forms = [
+            lambda: f"HTTPS://{host().upper()}/{path()}",
+            lambda: f"http://{host()}:80/{path()}",
+            lambda: f"https://bücher{rng.randrange(1000)}.example/{path()}",
+            lambda: f"https://{host()}/{path()} with spaces",
+        ]
+        return [rng.choice(forms)() for _ in range(count)]
+    forms = [
+        lambda: f"{host()}/{path()}",
+        lambda: f"ftp://{host()}/{path()}",
+        lambda: f"https://user:pw@{host()}/",
+        lambda: f"https://{host()}:99999/",
+    ]
+    return [rng.choice(forms)() for _ in range(count)]
+
+
+def throughput(func, urls: list) -> float:
+    started = time.perf_counter()
+    for url in urls:
+        try:
+            func(url)
+        except ValueError:
+            pass
+    return len(urls) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=100_000, help="URLs of each kind")
+    parser.add_argument("--domains", type=int, default=100_000, help="blocklist size")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/targets-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    kinds = {kind: make_urls(kind, args.urls, rng) for kind in ("normal", "messy", "invalid")}
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.writelines(f"blocked{i}.example\n" for i in range(args.domains))
+    try:
+        started = time.perf_counter()
+        blocklist = targets.DomainList(f.name)
+        load_seconds = time.perf_counter() - started
+    finally:
+        os.remove(f.name)
+
+    results = {"blocklist_load_seconds": load_seconds}
+    for kind, urls in kinds.items():
+        results[kind] = {
+            "urlsplit": throughput(urlsplit, urls),
+            "normalize": throughput(targets.normalize, urls),
+        }
+        targets.blocklist = blocklist
+        results[kind]["normalize_blocklist"] = throughput(targets.normalize, urls)
+        targets.blocklist = targets.DomainList("")
+        results[kind]["url_model"] = throughput(lambda url: crud.URLBase(target_url=url), urls)
+
+    print(f"blocklist of {args.domains} domains loaded in {load_seconds:.2f}s")
+    print(f"{'urls/s':<10} {'urlsplit':>12} {'normalize':>12} {'+blocklist':>12} {'URLBase':>12}")
+    for kind in kinds:
+        r = results[kind]
+        print(
+            f"{kind:<10} {r['urlsplit']:>12.0f} {r['normalize']:>12.0f} "
+            f"{r['normalize_blocklist']:>12.0f} {r['url_model']:>12.0f}"
+        )
+    print(f"saved {save_results('targets', results, args.output)}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Shared helpers for the benchmark scripts: percentiles and JSON result files."""
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentiles(samples: list, points=(50, 95, 99)) -> dict:
+    """Nearest-rank percentiles of `samples`, keyed p50/p95/..."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {f"p{p}": ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))] for p in points}
+
+
+def memory_kb() -> dict:
+    """This process's RSS and PSS in kB, from smaps_rollup where the kernel has it"""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {"rss_kb": int(fields["Rss"].split()[0]), "pss_kb": int(fields["Pss"].split()[0])}
+    except (OSError, KeyError):
+        return {"rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "pss_kb": None}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(name: str, results: dict, output: str = None) -> str:
+    """Write results with run metadata to JSON and return the path"""
+    document = {
+        "benchmark": name,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2)
+    return output
+
+
+def compare(previous: str, results: dict):
+    """Print each numeric result next to the same result from an earlier run"""
+    with open(previous) as f:
+        old = json.load(f)["results"]
+
+    def walk(new, before, prefix=""):
+        for key, value in new.items():
+            name = f"{prefix}{key}"
+            if isinstance(value, dict):
+                walk(value, before.get(key, {}), name + ".")
+            elif isinstance(value, (int, float)) and isinstance(before.get(key), (int, float)) and before[key]:
+                change = (value - before[key]) / before[key] * 100
+                print(f"{name:<45} {before[key]:>14.6g} -> {value:>14.6g} ({change:+.1f}%)")
+
+    walk(results, old)
@@ -0,0 +1,141 @@
+"""HTTP load generator for the redirect path.
+
+Starts uvicorn on a scratch SQLite database, creates --links short links
+through /shorten/bulk, then drives GET /{key} from --concurrency asyncio
+workers for --duration seconds. Key popularity follows a Zipf
+distribution with exponent --zipf, so a few keys take most of the traffic,
+as in production. Reports RPS and p50/p95/p99 latency and saves JSON results:
+
+    python benchmarks/loadgen.py --duration 20 --concurrency 64 --output base.json
+    python benchmarks/loadgen.py --duration 20 --concurrency 64 --compare base.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, compare, free_port, percentiles, save_results
+
+import httpx
+
+
+def zipf_sampler(n: int, s: float, seed: int = 0):
+    """Return a function drawing 0..n-1 with P(rank k) proportional to 1 / (k + 1) ** s"""
+    cumulative = list(itertools.accumulate(1 / (k + 1) ** s for k in range(n)))
+    rng = random.Random(seed)
+    population = range(n)
+    return lambda: rng.choices(population, cum_weights=cumulative)[0]
+
+
+def start_server(database_url: str, port: int, workers: int) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_URL": database_url, "BCRYPT_ROUNDS": "4", "RATE_LIMITS": "false"}
+    # Create the schema up front so every worker starts against the same tables
+    subprocess.check_call(
+        [sys.executable, "-c", "import crud; crud.Base.metadata.create_all(bind=crud.engine)"], cwd=ROOT, env=env
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+
+
+async def wait_until_up(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get("/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def seed(client: httpx.AsyncClient, links: int) -> list:
+    user = {"username": "loadgen", "password": "loadgenpass"}
+    await client.post("/register", json=user)
+    token = (await client.post("/token", data=user)).json()["access_token"]
+    response = await client.post(
+        "/shorten/bulk",
+        json=[f"https://example.com/{i}" for i in range(links)],
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=300,
+    )
+    return [json.loads(line)["short_key"] for line in response.text.splitlines() if "short_key" in line]
+
+
+async def drive(client: httpx.AsyncClient, keys: list, zipf: float, concurrency: int, duration: float) -> dict:
+    sample = zipf_sampler(len(keys), zipf)
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            key = keys[sample()]
+            start = time.perf_counter()
+            try:
+                response = await client.get(f"/{key}")
+                ok = response.status_code in (301, 302, 307, 308)
+            except httpx.TransportError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        **{f"{k}_ms": v * 1e3 for k, v in percentiles(latencies).items()},
+    }
+
+
+async def run(args) -> dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        server = start_server(f"sqlite:///{os.path.join(tmp, 'load.db')}", port, args.workers)
+        try:
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, follow_redirects=False) as client:
+                await wait_until_up(client)
+                keys = await seed(client, args.links)
+                # Warm the caches before measuring
+                await drive(client, keys, args.zipf, args.concurrency, min(2.0, args.duration))
+                return await drive(client, keys, args.zipf, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=10_000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/loadgen-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    results = {"config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}}
+    results["redirect"] = asyncio.run(run(args))
+    r = results["redirect"]
+    print(f"{r['requests']} requests, {r['errors']} errors, {r['rps']:.0f} req/s")
+    print(f"p50 {r['p50_ms']:.2f} ms  p95 {r['p95_ms']:.2f} ms  p99 {r['p99_ms']:.2f} ms")
+    print(f"saved {save_results('loadgen', results, args.output)}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
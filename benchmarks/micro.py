@@ -0,0 +1,91 @@
+"""Micro-benchmarks for the hot functions behind the redirect and auth paths.
+
+Covers crud.get_url_by_key, crud.increment_click_count,
+keys.create_random_key, JWT encode/decode and bcrypt. Each case reports
+ops/sec and per-call p50/p95/p99 in microseconds:
+
+    python benchmarks/micro.py --output before.json
+    python benchmarks/micro.py --compare before.json
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from common import compare, percentiles, save_results
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+import jwt
+
+import auth
+import crud
+import keys
+
+
+def timed(func, iterations: int) -> dict:
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t) * 1e6)
+    elapsed = time.perf_counter() - start
+    return {"ops_per_sec": iterations / elapsed, **{f"{k}_us": v for k, v in percentiles(samples).items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5_000)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--bcrypt-iterations", type=int, default=20)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/micro-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'micro.db')}")
+        crud.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(insert(crud.USER.__table__), [{"id": 1, "username": "bench", "hashed_password": "x"}])
+            conn.execute(
+                insert(crud.URL.__table__),
+                [{"target_url": f"https://example.com/{i}", "short_key": f"k{i:x}", "owner_id": 1, "clicks": 0} for i in range(args.rows)],
+            )
+        db = sessionmaker(bind=engine)()
+
+        def lookup():
+            crud.get_url_by_key(db, f"k{random.randrange(args.rows):x}")
+            db.expunge_all()
+
+        results["crud.get_url_by_key"] = timed(lookup, args.iterations)
+        results["crud.increment_click_count"] = timed(
+            lambda: crud.increment_click_count(db, f"k{random.randrange(args.rows):x}"), args.iterations
+        )
+        db.close()
+        engine.dispose()
+
+    results["keys.create_random_key"] = timed(keys.create_random_key, args.iterations * 10)
+    results["keys.key_for_number"] = timed(lambda: keys.key_for_number(random.randrange(keys.KEYSPACE)), args.iterations * 10)
+
+    token = auth.create_access_token("bench")
+    results["jwt.encode"] = timed(lambda: auth.create_access_token("bench"), args.iterations)
+    results["jwt.decode"] = timed(lambda: jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM]), args.iterations)
+    results["auth.decode_access_token (memoized)"] = timed(lambda: auth.decode_access_token(token), args.iterations)
+
+    hashed = auth.get_password_hash("benchpass")
+    results[f"bcrypt.hash (rounds={auth.BCRYPT_ROUNDS})"] = timed(lambda: auth.get_password_hash("benchpass"), args.bcrypt_iterations)
+    results[f"bcrypt.verify (rounds={auth.BCRYPT_ROUNDS})"] = timed(lambda: auth.verify_password("benchpass", hashed), args.bcrypt_iterations)
+
+    print(f"{'case':<40} {'ops/s':>12} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10}")
+    for name, r in results.items():
+        print(f"{name:<40} {r['ops_per_sec']:>12.0f} {r['p50_us']:>10.1f} {r['p95_us']:>10.1f} {r['p99_us']:>10.1f}")
+    print(f"saved {save_results('micro', results, args.output)}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
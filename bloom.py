@@ -0,0 +1,201 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import uuid
+
+import redis
+from starlette.concurrency import run_in_threadpool
+
+import cache
+import crud
+
+
+logger = logging.getLogger(__name__)
+
+# Off by default: with several workers and no REDIS_HOST, a worker would not
+# see keys created by the others and would answer 404 for them
+KEY_FILTER = crud.env_flag("KEY_FILTER")
+KEY_FILTER_CAPACITY = int(os.getenv("KEY_FILTER_CAPACITY", "1000000"))
+KEY_FILTER_ERROR_RATE = float(os.getenv("KEY_FILTER_ERROR_RATE", "0.01"))
+KEY_FILTER_SCAN_BATCH = int(os.getenv("KEY_FILTER_SCAN_BATCH", "10000"))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings.
+
+    Bits are laid out like a Redis bitmap (bit 0 is the high bit of byte 0),
+    so the array can be merged with one kept in Redis with SETBIT/BITOP.
+    """
+
+    def __init__(self, capacity: int = KEY_FILTER_CAPACITY, error_rate: float = KEY_FILTER_ERROR_RATE):
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: str) -> list:
+        """Bit offsets for key, by double hashing one 128-bit digest"""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def set(self, positions: list):
+        for position in positions:
+            self.array[position >> 3] |= 0x80 >> (position & 7)
+
+    def has(self, positions: list) -> bool:
+        return all(self.array[position >> 3] & (0x80 >> (position & 7)) for position in positions)
+
+    def add(self, key: str) -> list:
+        positions = self.positions(key)
+        self.set(positions)
+        self.count += 1
+        return positions
+
+    def __contains__(self, key: str) -> bool:
+        return self.has(self.positions(key))
+
+    def merge(self, other: bytes):
+        """OR another bitmap of the same size into this one"""
+        for i, byte in enumerate(other[: len(self.array)]):
+            self.array[i] |= byte
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.array)
+
+    def false_positive_rate(self) -> float:
+        """Estimated from how many bits are set, so it also covers bits merged in from Redis"""
+        filled = int.from_bytes(self.array, "big").bit_count() / self.bits
+        return filled ** self.hashes
+
+
+class KeyFilter:
+    """Answers "definitely not a short key" for the redirect path without a query.
+
+    Until `build` has scanned the urls table every key is let through. With
+    Redis the bitmap is shared: every add is mirrored with SETBIT, and a key
+    missing locally is checked against the shared bitmap before it is
+    rejected, so keys created by other workers are never turned away. If a
+    mirror fails, the bits are sent again with the next add and the shared
+    bitmap is marked untrusted, letting every key through, until a build
+    has merged a fresh scan into it.
+    """
+
+    def __init__(self, bloom: BloomFilter, redis_client=None, enabled: bool = KEY_FILTER):
+        self.bloom = bloom
+        self.redis = redis_client
+        self.enabled = enabled
+        self.ready = False
+        self.redis_key = f"keyfilter:{bloom.bits}:{bloom.hashes}"
+        self.untrusted_key = f"{self.redis_key}:untrusted"
+        self.stats = {"rejected": 0, "passed": 0, "false_positive": 0}
+        self._lock = threading.Lock()
+        # Positions whose SETBIT failed, sent again with the next add
+        self._unmirrored = set()
+
+    def add(self, *keys: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            positions = [position for key in keys for position in self.bloom.add(key)]
+            if self.redis is None:
+                return
+            positions += self._unmirrored
+            self._unmirrored = set()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for position in positions:
+                pipe.setbit(self.redis_key, position, 1)
+            pipe.execute()
+        except redis.RedisError:
+            with self._lock:
+                self._unmirrored.update(positions)
+            logger.warning("could not mirror %d keys to the shared key filter; other workers will let keys through", len(keys))
+            try:
+                self.redis.set(self.untrusted_key, 1)
+            except redis.RedisError:
+                # Then the other workers can't read the bitmap either, and let keys through anyway
+                pass
+
+    def might_contain(self, key: str) -> bool:
+        if not (self.enabled and self.ready):
+            return True
+        positions = self.bloom.positions(key)
+        return self._count(self.bloom.has(positions) or self._shared_has(positions))
+
+    async def might_contain_async(self, key: str) -> bool:
+        """might_contain() for async routes, with the shared bitmap read off the event loop"""
+        if not (self.enabled and self.ready):
+            return True
+        positions = self.bloom.positions(key)
+        if self.bloom.has(positions):
+            return self._count(True)
+        return self._count(self.redis is not None and await run_in_threadpool(self._shared_has, positions))
+
+    def _count(self, passed: bool) -> bool:
+        self.stats["passed" if passed else "rejected"] += 1
+        return passed
+
+    def false_positive(self):
+        """Record that a key the filter let through was not in the database"""
+        self.stats["false_positive"] += 1
+
+    def build(self, session_factory=None, batch_size: int = KEY_FILTER_SCAN_BATCH):
+        """Load every existing short key, then merge with the shared bitmap"""
+        if not self.enabled:
+            return
+        db = (session_factory or crud.SessionLocal)()
+        try:
+            for keys in crud.iter_short_keys(db, batch_size):
+                with self._lock:
+                    for key in keys:
+                        self.bloom.add(key)
+        finally:
+            db.close()
+        if self.redis is not None:
+            self._sync_shared()
+        self.ready = True
+        logger.info("key filter ready: %d keys, %d bytes", self.bloom.count, self.bloom.memory_bytes)
+
+    def _shared_has(self, positions: list) -> bool:
+        if self.redis is None:
+            return False
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(self.untrusted_key)
+            for position in positions:
+                pipe.getbit(self.redis_key, position)
+            untrusted, *bits = pipe.execute()
+            if untrusted is not None:
+                # A worker failed to mirror some keys; the bitmap can't rule anything out
+                return True
+            if not all(bits):
+                return False
+        except redis.RedisError:
+            # Can't tell; let the database decide
+            return True
+        with self._lock:
+            self.bloom.set(positions)
+        return True
+
+    def _sync_shared(self):
+        # A union never loses keys, so workers building at the same time can't clobber each other
+        scratch = f"{self.redis_key}:build:{uuid.uuid4().hex}"
+        try:
+            self.redis.set(scratch, bytes(self.bloom.array), ex=60)
+            self.redis.bitop("OR", self.redis_key, self.redis_key, scratch)
+            # The union now holds every key in the table, including any that failed to mirror
+            self.redis.delete(scratch, self.untrusted_key)
+            shared = self.redis.get(self.redis_key)
+        except redis.RedisError:
+            logger.warning("could not sync the shared key filter; using the local one")
+            return
+        with self._lock:
+            self.bloom.merge(shared or b"")
+
+
+key_filter = KeyFilter(BloomFilter(), cache.redis_client)
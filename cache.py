@@ -0,0 +1,570 @@
+import fcntl
+import json
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from datetime import timezone
+from typing import NamedTuple, Optional
+
+import redis
+from starlette.concurrency import run_in_threadpool
+
+from config import env_flag
+
+
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+
+REDIRECT_CACHE_SIZE = int(os.getenv("REDIRECT_CACHE_SIZE", "10000"))
+REDIRECT_CACHE_TTL = int(os.getenv("REDIRECT_CACHE_TTL", "3600"))
+REDIRECT_NEGATIVE_TTL = int(os.getenv("REDIRECT_NEGATIVE_TTL", "30"))
+# One cache table in shared memory for all `uvicorn --workers` processes instead of one per process
+REDIRECT_CACHE_SHARED = env_flag("REDIRECT_CACHE_SHARED")
+REDIRECT_CACHE_SHM_NAME = os.getenv("REDIRECT_CACHE_SHM_NAME", "url-shortener-redirects")
+# Entries whose key and URL don't fit in a slot are left to the Redis tier and the database
+REDIRECT_CACHE_SLOT_BYTES = int(os.getenv("REDIRECT_CACHE_SLOT_BYTES", "256"))
+
+# Returned by RedirectCache.get when neither tier knows the key
+MISSING = object()
+
+
+class CachedURL(NamedTuple):
+    """What the redirect path needs to answer a request for a short key"""
+    target_url: str
+    status: int = 307
+    max_age: Optional[int] = None
+    # Unix time after which the link answers 410; None never expires
+    expires_at: Optional[float] = None
+
+    @classmethod
+    def from_url(cls, url) -> "CachedURL":
+        """Build the cache entry from a URL row or URLInfo"""
+        expires_at = url.expires_at and url.expires_at.replace(tzinfo=timezone.utc).timestamp()
+        return cls(url.target_url, url.redirect_status or 307, url.cache_max_age, expires_at)
+
+
+#local tier -------------------------------------------------------------------------------
+class LocalCache:
+    """Bounded in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, maxsize: int = REDIRECT_CACHE_SIZE, ttl: float = REDIRECT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """Drop every entry whose key satisfies predicate"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+#shared tier ------------------------------------------------------------------------------
+class SharedCache:
+    """Redirect entries in one shared memory table used by every worker process on the host.
+
+    A fixed-size open-addressing table: a key lives in one of the `probe`
+    slots after its hash, and when they are all taken CLOCK picks the victim
+    among them (a slot read since the last sweep gets a second chance).
+    Reads take no lock: each slot carries a sequence number that is odd
+    while it is being written plus a CRC of its contents, and a read that
+    sees either change is treated as a miss. Writes are serialised between
+    processes with flock on a lock file next to the segment.
+
+    Values are CachedURL or None (a known-missing key); entries that don't
+    fit in a slot are simply not cached here.
+    """
+
+    MAGIC = b"URLSHM01"
+    HEADER = struct.Struct("<8sII")
+    # seq, ref, crc; then the checksummed body: key length, URL length,
+    # status (0 for a missing key), max-age (-1 for none), expiry (NaN for none), deadline
+    SLOT = struct.Struct("<IB3xI")
+    BODY = struct.Struct("<BxHHxxidd")
+
+    def __init__(
+        self,
+        name: str = REDIRECT_CACHE_SHM_NAME,
+        slots: int = REDIRECT_CACHE_SIZE,
+        slot_size: int = REDIRECT_CACHE_SLOT_BYTES,
+        ttl: float = REDIRECT_CACHE_TTL,
+        probe: int = 8,
+    ):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.probe = min(probe, slots)
+        self.data_start = self.SLOT.size + self.BODY.size
+        size = self.HEADER.size + slots * slot_size
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a")
+        self._lock = threading.Lock()
+        # Processes started by one parent share its resource tracker, which keeps a set of names:
+        # each register/unregister pair has to reach it without another process's pair in between
+        with self._locked():
+            try:
+                self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+                self.HEADER.pack_into(self.shm.buf, 0, self.MAGIC, slots, slot_size)
+            except FileExistsError:
+                self.shm = shared_memory.SharedMemory(name)
+                magic, existing_slots, existing_size = self.HEADER.unpack_from(self.shm.buf, 0)
+                # An all-zero header is a segment another worker is still creating
+                if magic == self.MAGIC and (existing_slots, existing_size) != (slots, slot_size):
+                    raise ValueError(f"shared cache {name!r} has {existing_slots} slots of {existing_size} bytes, not {slots} of {slot_size}")
+            # The segment outlives any one worker; don't let this process's resource tracker unlink it at exit
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.buf = self.shm.buf
+
+    def _offset(self, index: int) -> int:
+        return self.HEADER.size + (index % self.slots) * self.slot_size
+
+    def _window(self, key: bytes):
+        """Offsets of the slots `key` may live in; lazy, since most lookups stop at the first"""
+        start = zlib.crc32(key)
+        for i in range(self.probe):
+            yield self._offset(start + i)
+
+    def _holds(self, offset: int, key: bytes) -> bool:
+        """Cheap unvalidated check that the slot's key is `key`, made before the full read"""
+        start = offset + self.data_start
+        return self.buf[offset + self.SLOT.size] == len(key) and self.buf[start:start + len(key)] == key
+
+    def _read(self, offset: int):
+        """(key, body fields, url bytes) for the slot, or None if it is empty or mid-write"""
+        seq, _, crc = self.SLOT.unpack_from(self.buf, offset)
+        if seq & 1:
+            return None
+        body = self.BODY.unpack_from(self.buf, offset + self.SLOT.size)
+        key_length, url_length = body[0], body[1]
+        end = offset + self.data_start + key_length + url_length
+        if not key_length or end > offset + self.slot_size:
+            return None
+        raw = bytes(self.buf[offset + self.SLOT.size:end])
+        if zlib.crc32(raw) != crc or self.SLOT.unpack_from(self.buf, offset)[0] != seq:
+            return None
+        data = raw[self.BODY.size:]
+        return data[:key_length], body, data[key_length:]
+
+    def get(self, key, default=MISSING):
+        wanted = key.encode()
+        for offset in self._window(wanted):
+            if not self._holds(offset, wanted):
+                continue
+            slot = self._read(offset)
+            if slot is None or slot[0] != wanted:
+                continue
+            _, _, status, max_age, expires_at, deadline = slot[1]
+            if deadline < time.time():
+                return default
+            self.buf[offset + 4] = 1
+            if not status:
+                return None
+            return CachedURL(slot[2].decode(), status, None if max_age < 0 else max_age, None if math.isnan(expires_at) else expires_at)
+        return default
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        encoded = key.encode()
+        url = value.target_url.encode() if value is not None else b""
+        if not encoded or len(encoded) > 255 or self.data_start + len(encoded) + len(url) > self.slot_size:
+            return
+        deadline = time.time() + (self.ttl if ttl is None else ttl)
+        if value is None:
+            body = self.BODY.pack(len(encoded), 0, 0, -1, math.nan, deadline)
+        else:
+            max_age = -1 if value.max_age is None else value.max_age
+            expires_at = math.nan if value.expires_at is None else value.expires_at
+            body = self.BODY.pack(len(encoded), len(url), value.status, max_age, expires_at, deadline)
+        raw = body + encoded + url
+        with self._locked():
+            offset = self._victim(encoded)
+            self._write(offset, raw)
+
+    def _victim(self, key: bytes) -> int:
+        # Called with the write lock held, so no slot is mid-write
+        window = list(self._window(key))
+        for offset in window:
+            if self._holds(offset, key):
+                return offset
+        now = time.time()
+        for offset in window:
+            key_length, _, _, _, _, deadline = self.BODY.unpack_from(self.buf, offset + self.SLOT.size)
+            if not key_length or deadline < now:
+                return offset
+        # CLOCK over the window: clear reference bits until an unreferenced slot turns up
+        for offset in window:
+            if not self.buf[offset + 4]:
+                return offset
+            self.buf[offset + 4] = 0
+        return window[0]
+
+    def _write(self, offset: int, raw: bytes):
+        seq = self.SLOT.unpack_from(self.buf, offset)[0]
+        struct.pack_into("<I", self.buf, offset, (seq + 1) | 1)
+        self.buf[offset + self.SLOT.size:offset + self.SLOT.size + len(raw)] = raw
+        struct.pack_into("<B3xI", self.buf, offset + 4, 1, zlib.crc32(raw))
+        struct.pack_into("<I", self.buf, offset, ((seq + 1) | 1) + 1)
+
+    def delete(self, key):
+        encoded = key.encode()
+        with self._locked():
+            for offset in self._window(encoded):
+                if self._holds(offset, encoded):
+                    self._write(offset, bytes(self.BODY.size))
+
+    def clear(self):
+        with self._locked():
+            for index in range(self.slots):
+                self._write(self._offset(index), bytes(self.BODY.size))
+
+    def __len__(self):
+        return sum(1 for index in range(self.slots) if self._read(self._offset(index)) is not None)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        self._lock_file.close()
+
+    def unlink(self):
+        """Remove the segment; workers that still have it mapped keep using it"""
+        # Registered again only so unlink's own unregister has something to remove
+        with self._locked():
+            resource_tracker.register(self.shm._name, "shared_memory")
+            self.shm.unlink()
+
+
+#redis tier -------------------------------------------------------------------------------
+class InMemoryRedis:
+    """Minimal in-process stand-in for redis.Redis, used for tests and single-node runs"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, name):
+        item = self._data.get(name)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires < time.monotonic():
+            del self._data[name]
+            return None
+        return item
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def get(self, name):
+        with self._lock:
+            item = self._live(name)
+            return None if item is None else item[0]
+
+    def set(self, name, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._live(name) is not None:
+                return None
+            expires = None if ex is None else time.monotonic() + ex
+            self._data[name] = (self._encode(value), expires)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def rename(self, src, dst):
+        with self._lock:
+            if self._live(src) is None:
+                raise redis.ResponseError("no such key")
+            self._data[dst] = self._data.pop(src)
+            return True
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            item = self._live(name)
+            value = int(item[0]) + amount if item else amount
+            self._data[name] = (self._encode(value), item[1] if item else None)
+            return value
+
+    def expire(self, name, seconds):
+        with self._lock:
+            item = self._live(name)
+            if item is None:
+                return False
+            self._data[name] = (item[0], time.monotonic() + seconds)
+            return True
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            item = self._live(name)
+            if item is None:
+                item = self._data[name] = ({}, None)
+            fields = item[0]
+            field = self._encode(key)
+            fields[field] = str(int(fields.get(field, b"0")) + amount).encode()
+            return int(fields[field])
+
+    def hgetall(self, name):
+        with self._lock:
+            item = self._live(name)
+            return {} if item is None else dict(item[0])
+
+    def sadd(self, name, *values):
+        with self._lock:
+            item = self._live(name)
+            if item is None:
+                item = self._data[name] = (set(), None)
+            before = len(item[0])
+            item[0].update(map(self._encode, values))
+            return len(item[0]) - before
+
+    def srem(self, name, *values):
+        with self._lock:
+            item = self._live(name)
+            if item is None:
+                return 0
+            before = len(item[0])
+            item[0].difference_update(map(self._encode, values))
+            return before - len(item[0])
+
+    def smembers(self, name):
+        with self._lock:
+            item = self._live(name)
+            return set() if item is None else set(item[0])
+
+    def setbit(self, name, offset, value):
+        with self._lock:
+            item = self._live(name)
+            bits = bytearray(item[0] if item else b"")
+            byte, mask = offset >> 3, 0x80 >> (offset & 7)
+            if len(bits) <= byte:
+                bits.extend(bytes(byte + 1 - len(bits)))
+            previous = int(bool(bits[byte] & mask))
+            bits[byte] = bits[byte] | mask if value else bits[byte] & ~mask
+            self._data[name] = (bytes(bits), item[1] if item else None)
+            return previous
+
+    def getbit(self, name, offset):
+        with self._lock:
+            item = self._live(name)
+            bits = item[0] if item else b""
+            byte = offset >> 3
+            return int(byte < len(bits) and bool(bits[byte] & (0x80 >> (offset & 7))))
+
+    def bitop(self, operation, dest, *keys):
+        operation = operation.upper()
+        if operation not in ("AND", "OR", "XOR", "NOT") or not keys or (operation == "NOT" and len(keys) != 1):
+            raise redis.ResponseError(f"syntax error in BITOP {operation}")
+        with self._lock:
+            # Missing keys and the tails of shorter values count as zero bytes, as in Redis
+            values = [item[0] if item is not None else b"" for item in map(self._live, keys)]
+            size = max(map(len, values))
+            result = bytearray(values[0].ljust(size, b"\0"))
+            if operation == "NOT":
+                result = bytearray(~byte & 0xFF for byte in result)
+            for value in values[1:]:
+                for i, byte in enumerate(value.ljust(size, b"\0")):
+                    if operation == "AND":
+                        result[i] &= byte
+                    elif operation == "OR":
+                        result[i] |= byte
+                    else:
+                        result[i] ^= byte
+            if result:
+                self._data[dest] = (bytes(result), None)
+            else:
+                self._data.pop(dest, None)
+            return len(result)
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+
+
+class InMemoryPipeline:
+    """Queues InMemoryRedis calls and runs them on execute, like redis.client.Pipeline"""
+
+    def __init__(self, client: InMemoryRedis):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        return [method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+def get_redis():
+    """Return the shared Redis client, or None when no Redis is configured"""
+    if not REDIS_HOST:
+        return None
+    if REDIS_HOST == "memory":
+        return InMemoryRedis()
+    return redis.Redis(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        socket_timeout=0.05,
+        socket_connect_timeout=0.05,
+    )
+
+
+#redirect cache ---------------------------------------------------------------------------
+class RedirectCache:
+    """Read-through key -> target cache: in-process LRU in front of an optional Redis tier.
+
+    Unknown keys are cached as None for a short negative TTL so that repeated
+    misses don't reach the database either.
+    """
+
+    prefix = "redirect:"
+
+    def __init__(
+        self,
+        local: LocalCache,
+        redis_client=None,
+        ttl: int = REDIRECT_CACHE_TTL,
+        negative_ttl: int = REDIRECT_NEGATIVE_TTL,
+    ):
+        self.local = local
+        self.redis = redis_client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Plain counters; racing increments may drop the odd count, which is fine for metrics
+        self.stats = {"local_hit": 0, "redis_hit": 0, "miss": 0}
+
+    def get(self, key: str):
+        """Return a CachedURL, None for a known-missing key, or MISSING"""
+        entry = self.get_local(key)
+        if entry is MISSING and self.redis is not None:
+            entry = self.get_shared(key)
+        return entry
+
+    async def get_async(self, key: str):
+        """get() for async routes: the local tier inline, the Redis round trip off the event loop"""
+        entry = self.get_local(key)
+        if entry is MISSING and self.redis is not None:
+            entry = await run_in_threadpool(self.get_shared, key)
+        return entry
+
+    def get_local(self, key: str):
+        entry = self.local.get(key)
+        if entry is not MISSING:
+            self.stats["local_hit"] += 1
+        elif self.redis is None:
+            self.stats["miss"] += 1
+        return entry
+
+    def get_shared(self, key: str):
+        try:
+            raw = self.redis.get(self.prefix + key)
+        except redis.RedisError:
+            raw = None
+        if raw is None:
+            self.stats["miss"] += 1
+            return MISSING
+        self.stats["redis_hit"] += 1
+        if raw == b"":
+            self.local.set(key, None, self.negative_ttl)
+            return None
+        entry = CachedURL(*json.loads(raw))
+        self.local.set(key, entry)
+        return entry
+
+    def set(self, key: str, entry: CachedURL):
+        self.local.set(key, entry)
+        self._redis_set(key, json.dumps(list(entry)), self.ttl)
+
+    async def set_async(self, key: str, entry: CachedURL):
+        self.local.set(key, entry)
+        if self.redis is not None:
+            await run_in_threadpool(self._redis_set, key, json.dumps(list(entry)), self.ttl)
+
+    def set_missing(self, key: str):
+        self.local.set(key, None, self.negative_ttl)
+        self._redis_set(key, "", self.negative_ttl)
+
+    async def set_missing_async(self, key: str):
+        self.local.set(key, None, self.negative_ttl)
+        if self.redis is not None:
+            await run_in_threadpool(self._redis_set, key, "", self.negative_ttl)
+
+    def invalidate(self, key: str):
+        self.local.delete(key)
+        if self.redis is not None:
+            try:
+                self.redis.delete(self.prefix + key)
+            except redis.RedisError:
+                pass
+
+    def clear(self):
+        self.local.clear()
+
+    def _redis_set(self, key, value, ttl):
+        if self.redis is None:
+            return
+        try:
+            self.redis.set(self.prefix + key, value, ex=ttl)
+        except redis.RedisError:
+            pass
+
+
+redis_client = get_redis()
+redirect_cache = RedirectCache(SharedCache() if REDIRECT_CACHE_SHARED else LocalCache(), redis_client)
@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from itertools import islice
+
+import redis
+from starlette.concurrency import run_in_threadpool
+
+import cache
+import crud
+from workers import PeriodicWorker
+
+
+CLICK_BUFFER = os.getenv("CLICK_BUFFER", "memory")
+CLICK_FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "5"))
+CLICK_BATCH_SIZE = int(os.getenv("CLICK_BATCH_SIZE", "500"))
+# A drain still unfinished after this long is from a worker that died mid-flush
+CLICK_ORPHAN_SECONDS = float(os.getenv("CLICK_ORPHAN_SECONDS", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryClickBuffer:
+    """Per-process click counts waiting to be written"""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, key: str, n: int = 1) -> int:
+        with self._lock:
+            self._counts[key] += n
+            return len(self._counts)
+
+    def drain(self) -> dict:
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        return dict(counts)
+
+
+class RedisClickBuffer:
+    """Click counts shared by every worker and replica in a Redis hash.
+
+    While Redis is unreachable clicks are counted in this process instead
+    and written with the next flush, so redirects never fail on Redis.
+    """
+
+    pending = "clicks:pending"
+    draining = "clicks:draining"
+
+    def __init__(self, client, orphan_seconds: float = CLICK_ORPHAN_SECONDS):
+        self.client = client
+        self.orphan_seconds = orphan_seconds
+        self.fallback = MemoryClickBuffer()
+        self.failing = False
+
+    def add(self, key: str, n: int = 1) -> int:
+        try:
+            self.client.hincrby(self.pending, key, n)
+        except redis.RedisError:
+            if not self.failing:
+                logger.warning("click buffer in Redis unavailable; counting clicks in this process", exc_info=True)
+            self.failing = True
+            return self.fallback.add(key, n)
+        self.failing = False
+        return 0
+
+    def drain(self) -> dict:
+        counts = Counter(self.fallback.drain())
+        try:
+            counts.update(self.recover())
+            counts.update(self.drain_pending())
+        except redis.RedisError:
+            # Whatever was renamed but not read is recovered by a later drain
+            logger.warning("click buffer in Redis unavailable; its counts wait for the next flush", exc_info=True)
+        return dict(counts)
+
+    def drain_pending(self) -> dict:
+        # Renaming is atomic, so increments that land mid-flush go to a fresh hash.
+        # The name is listed first so a crash after the rename leaves it findable
+        name = f"{self.draining}:{time.time():.0f}:{uuid.uuid4().hex}"
+        self.client.sadd(self.draining, name)
+        try:
+            self.client.rename(self.pending, name)
+        except redis.ResponseError:
+            self.client.srem(self.draining, name)
+            return {}
+        return self.take(name)
+
+    def recover(self) -> dict:
+        """Counts from drains that a crashed worker renamed but never finished"""
+        counts = Counter()
+        cutoff = time.time() - self.orphan_seconds
+        for name in self.client.smembers(self.draining):
+            name = name.decode() if isinstance(name, bytes) else name
+            if float(name.split(":")[2]) < cutoff:
+                logger.warning("recovering click counts from unfinished drain %s", name)
+                counts.update(self.take(name))
+        return counts
+
+    def take(self, name: str) -> dict:
+        # One transaction, so of two workers taking the same hash only one gets the counts
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(name)
+        pipe.delete(name)
+        pipe.srem(self.draining, name)
+        counts, _, _ = pipe.execute()
+        return {key.decode(): int(n) for key, n in counts.items()}
+
+
+class ClickAggregator(PeriodicWorker):
+    """Buffers redirect clicks and writes them as batched `clicks = clicks + n` updates"""
+
+    name = "click-aggregator"
+
+    def __init__(
+        self,
+        buffer,
+        session_factory=None,
+        interval: float = CLICK_FLUSH_INTERVAL,
+        batch_size: int = CLICK_BATCH_SIZE,
+    ):
+        super().__init__(interval)
+        self.buffer = buffer
+        self.session_factory = session_factory or crud.SessionLocal
+        self.batch_size = batch_size
+
+    def record(self, key: str):
+        if self.buffer.add(key) >= self.batch_size:
+            self.wake()
+
+    async def record_async(self, key: str):
+        """record() for async routes; a Redis buffer is written off the event loop"""
+        if isinstance(self.buffer, RedisClickBuffer):
+            await run_in_threadpool(self.record, key)
+        else:
+            self.record(key)
+
+    def run_once(self):
+        self.flush()
+
+    def flush(self):
+        counts = self.buffer.drain()
+        items = iter(counts.items())
+        while True:
+            batch = dict(islice(items, self.batch_size))
+            if not batch:
+                break
+            try:
+                db = self.session_factory()
+                try:
+                    crud.add_click_counts(db, batch)
+                finally:
+                    db.close()
+            except Exception:
+                # Put the unwritten counts back so the next flush retries them
+                for key, n in {**batch, **dict(items)}.items():
+                    self.buffer.add(key, n)
+                raise
+
+
+def make_buffer():
+    if CLICK_BUFFER == "redis" and cache.redis_client is not None:
+        return RedisClickBuffer(cache.redis_client)
+    return MemoryClickBuffer()
+
+
+aggregator = ClickAggregator(make_buffer())
@@ -0,0 +1,6 @@
+"""Helpers for reading settings from the environment, for modules that can't import crud"""
+import os
+
+
+def env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
@@ -1,11 +1,24 @@
 # In conftest.py
+import functools
 import pytest
 import os
+
+# Cheap bcrypt rounds keep the suite fast; must be set before auth is imported
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from fastapi.encoders import jsonable_encoder
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from main import app
-from crud import Base, get_db
+from crud import AppSession, Base, get_db, get_read_db, get_session_factory
+import auth
+import cache
+import clicks
+import events
+import expiry
+import idempotency
+import ratelimit
 
 # Use PostgreSQL for testing in CI, SQLite locally
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -19,7 +32,8 @@ else:
         SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
     )
 
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# AppSession so read sessions are routed like the app's when a test configures replicas
+TestingSessionLocal = sessionmaker(class_=AppSession, autocommit=False, autoflush=False, bind=engine)
 
 # This is the fixture that will be used by our tests
 @pytest.fixture()
@@ -35,8 +49,20 @@ def client():
         finally:
             db.close()
 
+    def override_get_read_db():
+        try:
+            db = TestingSessionLocal(info={"read_only": True})
+            yield db
+        finally:
+            db.close()
+
     # Apply the override
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
+    clicks.aggregator.session_factory = TestingSessionLocal
+    events.pipeline.session_factory = TestingSessionLocal
+    expiry.purger.session_factory = TestingSessionLocal
     
     # Yield the client for the test to use
     yield TestClient(app)
@@ -44,5 +70,84 @@ def client():
     # Drop all tables after tests are done to keep it clean
     Base.metadata.drop_all(bind=engine)
     
+    # Forget cached redirects and buffered clicks for the dropped tables
+    cache.redirect_cache.clear()
+    clicks.aggregator.buffer.drain()
+    events.pipeline.buffer.clear()
+    auth.principal_cache.clear()
+    ratelimit.limiter.store.clear()
+    idempotency.store.clear()
+    
     # Clean up dependency overrides
-    app.dependency_overrides.clear()
\ No newline at end of file
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture()
+def auth_headers(client):
+    """Register a user and return the Authorization header for its token"""
+    def headers(username: str = "testuser", password: str = "testpass123") -> dict:
+        user_data = {"username": username, "password": password}
+        client.post("/register", json=user_data)
+        token = client.post("/token", data=user_data).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    return headers
+
+
+@pytest.fixture()
+def shorten(client, auth_headers):
+    """Shorten a link, as the default test user unless given headers, and return its key"""
+    default_headers = functools.lru_cache(maxsize=None)(auth_headers)
+
+    def create(target_url: str = "https://example.com", headers: dict = None, **body) -> str:
+        body = jsonable_encoder({"target_url": target_url, **body})
+        response = client.post("/shorten", json=body, headers=headers or default_headers())
+        assert response.status_code == 200, response.text
+        return response.json()["short_key"]
+    return create
+
+
+@pytest.fixture()
+def db_session(client):
+    """A session on the test database, for asserting on stored rows"""
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@pytest.fixture()
+def async_client(tmp_path):
+    """A client whose routes run on an AsyncSession backed by aiosqlite"""
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    path = tmp_path / "async.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=sync_engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+    async def override_get_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    async def override_get_read_db():
+        async with AsyncTestingSessionLocal(info={"read_only": True}) as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_read_db
+    app.dependency_overrides[get_session_factory] = lambda: AsyncTestingSessionLocal
+    clicks.aggregator.session_factory = sessionmaker(bind=sync_engine)
+    events.pipeline.session_factory = sessionmaker(bind=sync_engine)
+
+    yield TestClient(app)
+
+    app.dependency_overrides.clear()
+    cache.redirect_cache.clear()
+    clicks.aggregator.buffer.drain()
+    events.pipeline.buffer.clear()
+    auth.principal_cache.clear()
+    ratelimit.limiter.store.clear()
+    idempotency.store.clear()
+    sync_engine.dispose()
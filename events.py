@@ -0,0 +1,139 @@
+import os
+import re
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from sqlalchemy import text
+
+import crud
+from workers import PeriodicWorker
+
+
+CLICK_EVENTS = crud.env_flag("CLICK_EVENTS", "true")
+CLICK_EVENT_BUFFER = int(os.getenv("CLICK_EVENT_BUFFER", "100000"))
+CLICK_EVENT_FLUSH_INTERVAL = float(os.getenv("CLICK_EVENT_FLUSH_INTERVAL", "5"))
+CLICK_EVENT_BATCH_SIZE = int(os.getenv("CLICK_EVENT_BATCH_SIZE", "1000"))
+
+BOT = re.compile(r"bot|crawl|spider|slurp|curl|wget|python-|httpx|okhttp", re.IGNORECASE)
+TABLET = re.compile(r"ipad|tablet", re.IGNORECASE)
+MOBILE = re.compile(r"mobi|iphone|android", re.IGNORECASE)
+
+
+def classify_agent(user_agent: str) -> str:
+    """Reduce a User-Agent header to bot/tablet/mobile/desktop/unknown"""
+    if not user_agent:
+        return "unknown"
+    if BOT.search(user_agent):
+        return "bot"
+    if TABLET.search(user_agent):
+        return "tablet"
+    if MOBILE.search(user_agent):
+        return "mobile"
+    return "desktop"
+
+
+def referrer_host(referrer: str) -> str:
+    if not referrer:
+        return "direct"
+    try:
+        return (urlsplit(referrer).hostname or "direct")[:255]
+    except ValueError:
+        return "invalid"
+
+
+class ClickEventPipeline(PeriodicWorker):
+    """Bounded ring buffer of click events drained into click_events and its rollups.
+
+    `record` only appends a tuple to a deque, so the redirect never waits on
+    the database. When the buffer is full the oldest events are overwritten
+    and counted in `dropped`.
+    """
+
+    name = "click-events"
+
+    def __init__(
+        self,
+        session_factory=None,
+        capacity: int = CLICK_EVENT_BUFFER,
+        interval: float = CLICK_EVENT_FLUSH_INTERVAL,
+        batch_size: int = CLICK_EVENT_BATCH_SIZE,
+        enabled: bool = CLICK_EVENTS,
+    ):
+        super().__init__(interval)
+        self.session_factory = session_factory or crud.SessionLocal
+        self.buffer = deque(maxlen=capacity)
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self.dropped = 0
+        self.written = 0
+        self._partitions = set()
+
+    def record(self, key: str, referrer: str = None, user_agent: str = None):
+        if not self.enabled:
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((key, time.time(), referrer and referrer[:512], user_agent and user_agent[:512]))
+
+    def run_once(self):
+        self.flush()
+
+    def flush(self):
+        while self.buffer:
+            batch = []
+            while self.buffer and len(batch) < self.batch_size:
+                batch.append(self.buffer.popleft())
+            try:
+                self._write(batch)
+            except Exception:
+                # Keep the batch for the next pass, oldest first
+                self.buffer.extendleft(reversed(batch))
+                raise
+            self.written += len(batch)
+
+    def _write(self, batch: list):
+        events = []
+        hourly, daily, dimensions = Counter(), Counter(), Counter()
+        for key, ts, referrer, user_agent in batch:
+            occurred_at = datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+            hour = occurred_at.replace(minute=0, second=0, microsecond=0)
+            day = hour.replace(hour=0)
+            host, agent = referrer_host(referrer), classify_agent(user_agent)
+            events.append({"short_key": key, "occurred_at": occurred_at, "referrer": host, "agent": agent})
+            hourly[key, hour] += 1
+            daily[key, day] += 1
+            dimensions[key, day, "referrer", host] += 1
+            dimensions[key, day, "agent", agent] += 1
+
+        db = self.session_factory()
+        try:
+            self._ensure_partitions(db, {event["occurred_at"] for event in events})
+            crud.add_click_events(
+                db,
+                events,
+                [{"short_key": k, "bucket": b, "clicks": n} for (k, b), n in hourly.items()],
+                [{"short_key": k, "bucket": b, "clicks": n} for (k, b), n in daily.items()],
+                [{"short_key": k, "bucket": b, "dimension": d, "value": v, "clicks": n} for (k, b, d, v), n in dimensions.items()],
+            )
+        finally:
+            db.close()
+
+    def _ensure_partitions(self, db, timestamps):
+        """Create the monthly click_events partitions a batch needs (Postgres only)"""
+        if db.get_bind().dialect.name != "postgresql":
+            return
+        for month in {(ts.year, ts.month) for ts in timestamps} - self._partitions:
+            year, number = month
+            start = datetime(year, number, 1)
+            end = datetime(year + number // 12, number % 12 + 1, 1)
+            db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS click_events_{year}_{number:02d} PARTITION OF click_events "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            db.commit()
+            self._partitions.add(month)
+
+
+pipeline = ClickEventPipeline()
@@ -0,0 +1,69 @@
+import os
+from datetime import timedelta
+
+import cache
+import crud
+from workers import PeriodicWorker
+
+
+URL_PURGE = crud.env_flag("URL_PURGE", "true")
+URL_PURGE_INTERVAL = float(os.getenv("URL_PURGE_INTERVAL", "60"))
+URL_PURGE_BATCH_SIZE = int(os.getenv("URL_PURGE_BATCH_SIZE", "500"))
+# Expired links keep answering 410 for this long before their rows are deleted
+URL_PURGE_GRACE = int(os.getenv("URL_PURGE_GRACE", "86400"))
+
+
+class ExpiredURLPurger(PeriodicWorker):
+    """Deletes expired links in small batches, one short transaction per batch.
+
+    A pass stops after `max_batches` so a large backlog is worked off over
+    several intervals instead of in one long burst of deletes.
+    """
+
+    name = "url-purge"
+
+    def __init__(
+        self,
+        session_factory=None,
+        interval: float = URL_PURGE_INTERVAL,
+        batch_size: int = URL_PURGE_BATCH_SIZE,
+        grace: int = URL_PURGE_GRACE,
+        max_batches: int = 20,
+        enabled: bool = URL_PURGE,
+    ):
+        super().__init__(interval)
+        self.session_factory = session_factory or crud.SessionLocal
+        self.batch_size = batch_size
+        self.grace = timedelta(seconds=grace)
+        self.max_batches = max_batches
+        self.enabled = enabled
+        self.purged = 0
+
+    def start(self):
+        if self.enabled:
+            super().start()
+
+    def run_once(self):
+        if self.enabled:
+            self.purge()
+
+    def purge(self) -> int:
+        """Run one pass and return how many links it deleted"""
+        before = crud.utcnow() - self.grace
+        deleted = 0
+        for _ in range(self.max_batches):
+            db = self.session_factory()
+            try:
+                keys = crud.delete_expired_urls(db, before, self.batch_size)
+            finally:
+                db.close()
+            for key in keys:
+                cache.redirect_cache.invalidate(key)
+            deleted += len(keys)
+            self.purged += len(keys)
+            if len(keys) < self.batch_size:
+                break
+        return deleted
+
+
+purger = ExpiredURLPurger()
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+
+import redis
+
+import cache
+
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# How long a request may hold its key before a retry is allowed to take over
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "60"))
+
+
+class KeyInUse(Exception):
+    """Another request with the same Idempotency-Key has not finished yet"""
+
+
+class KeyMismatch(Exception):
+    """The Idempotency-Key was first used with a different request body"""
+
+
+def fingerprint(body: str) -> str:
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Remembers the response to each (scope, Idempotency-Key) so a retry gets it back.
+
+    A key is claimed with a "pending" record before the work starts, so two
+    concurrent retries can't both create a link. In Redis the claim is a SET
+    NX and holds across replicas; without Redis, records live in a local LRU.
+    """
+
+    prefix = "idempotency:"
+
+    def __init__(self, redis_client=None, ttl: int = IDEMPOTENCY_TTL, lock_ttl: int = IDEMPOTENCY_LOCK_TTL):
+        self.redis = redis_client
+        self.local = cache.LocalCache(maxsize=cache.REDIRECT_CACHE_SIZE, ttl=ttl)
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self._lock = threading.Lock()
+
+    def begin(self, scope: str, key: str, fingerprint: str):
+        """Claim the key; return None to go ahead, or the stored response to replay"""
+        name = f"{self.prefix}{scope}:{key}"
+        pending = json.dumps({"fingerprint": fingerprint})
+        if self._claim(name, pending):
+            return None
+        record = self._get(name)
+        if record is None:
+            # Finished and expired between the two calls; try once more
+            if self._claim(name, pending):
+                return None
+            raise KeyInUse(key)
+        if record["fingerprint"] != fingerprint:
+            raise KeyMismatch(key)
+        if "response" not in record:
+            raise KeyInUse(key)
+        return record["response"]
+
+    def complete(self, scope: str, key: str, fingerprint: str, response):
+        self._set(f"{self.prefix}{scope}:{key}", json.dumps({"fingerprint": fingerprint, "response": response}), self.ttl)
+
+    def abandon(self, scope: str, key: str):
+        """Release a claim after a failed request so the client can retry"""
+        name = f"{self.prefix}{scope}:{key}"
+        self.local.delete(name)
+        if self.redis is not None:
+            try:
+                self.redis.delete(name)
+            except redis.RedisError:
+                pass
+
+    def clear(self):
+        self.local.clear()
+
+    def _claim(self, name: str, value: str) -> bool:
+        if self.redis is not None:
+            try:
+                return bool(self.redis.set(name, value, ex=self.lock_ttl, nx=True))
+            except redis.RedisError:
+                # Without the store a retry can't be recognised; serve it like any request
+                return True
+        with self._lock:
+            if self.local.get(name) is not cache.MISSING:
+                return False
+            self.local.set(name, value, self.lock_ttl)
+            return True
+
+    def _get(self, name: str):
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(name)
+            except redis.RedisError:
+                # As in _claim: an unreadable record is treated as no record rather than a 500
+                raw = self.local.get(name, None)
+        else:
+            raw = self.local.get(name, None)
+        return None if raw is None else json.loads(raw)
+
+    def _set(self, name: str, value: str, ttl: int):
+        if self.redis is not None:
+            try:
+                self.redis.set(name, value, ex=ttl)
+            except redis.RedisError:
+                pass
+        else:
+            self.local.set(name, value, ttl)
+
+
+store = IdempotencyStore(cache.redis_client)
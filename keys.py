@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import secrets
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit
+
+from sqlalchemy import insert, update, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import crud
+from crud import URL, URLBase, URLInfo, KeyBlock
+
+
+KEY_STRATEGY = os.getenv("KEY_STRATEGY", "random")
+KEY_BLOCK_SIZE = int(os.getenv("KEY_BLOCK_SIZE", "1000"))
+KEY_MAX_ATTEMPTS = int(os.getenv("KEY_MAX_ATTEMPTS", "5"))
+# Return the caller's existing link when they shorten the same target with the same policy
+SHORTEN_DEDUP = crud.env_flag("SHORTEN_DEDUP")
+
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+KEY_LENGTH = 7
+KEYSPACE = len(ALPHABET) ** KEY_LENGTH
+# Odd and not divisible by 31, so n -> n * MULTIPLIER mod KEYSPACE is a bijection
+# that spreads consecutive ids over the keyspace
+MULTIPLIER = 1_580_030_173
+OFFSET = 916_132_831
+
+
+def create_random_key(length: int = 5) -> str:
+    return secrets.token_urlsafe(length)
+
+
+def encode_base62(n: int, length: int = 0) -> str:
+    chars = []
+    while n:
+        n, digit = divmod(n, 62)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars)).rjust(length, ALPHABET[0]) or ALPHABET[0]
+
+
+def key_for_number(n: int) -> str:
+    """Fixed-length, non-sequential looking key for a unique number below KEYSPACE"""
+    return encode_base62((n * MULTIPLIER + OFFSET) % KEYSPACE, KEY_LENGTH)
+
+
+#strategies -------------------------------------------------------------------------------
+class RandomKeys:
+    """Random keys; the unique index on short_key catches the rare collision"""
+
+    def next_key(self, db: Session):
+        return create_random_key()
+
+    def next_keys(self, db: Session, n: int) -> list:
+        return [create_random_key() for _ in range(n)]
+
+
+class SequenceKeys:
+    """Keys derived from the row id the database assigns on insert"""
+
+    def next_key(self, db: Session):
+        # The key is filled in from the id once the row is flushed
+        return None
+
+    def next_keys(self, db: Session, n: int) -> list:
+        return [None] * n
+
+    def key_for_id(self, id: int) -> str:
+        return key_for_number(id)
+
+
+class BlockKeys:
+    """Keys from id ranges leased per worker, one small write per block"""
+
+    def __init__(self, block_size: int = KEY_BLOCK_SIZE, name: str = "urls"):
+        self.block_size = block_size
+        self.name = name
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_key(self, db: Session):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._lease(db)
+            n = self._next
+            self._next += 1
+        return key_for_number(n)
+
+    def next_keys(self, db: Session, n: int) -> list:
+        return [self.next_key(db) for _ in range(n)]
+
+    def _lease(self, db: Session):
+        # Leased on its own connection so the lease is committed even when
+        # the insert that triggered it is rolled back
+        blocks = KeyBlock.__table__
+        with db.get_bind().begin() as conn:
+            end = conn.execute(
+                update(blocks)
+                .where(blocks.c.name == self.name)
+                .values(next_id=blocks.c.next_id + self.block_size)
+                .returning(blocks.c.next_id)
+            ).scalar()
+            if end is None:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(blocks).values(name=self.name, next_id=self.block_size))
+                except IntegrityError:
+                    # Another worker created the row first
+                    return self._lease(db)
+                end = self.block_size
+        return end - self.block_size, end
+
+
+STRATEGIES = {
+    "random": RandomKeys,
+    "sequence": SequenceKeys,
+    "block": BlockKeys,
+}
+
+if crud.shards and KEY_STRATEGY == "sequence":
+    # Row ids are per shard, so they can't number keys across shards
+    raise RuntimeError("KEY_STRATEGY=sequence can't be used with DATABASE_SHARD_URLS")
+
+generator = STRATEGIES[KEY_STRATEGY]()
+
+
+def target_hash(url: URLBase) -> str:
+    """Dedup key for a shorten request: the normalized target plus its redirect policy"""
+    expires_at = url.expires_at.isoformat() if url.expires_at else None
+    # target_url was normalized when the request was validated; a bare host and its root path are the same page
+    target = urlsplit(url.target_url)
+    fields = [urlunsplit(target._replace(path=target.path or "/")), url.redirect_status, url.cache_max_age, expires_at]
+    return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+def create_url(
+    db: Session,
+    url: str,
+    ownerid: int,
+    keygen=None,
+    redirect_status: int = None,
+    cache_max_age: int = None,
+    expires_at: datetime = None,
+    target_hash: str = None,
+) -> URLInfo:
+    """Insert a new short URL with a fresh key, without checking for the key first.
+
+    A duplicate key surfaces as an IntegrityError from the unique index and
+    the insert is retried with a new key. With a `target_hash` the owner's
+    existing link for it is returned instead, if there is one; a concurrent
+    insert of the same hash also surfaces as an IntegrityError and is
+    resolved the same way.
+    """
+    keygen = keygen or generator
+    if target_hash is not None:
+        existing = crud.get_url_by_target_hash(db, ownerid, target_hash)
+        if existing is not None:
+            return URLInfo.model_validate(existing)
+    for _ in range(KEY_MAX_ATTEMPTS):
+        key = keygen.next_key(db)
+        with crud.url_session(db, key) as url_db:
+            entry = URL(
+                target_url=url,
+                short_key=key,
+                owner_id=ownerid,
+                clicks=0,
+                redirect_status=redirect_status,
+                cache_max_age=cache_max_age,
+                expires_at=expires_at,
+                target_hash=target_hash,
+            )
+            url_db.add(entry)
+            try:
+                url_db.flush()
+                if entry.short_key is None:
+                    entry.short_key = keygen.key_for_id(entry.id)
+                    url_db.flush()
+                info = URLInfo.model_validate(entry)
+                url_db.commit()
+            except IntegrityError:
+                url_db.rollback()
+                existing = target_hash and crud.get_url_by_target_hash(db, ownerid, target_hash)
+                if existing:
+                    return URLInfo.model_validate(existing)
+                continue
+        return info
+    raise RuntimeError(f"could not generate a unique key in {KEY_MAX_ATTEMPTS} attempts")
+
+
+def create_urls(
+    db: Session,
+    targets: list,
+    ownerid: int,
+    keygen=None,
+) -> list:
+    """Insert a chunk of short URLs with one multi-row INSERT and return their rows.
+
+    Each target is a URL string or a dict of URL column values. Keys for the
+    whole chunk are generated up front; if any of them is already taken the
+    chunk is rolled back and retried with new keys. With shards there is one
+    INSERT per shard, and only the rows of a shard that hit a taken key are
+    retried.
+    """
+    keygen = keygen or generator
+    rows = [
+        {
+            "redirect_status": None,
+            "cache_max_age": None,
+            "expires_at": None,
+            **({"target_url": target} if isinstance(target, str) else target),
+            "short_key": key,
+            "owner_id": ownerid,
+            "clicks": 0,
+        }
+        for target, key in zip(targets, keygen.next_keys(db, len(targets)))
+    ]
+    pending = rows
+    for _ in range(KEY_MAX_ATTEMPTS):
+        failed = []
+        if crud.sharded(db):
+            for shard, shard_rows in crud.shards.group(pending, key=lambda row: row["short_key"]).items():
+                with crud.shards.session(shard) as shard_db:
+                    if not insert_rows(shard_db, shard_rows, keygen):
+                        failed += shard_rows
+        elif not insert_rows(db, pending, keygen):
+            failed = pending
+        if not failed:
+            return rows
+        for row, key in zip(failed, keygen.next_keys(db, len(failed))):
+            row["short_key"] = key
+        pending = failed
+    raise RuntimeError(f"could not generate unique keys in {KEY_MAX_ATTEMPTS} attempts")
+
+
+def insert_rows(db: Session, rows: list, keygen) -> bool:
+    """INSERT rows in one statement, filling in their ids; False if a key was taken"""
+    urls = URL.__table__
+    try:
+        created = db.execute(
+            insert(urls).returning(urls.c.id, urls.c.short_key, sort_by_parameter_order=True),
+            rows,
+        ).all()
+        for row, (id, key) in zip(rows, created):
+            row["id"] = id
+            if key is None:
+                row["short_key"] = keygen.key_for_id(id)
+        if any(key is None for _, key in created):
+            db.execute(
+                update(urls).where(urls.c.id == bindparam("b_id")).values(short_key=bindparam("b_key")),
+                [{"b_id": row["id"], "b_key": row["short_key"]} for row in rows],
+            )
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return True
@@ -1,21 +1,75 @@
-import secrets
-from fastapi import FastAPI, Depends, HTTPException, status
+import asyncio
+import csv
+import functools
+import io
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Literal, Optional
+from urllib.parse import quote
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse, FileResponse
+from fastapi.responses import RedirectResponse, FileResponse, StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 import crud
-from crud import User, UserCreate, TOKEN, Base, engine
+import keys
+import cache
+import bloom
+import clicks
+import events
+import expiry
+import idempotency
+import metrics
+import ratelimit
+import snapshot
+import targets
+import warmup
+from crud import User, UserCreate, TOKEN, Base
 import auth
-from auth import SECRET_KEY, ALGORITHM
 import jwt
 
 
 
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+REDIRECT_PREBUILT = crud.env_flag("REDIRECT_PREBUILT")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clicks.aggregator.start()
+    events.pipeline.start()
+    expiry.purger.start()
+    crud.replica_health.start()
+    snapshot.watcher.start()
+    targets.watcher.start()
+    # Redirects pass every key through the filter until this scan finishes
+    threading.Thread(target=bloom.key_filter.build, name="key-filter-build", daemon=True).start()
+    # Serve liveness right away; /readyz turns 200 once this finishes
+    warming = asyncio.create_task(warmup.warmup.run())
+    yield
+    warming.cancel()
+    # Flush whatever clicks and events are still buffered
+    clicks.aggregator.stop()
+    events.pipeline.stop()
+    expiry.purger.stop()
+    crud.replica_health.stop()
+    snapshot.watcher.stop()
+    targets.watcher.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(ratelimit.RateLimitMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -26,12 +80,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(auth.HasherBusy)
+async def hasher_busy_handler(request: Request, exc: auth.HasherBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(crud.get_db)
+    db: Session = Depends(crud.get_read_session)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -39,43 +101,68 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = auth.decode_access_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
 
-    current_user = crud.get_user_by_username(db, name=username) 
-    if current_user is None:
+    version = await auth.principal_version_async(username)
+    current_user = auth.get_cached_principal(payload, version)
+    if current_user is not None:
+        return current_user
+    registered = await crud.run_read(db, crud.get_user_by_username, name=username)
+    if registered is None:
         raise credentials_exception
+    current_user = User.model_validate(registered)
+    auth.cache_principal(payload, current_user, version)
     return current_user
 
-def create_random_key(length: int = 5) -> str:
-    return secrets.token_urlsafe(length)
+async def get_rate_limited_user(current_user: crud.User = Depends(get_current_user)):
+    """get_current_user, plus the per-user limit for routes that write"""
+    await ratelimit.limit_user(current_user)
+    return current_user
 
 
 @app.get("/")
 def root():
     return FileResponse("static/index.html")
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+@app.get("/healthz", include_in_schema=False)
+def liveness():
+    """The process is up and serving; never touches the database"""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+def readiness():
+    """200 once warmup has finished, so traffic only reaches warm workers"""
+    body = {**warmup.warmup.status(), "key_filter_ready": bloom.key_filter.ready}
+    return JSONResponse(body, status_code = 200 if warmup.warmup.ready else 503)
+
 @app.post("/register", response_model=User)
-def register(
+async def register(
     user: UserCreate, 
-    db: Session = Depends(crud.get_db)
+    db: Session = Depends(crud.get_session)
 ):
-    if crud.get_user_by_username(db, name = user.username) is not None:
+    if await crud.run(db, crud.get_user_by_username, name = user.username) is not None:
         raise HTTPException(status_code = 400, detail = "Username already taken")
-    registered = crud.create_user(db, user)
+    hashed_password = await auth.hasher.hash(user.password)
+    registered = await crud.run(db, crud.create_user, user, hashed_password=hashed_password)
     return registered
 
 @app.post("/token", response_model = TOKEN)
-def login(
+async def login(
     newuser: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(crud.get_db)
+    db: Session = Depends(crud.get_read_session)
 ):
-    registered = crud.get_user_by_username(db, name = newuser.username)
-    if registered is not None and auth.verify_password(plain_password = newuser.password, hashed_password = registered.hashed_password):
+    registered = await crud.run_read(db, crud.get_user_by_username, name = newuser.username)
+    if registered is not None and await auth.hasher.verify(newuser.password, registered.hashed_password):
         return {"access_token": auth.create_access_token(newuser.username), "token_type": "bearer"}
         
     raise HTTPException(
@@ -84,27 +171,236 @@ def login(
             headers={"WWW-Authenticate": "Bearer"},
         )
         
+def note_created(user_id: int, short_keys: list):
+    """Key filter and read-your-writes bookkeeping for new links; both may call Redis, so run it in the threadpool"""
+    bloom.key_filter.add(*short_keys)
+    crud.note_write(user_id)
+
 @app.post("/shorten")
-def receive_url(
+async def receive_url(
     url: crud.URLBase,
-    current_user: crud.User = Depends(get_current_user),
-    db: Session = Depends(crud.get_db)
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    current_user: crud.User = Depends(get_rate_limited_user),
+    db: Session = Depends(crud.get_session)
 ):
-    key = create_random_key()
-    while crud.get_url_by_key(db, key) is not None:
-        key = create_random_key()
-    entry = crud.create_db_url(db, url=url.target_url, key=key, ownerid = current_user.id)
+    if idempotency_key is not None:
+        scope, fingerprint = f"user:{current_user.id}", idempotency.fingerprint(url.model_dump_json())
+        try:
+            replay = await run_in_threadpool(idempotency.store.begin, scope, idempotency_key, fingerprint)
+        except idempotency.KeyInUse:
+            raise HTTPException(status_code = 409, detail = "A request with this Idempotency-Key is in progress")
+        except idempotency.KeyMismatch:
+            raise HTTPException(status_code = 422, detail = "Idempotency-Key was already used for a different request")
+        if replay is not None:
+            return JSONResponse(replay, headers = {"Idempotent-Replayed": "true"})
+    try:
+        entry = await crud.run(
+            db, keys.create_url, url=url.target_url, ownerid = current_user.id,
+            redirect_status=url.redirect_status, cache_max_age=url.cache_max_age, expires_at=url.expires_at,
+            target_hash=keys.target_hash(url) if keys.SHORTEN_DEDUP else None,
+        )
+    except Exception:
+        if idempotency_key is not None:
+            await run_in_threadpool(idempotency.store.abandon, scope, idempotency_key)
+        raise
+    await cache.redirect_cache.set_async(entry.short_key, cache.CachedURL.from_url(entry))
+    await run_in_threadpool(note_created, current_user.id, [entry.short_key])
+    if idempotency_key is not None:
+        await run_in_threadpool(idempotency.store.complete, scope, idempotency_key, fingerprint, jsonable_encoder(entry))
     return entry
 
+async def iter_ndjson(request: Request):
+    line, buffer = 0, b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for raw in lines:
+            line += 1
+            if raw.strip():
+                yield line, raw
+    if buffer.strip():
+        yield line + 1, buffer
+
+async def read_bulk_items(request: Request) -> list:
+    """Return (line, item) pairs from an NDJSON stream or a JSON array body"""
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        return [pair async for pair in iter_ndjson(request)]
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        items = None
+    if not isinstance(items, list):
+        raise HTTPException(status_code = 422, detail = "Body must be a JSON array or NDJSON")
+    return list(enumerate(items, start=1))
+
+def parse_bulk_item(item) -> dict:
+    if isinstance(item, bytes):
+        item = json.loads(item)
+    if isinstance(item, str):
+        item = {"target_url": item}
+    return crud.URLBase.model_validate(item).model_dump()
+
+@app.post("/shorten/bulk")
+async def receive_urls_bulk(
+    request: Request,
+    current_user: crud.User = Depends(get_rate_limited_user),
+    session_factory = Depends(crud.get_session_factory)
+):
+    """Shorten many URLs in one request, streaming back one NDJSON line per input item"""
+    # The body is read before the response starts; the inserts are streamed
+    lines, targets, errors = [], [], []
+    for line, item in await read_bulk_items(request):
+        try:
+            targets.append(parse_bulk_item(item))
+            lines.append(line)
+        except ValidationError as exc:
+            error = exc.errors()[0]
+            errors.append(json.dumps({"line": line, "error": f"{'.'.join(map(str, error['loc']))}: {error['msg']}"}) + "\n")
+        except ValueError as exc:
+            errors.append(json.dumps({"line": line, "error": str(exc).splitlines()[0]}) + "\n")
+
+    async def results():
+        if errors:
+            yield "".join(errors)
+        async with crud.open_session(session_factory) as db:
+            for start in range(0, len(targets), BULK_CHUNK_SIZE):
+                chunk = slice(start, start + BULK_CHUNK_SIZE)
+                entries = await crud.run(db, keys.create_urls, targets=targets[chunk], ownerid = current_user.id)
+                await run_in_threadpool(note_created, current_user.id, [entry["short_key"] for entry in entries])
+                yield "".join(
+                    json.dumps({"line": line, "id": entry["id"], "short_key": entry["short_key"], "target_url": entry["target_url"]}) + "\n"
+                    for line, entry in zip(lines[chunk], entries)
+                )
+
+    return StreamingResponse(results(), media_type = "application/x-ndjson")
+
+@app.get("/urls", response_model = crud.URLPage)
+async def list_my_urls(
+    sort: Literal["created", "clicks"] = "created",
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: crud.User = Depends(get_current_user),
+    db: Session = Depends(crud.get_read_session)
+):
+    """The caller's links, newest (or most clicked) first; pass next_cursor to get the next page"""
+    if await run_in_threadpool(crud.wrote_recently, current_user.id):
+        crud.use_primary(db)
+    try:
+        return await crud.run(db, crud.list_urls, current_user.id, sort, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code = 400, detail = "Invalid cursor")
+
+@app.get("/urls/export")
+async def export_my_urls(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    current_user: crud.User = Depends(get_current_user),
+    session_factory = Depends(crud.get_read_session_factory)
+):
+    """Stream all of the caller's links, fetched page by page so memory stays flat"""
+    read_primary = await run_in_threadpool(crud.wrote_recently, current_user.id)
+    async def rows():
+        if format == "csv":
+            yield "id,short_key,target_url,clicks\r\n"
+        async with crud.open_session(session_factory) as db:
+            if read_primary:
+                crud.use_primary(db)
+            cursor = None
+            while True:
+                page = await crud.run(db, crud.list_urls, current_user.id, "created", EXPORT_PAGE_SIZE, cursor)
+                if format == "csv":
+                    out = io.StringIO()
+                    csv.writer(out).writerows((u.id, u.short_key, u.target_url, u.clicks) for u in page.items)
+                    yield out.getvalue()
+                else:
+                    yield "".join(u.model_dump_json() + "\n" for u in page.items)
+                if page.next_cursor is None:
+                    break
+                cursor = page.next_cursor
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="urls.{format}"'}
+    return StreamingResponse(rows(), media_type = media_type, headers = headers)
+
+@app.get("/stats/{key}", response_model = crud.ClickStats)
+async def link_stats(
+    key: str,
+    granularity: Literal["hour", "day"] = "day",
+    days: int = Query(30, ge=1, le=366),
+    current_user: crud.User = Depends(get_current_user),
+    db: Session = Depends(crud.get_read_session)
+):
+    """Clicks over time plus top referrers and agents for one of the caller's links"""
+    url = await crud.run_read(db, crud.get_url_by_key, key)
+    if url is None or url.owner_id != current_user.id:
+        raise HTTPException(status_code = 404, detail = "URL not found")
+    # Start on a bucket boundary so the first bucket in the window is counted
+    since = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    if granularity == "day":
+        since = since.replace(hour=0)
+    return await crud.run(db, crud.get_click_stats, key, granularity, since)
+
+def redirect_headers(entry: cache.CachedURL) -> tuple:
+    """Encoded response headers for a redirect, as RedirectResponse would build them"""
+    headers = [
+        (b"content-length", b"0"),
+        (b"location", quote(entry.target_url, safe=":/%#?=@[]!$&'()*+,;").encode("latin-1")),
+    ]
+    if entry.max_age is not None:
+        headers.append((b"cache-control", f"public, max-age={entry.max_age}".encode("latin-1")))
+    return tuple(headers)
+
+# Header bytes for hot keys, built once and reused for every redirect
+prebuilt_headers = functools.lru_cache(maxsize=cache.REDIRECT_CACHE_SIZE)(redirect_headers)
+
+class PrebuiltRedirect(Response):
+    """Redirect whose header block comes from prebuilt_headers instead of being rebuilt"""
+
+    def __init__(self, entry: cache.CachedURL):
+        self.status_code = entry.status
+        self.body = b""
+        self.background = None
+        # A fresh list: middleware may append headers to it
+        self.raw_headers = list(prebuilt_headers(entry))
+
+def redirect_response(entry: cache.CachedURL) -> Response:
+    if REDIRECT_PREBUILT:
+        return PrebuiltRedirect(entry)
+    headers = {"Cache-Control": f"public, max-age={entry.max_age}"} if entry.max_age is not None else None
+    return RedirectResponse(entry.target_url, status_code = entry.status, headers = headers)
+
 @app.get("/{key}")
-def forward_to_target_url(
+async def forward_to_target_url(
     key: str,
-    db: Session = Depends(crud.get_db)
+    request: Request,
+    db: Session = Depends(crud.get_read_session)
 ):
-    url = crud.get_url_by_key(db, key)
-    if url:
-        # Increment click count
-        crud.increment_click_count(db, key)
-        return RedirectResponse(url.target_url)
-    else:
+    # Keys in the snapshot are answered from the shared mapping; newer ones go on to the cache and database
+    # Anything that may wait on Redis goes through an _async variant that calls it off the event loop
+    entry = snapshot.store.get(key)
+    if entry is cache.MISSING:
+        entry = await cache.redirect_cache.get_async(key)
+    if entry is cache.MISSING and not await bloom.key_filter.might_contain_async(key):
+        entry = None
+    elif entry is cache.MISSING:
+        url = await crud.run_read(db, crud.get_url_by_key, key)
+        if url is None:
+            bloom.key_filter.false_positive()
+            await cache.redirect_cache.set_missing_async(key)
+            entry = None
+        else:
+            entry = cache.CachedURL.from_url(url)
+            await cache.redirect_cache.set_async(key, entry)
+    if entry is None:
+        metrics.NOT_FOUND.inc()
         raise HTTPException(status_code = 404, detail = "URL not found")
+    if entry.expires_at is not None:
+        remaining = entry.expires_at - time.time()
+        if remaining <= 0:
+            raise HTTPException(status_code = 410, detail = "URL has expired")
+        if entry.max_age is not None and entry.max_age > remaining:
+            # Don't let browsers and proxies keep the redirect past its expiry
+            entry = entry._replace(max_age = int(remaining))
+    # Count the click; the aggregator writes it in the background
+    await clicks.aggregator.record_async(key)
+    events.pipeline.record(key, request.headers.get("referer"), request.headers.get("user-agent"))
+    return redirect_response(entry)
@@ -0,0 +1,152 @@
+import time
+
+from prometheus_client import Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import auth
+import bloom
+import cache
+import crud
+import events
+import expiry
+import ratelimit
+import snapshot
+import targets
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route template",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+NOT_FOUND = Counter("redirect_not_found_total", "Redirect requests for unknown keys")
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Database statement latency by statement type",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+#requests ---------------------------------------------------------------------------------
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request against its route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], route.path if route is not None else "unmatched"
+            ).observe(time.perf_counter() - start)
+
+
+#database ---------------------------------------------------------------------------------
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_QUERY_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+
+@event.listens_for(Engine, "handle_error")
+def _drop_query_timer(context):
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+#gauges read at scrape time ---------------------------------------------------------------
+class StateCollector:
+    """Publishes pool, cache, snapshot, key filter, click event, purge, target check, rate limit and password hasher state when scraped"""
+
+    pool_fields = ("size", "checked_out", "overflow")
+    pool_counters = ("checkouts", "checkout_timeouts", "wait_seconds_total", "held_seconds_total")
+
+    def collect(self):
+        pools = crud.pool_stats()
+        for field in self.pool_fields:
+            gauge = GaugeMetricFamily(f"db_pool_{field}", f"Connection pool {field}", labels=["url"])
+            for pool in pools:
+                if field in pool:
+                    gauge.add_metric([pool["url"]], pool[field])
+            yield gauge
+        for field in self.pool_counters:
+            counter = CounterMetricFamily(f"db_pool_{field}", f"Connection pool {field}", labels=["url"])
+            for pool in pools:
+                if field in pool:
+                    counter.add_metric([pool["url"]], pool[field])
+            yield counter
+
+        lookups = CounterMetricFamily("redirect_cache_lookups", "Redirect cache lookups by result", labels=["result"])
+        for result, count in cache.redirect_cache.stats.items():
+            lookups.add_metric([result], count)
+        yield lookups
+
+        snapshot_lookups = CounterMetricFamily("redirect_snapshot_lookups", "Redirect snapshot lookups by result", labels=["result"])
+        for result in ("hits", "misses"):
+            snapshot_lookups.add_metric([result], snapshot.store.stats[result])
+        yield snapshot_lookups
+        yield CounterMetricFamily("redirect_snapshot_reloads", "Redirect snapshots swapped in", value=snapshot.store.stats["reloads"])
+        current = snapshot.store.current
+        yield GaugeMetricFamily("redirect_snapshot_links", "Links in the served redirect snapshot", value=len(current) if current else 0)
+
+        checks = CounterMetricFamily("key_filter_checks", "Key filter checks on cache misses by result", labels=["result"])
+        for result, count in bloom.key_filter.stats.items():
+            checks.add_metric([result], count)
+        yield checks
+        key_filter = bloom.key_filter.bloom
+        yield GaugeMetricFamily("key_filter_keys", "Short keys added to the key filter", value=key_filter.count)
+        yield GaugeMetricFamily("key_filter_memory_bytes", "Size of the key filter bitmap", value=key_filter.memory_bytes)
+        yield GaugeMetricFamily(
+            "key_filter_false_positive_rate", "Estimated key filter false positive rate", value=key_filter.false_positive_rate()
+        )
+
+        yield GaugeMetricFamily("click_events_buffered", "Click events waiting to be written", value=len(events.pipeline.buffer))
+        yield CounterMetricFamily("click_events_dropped", "Click events overwritten in a full buffer", value=events.pipeline.dropped)
+        yield CounterMetricFamily("click_events_written", "Click events written to the database", value=events.pipeline.written)
+        yield CounterMetricFamily("urls_purged", "Expired links deleted by the purge worker", value=expiry.purger.purged)
+
+        target_checks = CounterMetricFamily("target_url_checks", "Submitted target URLs by validation result", labels=["result"])
+        for result, count in targets.stats.items():
+            target_checks.add_metric([result], count)
+        yield target_checks
+        for name, domains in (("blocklist", targets.blocklist), ("allowlist", targets.allowlist)):
+            yield GaugeMetricFamily(f"target_{name}_domains", f"Domains in the target {name}", value=len(domains))
+
+        limited = CounterMetricFamily("rate_limited_requests", "Requests refused with 429 by limit", labels=["scope"])
+        for scope, count in ratelimit.limiter.stats.items():
+            limited.add_metric([scope], count)
+        yield limited
+
+        hasher = auth.hasher.stats()
+        yield GaugeMetricFamily("password_hash_queue_depth", "Hash jobs waiting for a worker", value=hasher["queue_depth"])
+        yield GaugeMetricFamily("password_hash_in_flight", "Hash jobs admitted to the pool", value=hasher["in_flight"])
+        yield CounterMetricFamily("password_hash_jobs", "Completed hash jobs", value=hasher["completed"])
+        yield CounterMetricFamily("password_hash_rejected", "Hash jobs refused with 503", value=hasher["rejected"])
+        yield CounterMetricFamily("password_hash_seconds", "Total time spent in hash jobs", value=hasher["seconds_total"])
+
+
+REGISTRY.register(StateCollector())
+
+
+def render():
+    """Return the exposition body and its content type"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,187 @@
+import ipaddress
+import logging
+import math
+import os
+import threading
+import time
+
+import redis
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+import cache
+import crud
+
+
+RATE_LIMITS = crud.env_flag("RATE_LIMITS", "true")
+# "redis" shares the counters between replicas when REDIS_HOST is set
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "redis")
+# "<requests>/<seconds>". Per client address: behind a proxy (nginx in docker-compose,
+# the ingress controller in deployment.yml) set RATE_LIMIT_TRUST_PROXY and
+# RATE_LIMIT_PROXIES below, or every client shares the proxy's address and one limit
+RATE_LIMIT_IP = os.getenv("RATE_LIMIT_IP", "30/60")
+RATE_LIMIT_USER = os.getenv("RATE_LIMIT_USER", "120/60")
+# Behind nginx the peer address is the proxy; take the client from X-Real-IP instead.
+# Off by default: anyone who can reach uvicorn directly could send a new X-Real-IP
+# with each request and never be limited
+RATE_LIMIT_TRUST_PROXY = crud.env_flag("RATE_LIMIT_TRUST_PROXY")
+# Addresses or networks of the proxies whose X-Real-IP is believed, comma-separated
+RATE_LIMIT_PROXIES = os.getenv("RATE_LIMIT_PROXIES", "127.0.0.1,::1")
+RATE_LIMIT_TRACKED = int(os.getenv("RATE_LIMIT_TRACKED", "100000"))
+
+# Per-IP limits cover the routes that hash passwords or insert links
+IP_LIMITED_PATHS = frozenset({"/register", "/token", "/shorten", "/shorten/bulk"})
+
+logger = logging.getLogger(__name__)
+
+
+def parse_networks(value: str) -> list:
+    """Parse "10.0.0.0/8, 127.0.0.1" into ip_network objects"""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+def parse_limit(value: str) -> tuple:
+    """Parse "30/60" into (30, 60.0)"""
+    requests, _, seconds = value.partition("/")
+    return int(requests), float(seconds or 60)
+
+
+class MemoryRateStore:
+    """Per-process window counters, bounded to the most recently seen clients"""
+
+    def __init__(self, maxsize: int = RATE_LIMIT_TRACKED):
+        self.windows = cache.LocalCache(maxsize=maxsize, ttl=math.inf)
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, window: int, seconds: float) -> tuple:
+        """Count a request in `window` and return (this window's count, the previous window's count)"""
+        with self._lock:
+            index, current, previous = self.windows.get(key, (window, 0, 0))
+            if index != window:
+                current, previous = 0, current if index == window - 1 else 0
+            current += 1
+            self.windows.set(key, (window, current, previous))
+            return current, previous
+
+    def clear(self):
+        self.windows.clear()
+
+
+class RedisRateStore:
+    """Window counters in Redis; INCR makes every hit atomic across replicas"""
+
+    prefix = "ratelimit:"
+
+    def __init__(self, client):
+        self.redis = client
+
+    def hit(self, key: str, window: int, seconds: float) -> tuple:
+        name = f"{self.prefix}{key}:"
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.incr(f"{name}{window}")
+        pipe.expire(f"{name}{window}", math.ceil(seconds * 2))
+        pipe.get(f"{name}{window - 1}")
+        current, _, previous = pipe.execute()
+        return int(current), int(previous or 0)
+
+    def clear(self):
+        pass
+
+
+class RateLimiter:
+    """Sliding-window rate limiter over fixed window counters.
+
+    The count for the last `seconds` is estimated as this window's hits plus
+    the previous window's hits weighted by how much of it still overlaps, so
+    each check is one counter update and one read, with no database access.
+    """
+
+    def __init__(self, store, enabled: bool = RATE_LIMITS):
+        self.store = store
+        self.enabled = enabled
+        self.stats = {"ip": 0, "user": 0}
+
+    def check(self, scope: str, key: str, limit: tuple, now: float = None) -> float:
+        """Count a request; return 0 if it is allowed, else seconds until it would be"""
+        if not self.enabled:
+            return 0
+        requests, seconds = limit
+        window, offset = divmod(time.time() if now is None else now, seconds)
+        try:
+            current, previous = self.store.hit(f"{scope}:{key}", int(window), seconds)
+        except redis.RedisError:
+            logger.warning("rate limit store unavailable; letting the request through")
+            return 0
+        if previous * (1 - offset / seconds) + current <= requests:
+            return 0
+        self.stats[scope] += 1
+        return max(1, math.ceil(seconds - offset))
+
+    async def check_async(self, scope: str, key: str, limit: tuple) -> float:
+        """check() for async callers; a Redis store is called off the event loop"""
+        if self.enabled and isinstance(self.store, RedisRateStore):
+            return await run_in_threadpool(self.check, scope, key, limit)
+        return self.check(scope, key, limit)
+
+
+def retry_headers(retry_after: float) -> dict:
+    return {"Retry-After": str(int(retry_after))}
+
+
+def trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(scope) -> str:
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    # X-Real-IP is only as good as whoever set it, so only a known proxy is believed
+    if RATE_LIMIT_TRUST_PROXY and trusted_proxy(peer):
+        for name, value in scope["headers"]:
+            if name == b"x-real-ip":
+                return value.decode("latin-1")
+    return peer
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying the per-IP limit to IP_LIMITED_PATHS"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in IP_LIMITED_PATHS:
+            retry_after = await limiter.check_async("ip", client_ip(scope), IP_LIMIT)
+            if retry_after:
+                response = JSONResponse(
+                    {"detail": "Too many requests"}, status.HTTP_429_TOO_MANY_REQUESTS, retry_headers(retry_after)
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+async def limit_user(user: crud.User):
+    """Raise 429 when `user` is over the per-principal limit"""
+    retry_after = await limiter.check_async("user", str(user.id), USER_LIMIT)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests", headers=retry_headers(retry_after)
+        )
+
+
+def make_store():
+    if RATE_LIMIT_STORE == "redis" and cache.redis_client is not None:
+        return RedisRateStore(cache.redis_client)
+    return MemoryRateStore()
+
+
+TRUSTED_PROXIES = parse_networks(RATE_LIMIT_PROXIES)
+IP_LIMIT = parse_limit(RATE_LIMIT_IP)
+USER_LIMIT = parse_limit(RATE_LIMIT_USER)
+limiter = RateLimiter(make_store())
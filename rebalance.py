@@ -0,0 +1,155 @@
+"""Move links onto the shard their key hashes to after the shard layout changes.
+
+Run it with the new layout in DATABASE_SHARD_URLS and the old one in
+DATABASE_SHARD_URLS_PREVIOUS; the app needs both settings for as long as
+this runs, so redirects look for a key on its old shard too. To shard an
+existing single database, give DATABASE_URL as the only previous shard.
+
+Every shard is scanned by id in batches. Rows whose key now belongs on
+another shard are copied there and then deleted here, one batch per
+transaction on each side. The last id scanned on each shard is written to
+--state after every batch, so an interrupted run picks up where it stopped,
+and --rate caps how many rows are moved per second. A key that is already
+on its new shard as a different link (created there during the run) is a
+conflict: the row is left where it is and reported, never deleted.
+
+    DATABASE_SHARD_URLS=a=...,b=...,c=... DATABASE_SHARD_URLS_PREVIOUS=a=...,b=... \\
+        python rebalance.py --create-schema --rate 2000 --state rebalance.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from sqlalchemy import delete, insert, select
+
+import crud
+
+
+logger = logging.getLogger(__name__)
+
+# What makes a copy on the target the same link; clicks keep changing once it is there
+IDENTITY = ("target_url", "owner_id", "created_at")
+
+
+class Rebalancer:
+    def __init__(self, shards, batch_size: int = 1000, rate: float = None, state_path: str = None):
+        self.shards = shards
+        self.batch_size = batch_size
+        self.rate = rate
+        self.state_path = state_path
+        self.state = self.load_state()
+        self.moved = 0
+        # (shard name, id, short_key) of rows left in place because their key means another link on the target
+        self.conflicts = []
+
+    def load_state(self) -> dict:
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {}
+
+    def save_state(self):
+        if self.state_path:
+            with open(self.state_path + ".tmp", "w") as f:
+                json.dump(self.state, f)
+            os.replace(self.state_path + ".tmp", self.state_path)
+
+    def run(self, max_batches: int = None) -> int:
+        """Scan every shard, moving misplaced rows; return how many were moved"""
+        batches = 0
+        for shard in self.shards:
+            while max_batches is None or batches < max_batches:
+                started = time.monotonic()
+                scanned, moved = self.move_batch(shard)
+                batches += 1
+                if not scanned:
+                    break
+                if self.rate and moved:
+                    time.sleep(max(0.0, moved / self.rate - (time.monotonic() - started)))
+        return self.moved
+
+    def move_batch(self, shard) -> tuple:
+        """Move the misplaced rows among the next batch on `shard`; return (scanned, moved)"""
+        urls = crud.URL.__table__
+        last_id = self.state.get(shard.name, 0)
+        with self.shards.session(shard) as source:
+            rows = source.execute(
+                select(urls).where(urls.c.id > last_id).order_by(urls.c.id).limit(self.batch_size)
+            ).all()
+            if not rows:
+                return 0, 0
+            misplaced = [row for row in rows if self.shards.for_key(row.short_key) is not shard]
+            conflicts = set()
+            for target, target_rows in self.shards.group(misplaced, key=lambda row: row.short_key).items():
+                conflicts.update(self.copy(target, target_rows))
+            moved = [row for row in misplaced if row.id not in conflicts]
+            if moved:
+                # Only after the copies are committed, so a crash in between leaves duplicates, never gaps
+                source.execute(delete(urls).where(urls.c.id.in_([row.id for row in moved])))
+                source.commit()
+        for row in misplaced:
+            if row.id in conflicts:
+                logger.warning("%s: kept id %d, key %r is another link on %s", shard.name, row.id, row.short_key, self.shards.for_key(row.short_key).name)
+                self.conflicts.append((shard.name, row.id, row.short_key))
+        self.state[shard.name] = rows[-1].id
+        self.save_state()
+        self.moved += len(moved)
+        logger.info("%s: scanned up to id %d, moved %d", shard.name, rows[-1].id, len(moved))
+        return len(rows), len(moved)
+
+    def copy(self, target, rows: list) -> set:
+        """Insert rows on `target` under new ids; return the ids of rows whose key is a different link there.
+
+        A key already on `target` as the same link was copied by an interrupted run and is skipped.
+        """
+        urls = crud.URL.__table__
+        with self.shards.session(target) as db:
+            present = {
+                row.short_key: row
+                for row in db.execute(
+                    select(urls.c.short_key, *(urls.c[name] for name in IDENTITY))
+                    .where(urls.c.short_key.in_([row.short_key for row in rows]))
+                )
+            }
+            conflicts = {
+                row.id
+                for row in rows
+                if row.short_key in present
+                and any(getattr(row, name) != getattr(present[row.short_key], name) for name in IDENTITY)
+            }
+            values = [
+                {name: value for name, value in row._mapping.items() if name != "id"}
+                for row in rows
+                if row.short_key not in present
+            ]
+            if values:
+                db.execute(insert(urls), values)
+            db.commit()
+        return conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--rate", type=float, help="most rows to move per second (default: no limit)")
+    parser.add_argument("--state", help="checkpoint file to resume from and update")
+    parser.add_argument("--create-schema", action="store_true", help="create the urls table on shards that lack it")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if not crud.shards:
+        parser.error("DATABASE_SHARD_URLS is not set")
+    if args.create_schema:
+        crud.create_shard_schema()
+    rebalancer = Rebalancer(crud.shards, args.batch_size, args.rate, args.state)
+    moved = rebalancer.run()
+    logger.info("moved %d links", moved)
+    if rebalancer.conflicts:
+        logger.warning("%d links were left in place because their key is taken on the new shard", len(rebalancer.conflicts))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
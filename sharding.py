@@ -0,0 +1,125 @@
+import bisect
+import hashlib
+from contextlib import contextmanager
+
+from sqlalchemy.orm import sessionmaker
+
+
+def parse_shards(spec: str) -> dict:
+    """Parse "a=url1,b=url2" (or plain "url1,url2", named shard0, shard1, ...) into {name: url}.
+
+    Names, not positions, place shards on the ring, so a shard keeps its
+    name when others are added or removed.
+    """
+    shards = {}
+    for i, item in enumerate(part.strip() for part in spec.split(",") if part.strip()):
+        name, sep, url = item.partition("=")
+        if not sep or "://" in name:
+            name, url = f"shard{i}", item
+        shards[name.strip()] = url.strip()
+    return shards
+
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring with `vnodes` points per node.
+
+    Adding a node to N existing ones moves only about 1/(N+1) of the keys,
+    all of them onto the new node.
+    """
+
+    def __init__(self, nodes, vnodes: int = 64):
+        self.nodes = list(nodes)
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, ring_hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class Shard:
+    """One database holding a slice of the urls table"""
+
+    def __init__(self, name: str, url: str, engine_factory):
+        self.name = name
+        self.url = url
+        self._engine_factory = engine_factory
+        self._engine = None
+        self._sessionmaker = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = self._engine_factory(self.url)
+        return self._engine
+
+    def session(self):
+        if self._sessionmaker is None:
+            self._sessionmaker = sessionmaker(
+                bind=self.engine, autocommit=False, autoflush=False, expire_on_commit=False, info={"shard": self.name}
+            )
+        return self._sessionmaker()
+
+
+class ShardSet:
+    """The shards of the urls table and the ring that places short keys on them.
+
+    While a rebalance is running, `previous` holds the old layout: a key is
+    looked for on its shard under the new ring first, then under the old one.
+    """
+
+    def __init__(self, shards: dict, engine_factory, vnodes: int = 64, previous: dict = None):
+        self.shards = {name: Shard(name, url, engine_factory) for name, url in shards.items()}
+        self.ring = HashRing(self.shards, vnodes) if self.shards else None
+        self.previous_ring = None
+        if previous:
+            for name, url in previous.items():
+                self.shards.setdefault(name, Shard(name, url, engine_factory))
+            self.previous_ring = HashRing(previous, vnodes)
+
+    def __bool__(self):
+        return bool(self.shards)
+
+    def __iter__(self):
+        """Every shard, including ones only the previous layout still uses"""
+        return iter(self.shards.values())
+
+    def for_key(self, key: str) -> Shard:
+        return self.shards[self.ring.node_for(key)]
+
+    def locate(self, key: str) -> list:
+        """Shards that may hold `key`, the one it belongs on first"""
+        found = [self.for_key(key)]
+        if self.previous_ring is not None:
+            previous = self.shards[self.previous_ring.node_for(key)]
+            if previous is not found[0]:
+                found.append(previous)
+        return found
+
+    def group_located(self, keys) -> dict:
+        """{shard: [keys]} over every shard that may hold each key, as in `locate`"""
+        grouped = {}
+        for key in keys:
+            for shard in self.locate(key):
+                grouped.setdefault(shard, []).append(key)
+        return grouped
+
+    def group(self, items, key=lambda item: item) -> dict:
+        """{shard: [items]}, placing each item by the short key `key(item)`"""
+        grouped = {}
+        for item in items:
+            grouped.setdefault(self.for_key(key(item)), []).append(item)
+        return grouped
+
+    @contextmanager
+    def session(self, shard: Shard):
+        db = shard.session()
+        try:
+            yield db
+        finally:
+            db.close()
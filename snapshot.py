@@ -0,0 +1,241 @@
+"""Memory-mapped snapshot of the urls table for redirects without a database query.
+
+The file is written once by `export` and then only read:
+
+    header   magic, version, row count, export time
+    index    one 8-byte data offset per row, in short_key order
+    data     per row: key length, status, URL length, max-age, expiry, key, URL
+
+Lookups binary-search the index straight out of the mapping, so every
+worker that maps the same file shares its pages through the OS page cache
+instead of holding its own copy. A new export is written next to the old
+file and renamed over it; `SnapshotWatcher` notices the new inode and
+swaps it in, while requests already holding the old mapping finish on it.
+
+Keys created after the export are not in the file; the redirect route
+looks them up as usual. A pod that should not reach the database for
+clicks either can run with CLICK_BUFFER=redis and CLICK_EVENTS=false.
+
+    python snapshot.py /var/lib/url-shortener/urls.snap
+"""
+import argparse
+import heapq
+import logging
+import math
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+import cache
+import crud
+from workers import PeriodicWorker
+
+
+# Path of the snapshot to serve redirects from; empty turns snapshot redirects off
+REDIRECT_SNAPSHOT = os.getenv("REDIRECT_SNAPSHOT", "")
+REDIRECT_SNAPSHOT_INTERVAL = float(os.getenv("REDIRECT_SNAPSHOT_INTERVAL", "10"))
+SNAPSHOT_EXPORT_BATCH = int(os.getenv("SNAPSHOT_EXPORT_BATCH", "10000"))
+
+MAGIC = b"URLSNAP1"
+VERSION = 1
+HEADER = struct.Struct("<8sIQd")
+OFFSET = struct.Struct("<Q")
+# key length, status, URL length, max-age (-1 for none), expiry (NaN for none)
+RECORD = struct.Struct("<HHIid")
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotError(Exception):
+    """The file is not a snapshot this version can read"""
+
+
+def export(path: str, rows) -> int:
+    """Write rows, sorted by short_key, to a snapshot at `path` and return how many.
+
+    Records and offsets go to temporary files as they stream in, so memory
+    use doesn't grow with the table; the finished file replaces `path` with
+    one rename.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    count = 0
+    offset = 0
+    previous = None
+    with tempfile.TemporaryFile(dir=directory) as data, tempfile.TemporaryFile(dir=directory) as index:
+        for row in rows:
+            key = row.short_key.encode()
+            if previous is not None and key <= previous:
+                raise ValueError(f"rows must be in strictly increasing short_key order, got {row.short_key!r} after {previous!r}")
+            previous = key
+            entry = cache.CachedURL.from_url(row)
+            target = entry.target_url.encode()
+            record = RECORD.pack(
+                len(key),
+                entry.status,
+                len(target),
+                -1 if entry.max_age is None else entry.max_age,
+                math.nan if entry.expires_at is None else entry.expires_at,
+            )
+            index.write(OFFSET.pack(offset))
+            data.write(record + key + target)
+            offset += len(record) + len(key) + len(target)
+            count += 1
+        fd, scratch = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(HEADER.pack(MAGIC, VERSION, count, time.time()))
+                for part in (index, data):
+                    part.seek(0)
+                    shutil.copyfileobj(part, out, 1 << 20)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(scratch, path)
+        except BaseException:
+            os.unlink(scratch)
+            raise
+    return count
+
+
+def export_from_db(path: str, session_factory=None, batch_size: int = SNAPSHOT_EXPORT_BATCH) -> int:
+    """Export every link, merging the shards' key orders when the table is sharded"""
+    sessions = [(session_factory or crud.SessionLocal)()]
+    try:
+        if crud.sharded(sessions[0]):
+            sessions += [shard.session() for shard in crud.shards]
+            streams = [crud.iter_redirect_rows(db, batch_size) for db in sessions[1:]]
+            return export(path, heapq.merge(*streams, key=lambda row: row.short_key.encode()))
+        return export(path, crud.iter_redirect_rows(sessions[0], batch_size))
+    finally:
+        for db in sessions:
+            db.close()
+
+
+class Snapshot:
+    """A read-only mapping of one snapshot file"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise SnapshotError(f"{path} is too short to be a snapshot")
+        magic, version, self.count, self.created_at = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError(f"{path} is not a version {VERSION} snapshot")
+        self.path = path
+        self.data_start = HEADER.size + self.count * OFFSET.size
+
+    def _key_at(self, i: int) -> tuple:
+        start = self.data_start + OFFSET.unpack_from(self.map, HEADER.size + i * OFFSET.size)[0]
+        key_start = start + RECORD.size
+        return self.map[key_start:key_start + RECORD.unpack_from(self.map, start)[0]], start
+
+    def get(self, key: str):
+        """The CachedURL for key, or None when the snapshot doesn't have it"""
+        wanted = key.encode()
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            found, start = self._key_at(middle)
+            if found < wanted:
+                low = middle + 1
+            elif found > wanted:
+                high = middle
+            else:
+                key_length, status, url_length, max_age, expires_at = RECORD.unpack_from(self.map, start)
+                url_start = start + RECORD.size + key_length
+                return cache.CachedURL(
+                    self.map[url_start:url_start + url_length].decode(),
+                    status,
+                    None if max_age < 0 else max_age,
+                    None if math.isnan(expires_at) else expires_at,
+                )
+        return None
+
+    def __len__(self):
+        return self.count
+
+
+class SnapshotStore:
+    """The snapshot currently served, swapped for a newer file when one appears"""
+
+    def __init__(self, path: str = REDIRECT_SNAPSHOT):
+        self.path = path
+        self.current = None
+        self.stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def get(self, key: str):
+        """The CachedURL for key, or cache.MISSING when there is no snapshot or it lacks the key"""
+        snapshot = self.current
+        if snapshot is None:
+            return cache.MISSING
+        entry = snapshot.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return cache.MISSING
+        self.stats["hits"] += 1
+        return entry
+
+    def reload(self) -> bool:
+        """Map the file at `path` if it is not the one already mapped; True if it was swapped in"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        current = self.current
+        if current is not None and current.identity == (stat.st_dev, stat.st_ino, stat.st_mtime_ns):
+            return False
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, ValueError, SnapshotError):
+            logger.exception("could not load snapshot %s; keeping the current one", self.path)
+            return False
+        # One reference swap; the old mapping is unmapped once no request holds it
+        self.current = snapshot
+        self.stats["reloads"] += 1
+        logger.info("serving redirects from %s: %d links", self.path, snapshot.count)
+        return True
+
+
+class SnapshotWatcher(PeriodicWorker):
+    name = "snapshot-watcher"
+
+    def __init__(self, interval: float = REDIRECT_SNAPSHOT_INTERVAL):
+        super().__init__(interval)
+
+    def start(self):
+        if store.enabled:
+            store.reload()
+            super().start()
+
+    def run_once(self):
+        store.reload()
+
+
+store = SnapshotStore()
+watcher = SnapshotWatcher()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=REDIRECT_SNAPSHOT or None, help="snapshot file to write (default: REDIRECT_SNAPSHOT)")
+    parser.add_argument("--batch-size", type=int, default=SNAPSHOT_EXPORT_BATCH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.path is None:
+        parser.error("give a path or set REDIRECT_SNAPSHOT")
+    started = time.perf_counter()
+    count = export_from_db(args.path, batch_size=args.batch_size)
+    logger.info("wrote %d links to %s in %.1fs", count, args.path, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
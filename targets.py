@@ -0,0 +1,224 @@
+"""Validation and normalization of target URLs, and the domain block/allow lists.
+
+Every URL a user submits goes through `normalize`, by way of the
+`crud.TargetURL` type on `/shorten`, `/shorten/bulk` and transfer.py
+imports. Most URLs are already in normal form (lower-case http(s) scheme
+and ASCII host, no port, credentials or spaces); one precompiled pattern
+recognises those and returns them untouched. Anything else is taken apart
+with urlsplit, checked piece by piece and rebuilt: scheme and host
+lower-cased, internationalized hosts converted to their IDNA (punycode)
+form, a default port dropped, and spaces and non-ASCII characters in the
+path, query and fragment percent-encoded.
+
+The block and allow lists are files of domains, one per line, each
+matching itself and its subdomains. They are held as sets and a host is
+looked up once per suffix, so a check costs one lookup per label however
+long the lists are. The watcher reloads either file when it changes.
+"""
+import functools
+import ipaddress
+import logging
+import os
+import re
+from urllib.parse import quote, urlsplit, urlunsplit
+
+import idna
+
+from workers import PeriodicWorker
+
+
+logger = logging.getLogger(__name__)
+
+TARGET_SCHEMES = [scheme.strip().lower() for scheme in os.getenv("TARGET_SCHEMES", "http,https").split(",") if scheme.strip()]
+TARGET_URL_MAX_LENGTH = int(os.getenv("TARGET_URL_MAX_LENGTH", "2048"))
+# Domains never accepted as targets, one per line; # starts a comment
+TARGET_BLOCKLIST = os.getenv("TARGET_BLOCKLIST", "")
+# When set, only these domains (and their subdomains) are accepted
+TARGET_ALLOWLIST = os.getenv("TARGET_ALLOWLIST", "")
+TARGET_LIST_INTERVAL = float(os.getenv("TARGET_LIST_INTERVAL", "30"))
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+LABEL = r"[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?"
+# The last label must start with a letter, which also keeps IPv4 addresses out
+HOSTNAME = rf"(?:{LABEL}\.)+[a-z](?:[a-z0-9-]{{0,61}}[a-z0-9])?"
+VALID_HOSTNAME = re.compile(HOSTNAME)
+UNSAFE = re.compile(r"[\x00-\x1f\x7f]")
+# Characters left as they are in the path, query and fragment; the rest is percent-encoded
+URL_SAFE = "!$%&'()*+,/:;=?@[]~"
+# What quote() leaves alone, so the fast path accepts exactly what rebuild would return unchanged
+KEPT = "a-zA-Z0-9" + re.escape("".join(sorted(set(URL_SAFE + "_.-") - {"?"})))
+# An already-normal URL: known scheme, lower-case ASCII host, a path, non-empty query and
+# fragment made only of kept characters
+FAST_PATH = re.compile(
+    rf"(?:{'|'.join(map(re.escape, TARGET_SCHEMES))})://({HOSTNAME})"
+    rf"(?:/[{KEPT}]*)?(?:\?[{KEPT}?]+)?(?:#[{KEPT}?]+)?"
+)
+
+
+class InvalidTarget(ValueError):
+    """A target URL that cannot be shortened; the message says why"""
+
+
+class BlockedTarget(InvalidTarget):
+    """A target URL on a blocked domain, or off the allowed ones"""
+
+
+class DomainList:
+    """A set of domains read from a file; a domain also covers its subdomains"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.domains = frozenset()
+        self.identity = None
+        if path:
+            self.reload()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def __len__(self) -> int:
+        return len(self.domains)
+
+    def __contains__(self, host: str) -> bool:
+        domains = self.domains
+        if not domains:
+            return False
+        while True:
+            if host in domains:
+                return True
+            dot = host.find(".")
+            if dot < 0:
+                return False
+            host = host[dot + 1:]
+
+    def reload(self) -> bool:
+        """Read the file again if it changed since the last read; True if the set was replaced"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            logger.warning("domain list %s does not exist; keeping %d domains", self.path, len(self.domains))
+            return False
+        identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if identity == self.identity:
+            return False
+        domains = set()
+        with open(self.path, encoding="utf-8") as f:
+            for number, line in enumerate(f, start=1):
+                domain = line.split("#", 1)[0].strip().lower().removeprefix("*.").rstrip(".")
+                if not domain:
+                    continue
+                try:
+                    domains.add(domain if domain.isascii() else to_ascii(domain))
+                except InvalidTarget:
+                    logger.warning("%s:%d: skipping invalid domain %r", self.path, number, domain)
+        # One reference swap; lookups in progress keep the old set
+        self.domains = frozenset(domains)
+        self.identity = identity
+        logger.info("loaded %d domains from %s", len(domains), self.path)
+        return True
+
+
+blocklist = DomainList(TARGET_BLOCKLIST)
+allowlist = DomainList(TARGET_ALLOWLIST)
+
+stats = {"fast": 0, "normalized": 0, "invalid": 0, "blocked": 0}
+
+
+def check_host(host: str):
+    if host in blocklist or (allowlist.enabled and host not in allowlist):
+        raise BlockedTarget(f"links to {host} are not allowed")
+
+
+# The idna package is slow next to everything else here, and bulk imports repeat hosts
+@functools.lru_cache(maxsize=10_000)
+def to_ascii(host: str) -> str:
+    try:
+        return idna.encode(host, uts46=True).decode("ascii")
+    except idna.IDNAError as exc:
+        raise InvalidTarget(f"invalid host name: {exc}") from None
+
+
+def normalize_host(host: str) -> str:
+    """The host in lower-case ASCII form, or InvalidTarget"""
+    host = host.rstrip(".")
+    if not host.isascii():
+        host = to_ascii(host)
+    host = host.lower()
+    if len(host) <= 253 and VALID_HOSTNAME.fullmatch(host):
+        return host
+    try:
+        return str(ipaddress.IPv4Address(host))
+    except ValueError:
+        raise InvalidTarget(f"invalid host name {host!r}") from None
+
+
+def normalize(url: str) -> str:
+    """Return the canonical form of an http(s) URL, or raise InvalidTarget"""
+    try:
+        if len(url) > TARGET_URL_MAX_LENGTH:
+            raise InvalidTarget(f"URL is longer than {TARGET_URL_MAX_LENGTH} characters")
+        match = FAST_PATH.fullmatch(url)
+        if match is not None and len(match.group(1)) <= 253:
+            check_host(match.group(1))
+            stats["fast"] += 1
+            return url
+        url = rebuild(url.strip())
+    except BlockedTarget:
+        stats["blocked"] += 1
+        raise
+    except InvalidTarget:
+        stats["invalid"] += 1
+        raise
+    stats["normalized"] += 1
+    return url
+
+
+def rebuild(url: str) -> str:
+    if UNSAFE.search(url):
+        raise InvalidTarget("URL contains control characters")
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError as exc:
+        raise InvalidTarget(f"malformed URL: {exc}") from None
+    scheme = parts.scheme.lower()
+    if scheme not in TARGET_SCHEMES:
+        raise InvalidTarget(f"URL must start with {' or '.join(s + '://' for s in TARGET_SCHEMES)}")
+    if "@" in parts.netloc:
+        raise InvalidTarget("URL must not contain a username or password")
+    host = parts.hostname
+    if not host:
+        raise InvalidTarget("URL has no host")
+    if parts.netloc.startswith("["):
+        try:
+            host = f"[{ipaddress.IPv6Address(host).compressed}]"
+        except ValueError:
+            raise InvalidTarget(f"invalid IPv6 address {host!r}") from None
+    else:
+        host = normalize_host(host)
+    check_host(host)
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    path, query, fragment = (quote(part, safe=URL_SAFE) for part in (parts.path, parts.query, parts.fragment))
+    return urlunsplit((scheme, host, path, query, fragment))
+
+
+class TargetListWatcher(PeriodicWorker):
+    name = "target-list-watcher"
+
+    def __init__(self, interval: float = TARGET_LIST_INTERVAL):
+        super().__init__(interval)
+
+    def start(self):
+        if blocklist.enabled or allowlist.enabled:
+            super().start()
+
+    def run_once(self):
+        for domains in (blocklist, allowlist):
+            if domains.enabled:
+                domains.reload()
+
+
+watcher = TargetListWatcher()
@@ -0,0 +1,30 @@
+from fastapi.testclient import TestClient
+
+import crud
+
+
+class TestAsyncMode:
+    """Test the request path on an AsyncSession"""
+
+    def test_complete_flow(self, async_client: TestClient):
+        """Test register -> login -> shorten -> redirect on aiosqlite"""
+        user_data = {"username": "asyncuser", "password": "testpass123"}
+        assert async_client.post("/register", json=user_data).status_code == 200
+        assert async_client.post("/register", json=user_data).status_code == 400
+
+        token = async_client.post("/token", data=user_data).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        response = async_client.post("/shorten", json={"target_url": "https://www.python.org"}, headers=headers)
+        assert response.status_code == 200
+        short_key = response.json()["short_key"]
+
+        redirect_response = async_client.get(f"/{short_key}", follow_redirects=False)
+        assert redirect_response.status_code == 307
+        assert redirect_response.headers["location"] == "https://www.python.org"
+        assert async_client.get("/missingkey").status_code == 404
+
+
+def test_async_database_url():
+    """Test that sync URLs are mapped onto async drivers"""
+    assert crud.async_database_url("postgresql://u:p@db:5432/x") == "postgresql+asyncpg://u:p@db:5432/x"
+    assert crud.async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
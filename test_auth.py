@@ -0,0 +1,109 @@
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import cache
+import crud
+from cache import InMemoryRedis
+
+
+@pytest.fixture()
+def user_lookups(monkeypatch):
+    calls = []
+    original = crud.get_user_by_username
+
+    def counting_get_user_by_username(db, name):
+        calls.append(name)
+        return original(db, name)
+
+    monkeypatch.setattr(crud, "get_user_by_username", counting_get_user_by_username)
+    return calls
+
+
+class TestPrincipalCache:
+    """Test caching of authenticated users"""
+
+    def test_cache_hit_skips_user_query(self, client: TestClient, auth_headers, user_lookups):
+        """Test that repeated requests with one token look the user up once"""
+        headers = auth_headers("cachetest")
+        user_lookups.clear()
+        for i in range(3):
+            response = client.post("/shorten", json={"target_url": f"https://example.com/{i}"}, headers=headers)
+            assert response.status_code == 200
+        assert user_lookups == ["cachetest"]
+
+    def test_user_change_invalidates_cache(self, client: TestClient, auth_headers, db_session, user_lookups):
+        """Test that updating the user row drops its cached principal"""
+        headers = auth_headers("cachetest")
+        client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+
+        user = crud.get_user_by_username(db_session, name="cachetest")
+        user.hashed_password = auth.get_password_hash("newpassword")
+        db_session.commit()
+
+        user_lookups.clear()
+        client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+        assert user_lookups == ["cachetest"]
+
+    def test_change_in_another_process_invalidates_cache(self, client: TestClient, auth_headers, user_lookups, monkeypatch):
+        """Test that a user change published through Redis drops principals cached here"""
+        monkeypatch.setattr(cache, "redis_client", InMemoryRedis())
+        headers = auth_headers("cachetest")
+        client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+        user_lookups.clear()
+        client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+        assert user_lookups == []
+
+        # What invalidate_principal leaves in Redis, without touching this process's cache
+        cache.redis_client.incr("principal-version:cachetest")
+        client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+        assert user_lookups == ["cachetest"]
+
+
+def test_decode_is_memoized_until_expiry(monkeypatch):
+    """Test that a token is verified once and its payload reused"""
+    token = auth.create_access_token("memotest")
+    calls = []
+    original = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(jwt, "decode", counting_decode)
+    assert auth.decode_access_token(token)["sub"] == "memotest"
+    assert auth.decode_access_token(token)["sub"] == "memotest"
+    assert calls == [token]
+
+
+class TestPasswordHasher:
+    """Test the bounded bcrypt pool"""
+
+    def test_saturated_pool_returns_503(self, client: TestClient, monkeypatch):
+        """Test that registrations are refused while every hashing slot is taken"""
+        import asyncio
+        import threading
+
+        hasher = auth.PasswordHasher(workers=1, queue_limit=0)
+        monkeypatch.setattr(auth, "hasher", hasher)
+        release = threading.Event()
+        blocker = threading.Thread(target=lambda: asyncio.run(hasher.run(release.wait)))
+        blocker.start()
+        try:
+            while hasher.stats()["in_flight"] == 0:
+                pass
+            response = client.post("/register", json={"username": "busy", "password": "testpass123"})
+            assert response.status_code == 503
+            assert response.headers["retry-after"] == "1"
+        finally:
+            release.set()
+            blocker.join()
+        assert hasher.stats()["rejected"] == 1
+
+        response = client.post("/register", json={"username": "busy", "password": "testpass123"})
+        assert response.status_code == 200
+
+    def test_bcrypt_cost_is_configurable(self):
+        """Test that hashes use the configured bcrypt cost factor"""
+        assert auth.get_password_hash("secret").startswith(f"$2b${auth.BCRYPT_ROUNDS:02d}$")
@@ -0,0 +1,116 @@
+import pytest
+import redis
+from fastapi.testclient import TestClient
+
+import bloom
+import cache
+import crud
+from bloom import BloomFilter, KeyFilter
+from cache import InMemoryRedis
+
+
+def new_filter(redis_client=None) -> KeyFilter:
+    return KeyFilter(BloomFilter(capacity=1000, error_rate=0.01), redis_client, enabled=True)
+
+
+@pytest.fixture()
+def key_filter(client, monkeypatch):
+    """The app's key filter, enabled and built from the (empty) test database"""
+    from conftest import TestingSessionLocal
+
+    key_filter = new_filter()
+    monkeypatch.setattr(bloom, "key_filter", key_filter)
+    key_filter.build(TestingSessionLocal)
+    return key_filter
+
+
+class TestBloomFilter:
+    """Test the Bloom filter itself"""
+
+    def test_no_false_negatives(self):
+        """Test that every added key is reported present"""
+        keys = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            keys.add(f"key{i}")
+        assert all(f"key{i}" in keys for i in range(1000))
+
+    def test_false_positive_rate_near_target(self):
+        """Test that a full filter stays near its configured error rate"""
+        keys = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            keys.add(f"key{i}")
+        false_positives = sum(f"other{i}" in keys for i in range(10000))
+        assert false_positives / 10000 < 0.03
+        assert 0 < keys.false_positive_rate() < 0.03
+        assert keys.memory_bytes == (keys.bits + 7) // 8
+
+
+class TestKeyFilter:
+    """Test the key filter on the redirect path"""
+
+    def test_unknown_key_skips_database(self, client: TestClient, key_filter, monkeypatch):
+        """Test that a key the filter rejects is a 404 without a query"""
+        def no_query(*args, **kwargs):
+            raise AssertionError("database queried")
+
+        monkeypatch.setattr(crud, "get_url_by_key", no_query)
+        assert client.get("/favicon.ico").status_code == 404
+        assert key_filter.stats["rejected"] == 1
+
+    def test_new_links_pass(self, client: TestClient, auth_headers, key_filter):
+        """Test that links created after the build still redirect"""
+        headers = auth_headers()
+        single = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers).json()["short_key"]
+        bulk = client.post("/shorten/bulk", json=["https://example.org"], headers=headers).json()["short_key"]
+
+        cache.redirect_cache.clear()
+        for key in (single, bulk):
+            assert client.get(f"/{key}", follow_redirects=False).status_code == 307
+
+    def test_not_ready_lets_everything_through(self):
+        """Test that keys are not rejected before the startup scan"""
+        key_filter = new_filter()
+        assert key_filter.might_contain("anything")
+
+    def test_shared_through_redis(self):
+        """Test that a key added by one worker passes another worker's filter"""
+        shared = InMemoryRedis()
+        first, second = new_filter(shared), new_filter(shared)
+        first.ready = second.ready = True
+        first.add("abc1234")
+        assert second.might_contain("abc1234")
+        assert "abc1234" in second.bloom
+
+    def test_failed_mirror_lets_keys_through(self):
+        """Test that after a failed SETBIT other workers stop rejecting keys until the bits are resent and a build runs"""
+        class BrokenPipeline:
+            def setbit(self, *args):
+                pass
+
+            def execute(self):
+                raise redis.ConnectionError("down")
+
+        shared = InMemoryRedis()
+        first, second = new_filter(shared), new_filter(shared)
+        first.ready = second.ready = True
+        shared.pipeline = lambda transaction=True: BrokenPipeline()
+        first.add("lost1234")
+        del shared.pipeline
+        assert second.might_contain("lost1234")
+        assert second.might_contain("neveradded")
+
+        first.add("next1234")
+        second._sync_shared()
+        assert second.might_contain("lost1234")
+        assert not second.might_contain("neveradded")
+
+    def test_build_merges_shared_bitmap(self, client: TestClient):
+        """Test that building unions the local scan with the shared bitmap"""
+        from conftest import TestingSessionLocal
+
+        shared = InMemoryRedis()
+        first = new_filter(shared)
+        first.add("fromother")
+        second = new_filter(shared)
+        second.build(TestingSessionLocal)
+        assert "fromother" in second.bloom
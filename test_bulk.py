@@ -0,0 +1,74 @@
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from conftest import engine
+from crud import AppSession, get_session_factory
+from main import app
+
+
+def read_lines(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+class TestBulkShorten:
+    """Test POST /shorten/bulk"""
+
+    def test_bulk_json_array(self, client: TestClient, auth_headers):
+        """Test shortening a JSON array of strings and objects"""
+        body = ["https://example.com/1", {"target_url": "https://example.com/2"}, "https://example.com/3"]
+        response = client.post("/shorten/bulk", json=body, headers=auth_headers())
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+        results = read_lines(response)
+        assert [r["line"] for r in results] == [1, 2, 3]
+        assert [r["target_url"] for r in results] == ["https://example.com/1", "https://example.com/2", "https://example.com/3"]
+        assert len({r["short_key"] for r in results}) == 3
+
+        redirect_response = client.get(f"/{results[1]['short_key']}", follow_redirects=False)
+        assert redirect_response.headers["location"] == "https://example.com/2"
+
+    def test_bulk_ndjson_reports_bad_lines(self, client: TestClient, auth_headers):
+        """Test that malformed NDJSON lines are reported without failing the batch"""
+        headers = {**auth_headers(), "Content-Type": "application/x-ndjson"}
+        body = '"https://example.com/a"\n{not json\n{"target_url": "https://example.com/b"}\n'
+        response = client.post("/shorten/bulk", content=body, headers=headers)
+        assert response.status_code == 200
+
+        results = read_lines(response)
+        errors = [r for r in results if "error" in r]
+        created = [r for r in results if "short_key" in r]
+        assert [r["line"] for r in errors] == [2]
+        assert [r["line"] for r in created] == [1, 3]
+
+    def test_bulk_closes_its_session(self, client: TestClient, auth_headers):
+        """Test that the session the streamed inserts ran on is closed once they finish"""
+        opened, closed = [], []
+
+        class TrackedSession(AppSession):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                opened.append(self)
+
+            def close(self):
+                closed.append(self)
+                super().close()
+
+        app.dependency_overrides[get_session_factory] = lambda: sessionmaker(class_=TrackedSession, bind=engine)
+        response = client.post("/shorten/bulk", json=["https://example.com/1"], headers=auth_headers())
+        assert "short_key" in response.text
+        assert len(opened) == 1
+        assert closed == opened
+        assert engine.pool.checkedout() == 0
+
+    def test_bulk_rejects_non_array_body(self, client: TestClient, auth_headers):
+        """Test that a JSON body that is not an array is rejected up front"""
+        response = client.post("/shorten/bulk", json={"target_url": "https://example.com"}, headers=auth_headers())
+        assert response.status_code == 422
+
+    def test_bulk_unauthorized(self, client: TestClient):
+        """Test that bulk shortening requires authentication"""
+        response = client.post("/shorten/bulk", json=["https://example.com"])
+        assert response.status_code == 401
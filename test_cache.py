@@ -0,0 +1,182 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from multiprocessing import shared_memory
+
+import pytest
+
+from cache import CachedURL, InMemoryRedis, LocalCache, RedirectCache, SharedCache, MISSING
+
+
+class TestLocalCache:
+    """Test the in-process LRU tier"""
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest untouched entry is dropped when full"""
+        local = LocalCache(maxsize=2, ttl=60)
+        local.set("a", 1)
+        local.set("b", 2)
+        local.get("a")
+        local.set("c", 3)
+        assert local.get("a") == 1
+        assert local.get("b") is MISSING
+        assert local.get("c") == 3
+
+    def test_entries_expire(self):
+        """Test that entries are not returned after their TTL"""
+        local = LocalCache(maxsize=10, ttl=60)
+        local.set("a", 1, ttl=0.01)
+        time.sleep(0.02)
+        assert local.get("a") is MISSING
+
+
+@pytest.fixture()
+def shm_name():
+    """A fresh shared memory segment name, unlinked after the test"""
+    name = f"test-redirects-{uuid.uuid4().hex[:8]}"
+    yield name
+    shared_memory.SharedMemory(name).unlink()
+    os.remove(os.path.join(tempfile.gettempdir(), f"{name}.lock"))
+
+
+def set_in_child(name: str, key: str, target: str):
+    SharedCache(name, slots=64).set(key, CachedURL(target))
+
+
+class TestSharedCache:
+    """Test the shared memory tier"""
+
+    def test_entries_are_seen_by_other_processes(self, shm_name):
+        """Test that an entry written by another process is a hit here"""
+        shared = SharedCache(shm_name, slots=64)
+        child = multiprocessing.get_context("spawn").Process(target=set_in_child, args=(shm_name, "abc", "https://example.com"))
+        child.start()
+        child.join()
+        assert child.exitcode == 0
+        assert shared.get("abc") == CachedURL("https://example.com")
+
+    def test_round_trip(self, shm_name):
+        """Test that redirect policy, negative entries and deletes survive the encoding"""
+        shared = SharedCache(shm_name, slots=64)
+        shared.set("policy", CachedURL("https://example.com/é", 308, 600, 1700000000.5))
+        shared.set("nope", None, ttl=30)
+        assert shared.get("policy") == CachedURL("https://example.com/é", 308, 600, 1700000000.5)
+        assert shared.get("nope") is None
+        shared.delete("policy")
+        assert shared.get("policy") is MISSING
+        shared.set("long", CachedURL("https://example.com/" + "x" * 1000))
+        assert shared.get("long") is MISSING
+
+    def test_entries_expire(self, shm_name):
+        """Test that entries are not returned after their TTL"""
+        shared = SharedCache(shm_name, slots=64)
+        shared.set("a", CachedURL("https://example.com"), ttl=0.01)
+        time.sleep(0.02)
+        assert shared.get("a") is MISSING
+
+    def test_clock_eviction_spares_referenced_entries(self, shm_name):
+        """Test that a full table evicts the entry not read since the last sweep"""
+        shared = SharedCache(shm_name, slots=4, probe=4)
+        for key in ("a", "b", "c", "d", "e"):
+            shared.set(key, CachedURL(f"https://example.com/{key}"))
+        survivors = [key for key in "abcd" if shared.get(key) is not MISSING]
+        assert len(survivors) == 3
+        # e and the first two survivors have been referenced since the sweep that made room for e
+        for key in survivors[:2]:
+            shared.get(key)
+        shared.set("f", CachedURL("https://example.com/f"))
+        assert shared.get(survivors[2]) is MISSING
+        assert all(shared.get(key) is not MISSING for key in [*survivors[:2], "e", "f"])
+
+
+class TestRedirectCache:
+    """Test the tiered redirect cache"""
+
+    def test_redis_tier_fills_local_tier(self):
+        """Test that a hit in Redis is served and promoted to the local tier"""
+        shared = InMemoryRedis()
+        RedirectCache(LocalCache(), shared).set("abc", CachedURL("https://example.com"))
+
+        other = RedirectCache(LocalCache(), shared)
+        assert other.get("abc") == CachedURL("https://example.com")
+        assert other.local.get("abc") == CachedURL("https://example.com")
+
+    def test_negative_entries(self):
+        """Test that unknown keys are remembered as None until invalidated"""
+        redirects = RedirectCache(LocalCache(), InMemoryRedis())
+        assert redirects.get("nope") is MISSING
+        redirects.set_missing("nope")
+        assert redirects.get("nope") is None
+        redirects.invalidate("nope")
+        assert redirects.get("nope") is MISSING
+
+
+def test_redirect_for_unknown_key_is_negatively_cached(client, monkeypatch):
+    """Test that repeated requests for an unknown key query the database once"""
+    import crud
+
+    calls = []
+    original = crud.get_url_by_key
+
+    def counting_get_url_by_key(db, key):
+        calls.append(key)
+        return original(db, key)
+
+    monkeypatch.setattr(crud, "get_url_by_key", counting_get_url_by_key)
+    assert client.get("/doesnotexist").status_code == 404
+    assert client.get("/doesnotexist").status_code == 404
+    assert calls == ["doesnotexist"]
+
+
+class OffLoopRedis(InMemoryRedis):
+    """InMemoryRedis that fails any call made on the event loop's thread, where it would stall every request"""
+
+    def __getattribute__(self, name):
+        if not name.startswith("_"):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError(f"Redis {name} called on the event loop")
+        return super().__getattribute__(name)
+
+
+def test_redis_is_never_called_on_the_event_loop(auth_headers, client, monkeypatch):
+    """Test that shortening and redirecting reach Redis only from the threadpool"""
+    import bloom
+    import cache
+    import clicks
+    import ratelimit
+
+    monkeypatch.setattr(cache, "redirect_cache", RedirectCache(LocalCache(), OffLoopRedis()))
+    key_filter = bloom.KeyFilter(bloom.BloomFilter(capacity=1000), OffLoopRedis(), enabled=True)
+    key_filter.ready = True
+    monkeypatch.setattr(bloom, "key_filter", key_filter)
+    monkeypatch.setattr(clicks.aggregator, "buffer", clicks.RedisClickBuffer(OffLoopRedis()))
+    monkeypatch.setattr(ratelimit, "limiter", ratelimit.RateLimiter(ratelimit.RedisRateStore(OffLoopRedis()), enabled=True))
+
+    response = client.post("/shorten", json={"target_url": "https://example.com"}, headers=auth_headers())
+    key = response.json()["short_key"]
+    cache.redirect_cache.local.clear()
+    assert client.get(f"/{key}", follow_redirects=False).status_code == 307
+    assert client.get(f"/{key}", follow_redirects=False).status_code == 307
+    assert client.get("/nosuchkey", follow_redirects=False).status_code == 404
+    assert clicks.aggregator.buffer.drain() == {key: 2}
+
+
+def test_in_memory_bitop():
+    """Test that the Redis stand-in combines bitmaps like BITOP, padding shorter values with zeros"""
+    fake = InMemoryRedis()
+    fake.set("a", b"\x0f\xf0")
+    fake.set("b", b"\x3c")
+    for operation, expected in [("AND", b"\x0c\x00"), ("OR", b"\x3f\xf0"), ("XOR", b"\x33\xf0")]:
+        assert fake.bitop(operation, "dest", "a", "b") == 2
+        assert fake.get("dest") == expected
+    fake.bitop("NOT", "dest", "a")
+    assert fake.get("dest") == b"\xf0\x0f"
+    assert fake.bitop("OR", "dest", "missing") == 0
+    assert fake.get("dest") is None
@@ -0,0 +1,85 @@
+import redis
+from fastapi.testclient import TestClient
+
+import clicks
+import crud
+from cache import InMemoryRedis
+
+
+class TestClickAggregation:
+    """Test write-behind click counting"""
+
+    def test_redirects_do_not_touch_the_database(self, client: TestClient, shorten, monkeypatch):
+        """Test that a cached redirect neither looks up nor updates the row"""
+        key = shorten("https://www.example.com")
+
+        def fail(*args, **kwargs):
+            raise AssertionError("database used on the redirect path")
+
+        monkeypatch.setattr(crud, "get_url_by_key", fail)
+        monkeypatch.setattr(crud, "add_click_counts", fail)
+        response = client.get(f"/{key}", follow_redirects=False)
+        assert response.status_code == 307
+
+    def test_flush_applies_buffered_clicks(self, client: TestClient, shorten, db_session):
+        """Test that buffered clicks are written by a flush"""
+        key = shorten("https://www.example.com")
+        for _ in range(3):
+            client.get(f"/{key}", follow_redirects=False)
+        assert crud.get_url_by_key(db_session, key).clicks == 0
+
+        clicks.aggregator.flush()
+        db_session.expire_all()
+        assert crud.get_url_by_key(db_session, key).clicks == 3
+
+    def test_stop_flushes_pending_clicks(self, client: TestClient, shorten, db_session):
+        """Test that shutting the aggregator down writes what is still buffered"""
+        key = shorten("https://www.example.com")
+        client.get(f"/{key}", follow_redirects=False)
+        clicks.aggregator.start()
+        clicks.aggregator.stop()
+        assert crud.get_url_by_key(db_session, key).clicks == 1
+
+
+def test_redis_buffer_drains_atomically():
+    """Test that the Redis buffer hands out each increment exactly once"""
+    buffer = clicks.RedisClickBuffer(InMemoryRedis())
+    buffer.add("a")
+    buffer.add("a")
+    buffer.add("b", 5)
+    assert buffer.drain() == {"a": 2, "b": 5}
+    assert buffer.drain() == {}
+
+
+class BrokenRedis:
+    """A Redis client whose server is down"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise redis.ConnectionError("connection refused")
+        return fail
+
+
+def test_redis_buffer_falls_back_to_memory(client: TestClient, shorten, db_session, monkeypatch):
+    """Test that redirects still work and clicks are still counted while Redis is down"""
+    key = shorten("https://www.example.com")
+    monkeypatch.setattr(clicks.aggregator, "buffer", clicks.RedisClickBuffer(BrokenRedis()))
+    for _ in range(2):
+        assert client.get(f"/{key}", follow_redirects=False).status_code == 307
+    clicks.aggregator.flush()
+    assert crud.get_url_by_key(db_session, key).clicks == 2
+
+
+def test_redis_buffer_recovers_unfinished_drains(monkeypatch):
+    """Test that counts renamed by a worker that died mid-drain are flushed later, once"""
+    shared = InMemoryRedis()
+    crashed = clicks.RedisClickBuffer(shared)
+    crashed.add("a", 3)
+    monkeypatch.setattr(crashed, "take", lambda name: {})
+    assert crashed.drain() == {}
+
+    crashed.add("a")
+    survivor = clicks.RedisClickBuffer(shared, orphan_seconds=0)
+    monkeypatch.setattr(clicks.time, "time", lambda: 2e9)
+    assert survivor.drain() == {"a": 4}
+    assert survivor.drain() == {}
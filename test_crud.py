@@ -0,0 +1,59 @@
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+
+import crud
+
+
+class TestEngineFactory:
+    """Test crud.make_engine and pool metrics"""
+
+    def test_pool_settings_come_from_config(self, tmp_path, monkeypatch):
+        """Test that the configured pool size and overflow are applied"""
+        monkeypatch.setattr(crud, "DB_POOL_SIZE", 3)
+        monkeypatch.setattr(crud, "DB_MAX_OVERFLOW", 1)
+        engine = crud.make_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+        try:
+            assert isinstance(engine.pool, crud.MeteredQueuePool)
+            assert engine.pool.size() == 3
+            assert engine.pool._max_overflow == 1
+            assert engine.pool._pre_ping is True
+        finally:
+            engine.dispose()
+            crud.engines.remove(engine)
+
+    def test_checkouts_are_counted(self, tmp_path):
+        """Test that pool_stats reports checkouts for an engine"""
+        engine = crud.make_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+        try:
+            for _ in range(2):
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+            stats = next(s for s in crud.pool_stats() if s["url"].endswith("stats.db"))
+            assert stats["checkouts"] == 2
+            assert stats["checked_out"] == 0
+            assert stats["wait_seconds_total"] >= 0
+            assert stats["held_seconds_total"] > 0
+
+            # dispose() replaces the pool; the event listeners carry over to the new one
+            engine.dispose()
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            assert engine.pool.checkouts == 1
+        finally:
+            engine.dispose()
+            crud.engines.remove(engine)
+
+    def test_pgbouncer_mode_disables_app_pool(self, monkeypatch):
+        """Test that PgBouncer mode leaves pooling to PgBouncer"""
+        monkeypatch.setattr(crud, "DB_PGBOUNCER", True)
+        engine = crud.make_engine("postgresql://u:p@pgbouncer:6432/db")
+        crud.engines.remove(engine)
+        assert isinstance(engine.pool, NullPool)
+
+    def test_statement_timeout(self, monkeypatch):
+        """Test that the statement timeout is passed to Postgres on connect"""
+        monkeypatch.setattr(crud, "DB_STATEMENT_TIMEOUT_MS", 2500)
+        options = crud._engine_options("postgresql://u:p@db/x", is_async=False)
+        assert options["connect_args"]["options"] == "-c statement_timeout=2500"
+        options = crud._engine_options("postgresql+asyncpg://u:p@db/x", is_async=True)
+        assert options["connect_args"]["server_settings"] == {"statement_timeout": "2500"}
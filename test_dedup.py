@@ -0,0 +1,97 @@
+import pytest
+import redis
+from fastapi.testclient import TestClient
+
+import keys
+from cache import InMemoryRedis
+from idempotency import IdempotencyStore, KeyInUse
+
+
+@pytest.fixture()
+def dedup(monkeypatch):
+    monkeypatch.setattr(keys, "SHORTEN_DEDUP", True)
+
+
+class TestDedup:
+    """Test deduplication of repeated shortens"""
+
+    def test_same_target_returns_existing_link(self, client: TestClient, auth_headers, dedup):
+        """Test that a repeat shorten, up to normalization, returns the first link"""
+        headers = auth_headers()
+        first = client.post("/shorten", json={"target_url": "https://Example.com:443"}, headers=headers).json()
+        second = client.post("/shorten", json={"target_url": "https://example.com/"}, headers=headers).json()
+        assert second["short_key"] == first["short_key"]
+        assert second["id"] == first["id"]
+
+    def test_policy_and_owner_keep_links_apart(self, client: TestClient, auth_headers, dedup):
+        """Test that a different redirect policy or owner gets its own link"""
+        headers = auth_headers()
+        plain = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers).json()
+        permanent = client.post(
+            "/shorten", json={"target_url": "https://example.com", "redirect_status": 301}, headers=headers
+        ).json()
+        other = client.post(
+            "/shorten", json={"target_url": "https://example.com"}, headers=auth_headers("dedupother")
+        ).json()
+        assert len({plain["short_key"], permanent["short_key"], other["short_key"]}) == 3
+
+    def test_off_by_default(self, client: TestClient, auth_headers):
+        """Test that without dedup mode every shorten mints a new link"""
+        headers = auth_headers()
+        first = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers).json()
+        second = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers).json()
+        assert first["short_key"] != second["short_key"]
+
+
+class TestIdempotencyKey:
+    """Test Idempotency-Key on POST /shorten"""
+
+    def test_retry_replays_response(self, client: TestClient, auth_headers):
+        """Test that a retried request returns the original link"""
+        headers = {**auth_headers(), "Idempotency-Key": "retry-1"}
+        first = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+        second = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+        assert second.status_code == 200
+        assert second.json() == first.json()
+        assert second.headers["idempotent-replayed"] == "true"
+
+    def test_key_reused_for_different_body(self, client: TestClient, auth_headers):
+        """Test that reusing a key with another body is rejected"""
+        headers = {**auth_headers(), "Idempotency-Key": "retry-2"}
+        client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+        response = client.post("/shorten", json={"target_url": "https://example.org"}, headers=headers)
+        assert response.status_code == 422
+
+    def test_keys_scoped_per_user(self, client: TestClient, auth_headers):
+        """Test that two users can use the same key independently"""
+        first = client.post(
+            "/shorten", json={"target_url": "https://example.com"},
+            headers={**auth_headers(), "Idempotency-Key": "shared"},
+        ).json()
+        second = client.post(
+            "/shorten", json={"target_url": "https://example.com"},
+            headers={**auth_headers("idemother"), "Idempotency-Key": "shared"},
+        ).json()
+        assert first["short_key"] != second["short_key"]
+
+
+def test_in_flight_key_conflicts():
+    """Test that a second claim on a pending key is refused"""
+    for store in (IdempotencyStore(), IdempotencyStore(InMemoryRedis())):
+        assert store.begin("user:1", "k", "fp") is None
+        with pytest.raises(KeyInUse):
+            store.begin("user:1", "k", "fp")
+        store.complete("user:1", "k", "fp", {"short_key": "abc"})
+        assert store.begin("user:1", "k", "fp") == {"short_key": "abc"}
+
+
+def test_unreadable_record_is_not_an_error():
+    """Test that a Redis error reading back a claimed key falls back instead of failing the request"""
+    class BrokenGet(InMemoryRedis):
+        def get(self, name):
+            raise redis.ConnectionError("down")
+
+    store = IdempotencyStore(BrokenGet())
+    assert store.begin("user:1", "k", "fp") is None
+    with pytest.raises(KeyInUse):
+        store.begin("user:1", "k", "fp")
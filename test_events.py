@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+import crud
+import events
+
+
+class TestClickEvents:
+    """Test the click event pipeline and GET /stats/{key}"""
+
+    def test_redirect_only_enqueues(self, client: TestClient, auth_headers, db_session):
+        """Test that a redirect buffers an event without writing it"""
+        headers = auth_headers("eventowner")
+        key = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers).json()["short_key"]
+        client.get(f"/{key}", follow_redirects=False)
+        assert len(events.pipeline.buffer) == 1
+        assert db_session.execute(select(func.count()).select_from(crud.click_events)).scalar() == 0
+
+    def test_stats_read_rollups(self, client: TestClient, auth_headers):
+        """Test that flushed events show up as series, referrers and agents"""
+        headers = auth_headers("eventowner")
+        key = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers).json()["short_key"]
+        client.get(f"/{key}", follow_redirects=False, headers={"Referer": "https://news.example.org/post", "User-Agent": "Mozilla/5.0 (iPhone)"})
+        client.get(f"/{key}", follow_redirects=False, headers={"User-Agent": "Googlebot/2.1"})
+        events.pipeline.flush()
+
+        for granularity in ("hour", "day"):
+            response = client.get(f"/stats/{key}", params={"granularity": granularity}, headers=headers)
+            assert response.status_code == 200
+            stats = response.json()
+            assert sum(point["clicks"] for point in stats["series"]) == 2
+        assert {r["value"]: r["clicks"] for r in stats["referrers"]} == {"news.example.org": 1, "direct": 1}
+        assert {a["value"]: a["clicks"] for a in stats["agents"]} == {"mobile": 1, "bot": 1}
+
+    def test_daily_stats_include_the_first_day(self, client: TestClient, auth_headers):
+        """Test that the oldest daily bucket in the window counts though it starts before `days` ago"""
+        headers = auth_headers("eventowner")
+        key = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers).json()["short_key"]
+        yesterday = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        events.pipeline.buffer.append((key, yesterday.timestamp(), None, "curl/8.0"))
+        events.pipeline.flush()
+
+        stats = client.get(f"/stats/{key}", params={"granularity": "day", "days": 1}, headers=headers).json()
+        assert [point["clicks"] for point in stats["series"]] == [1]
+        assert stats["agents"] == [{"value": "bot", "clicks": 1}]
+
+    def test_stats_only_for_owner(self, client: TestClient, auth_headers):
+        """Test that another user's link is reported as not found"""
+        key = client.post("/shorten", json={"target_url": "https://example.com"}, headers=auth_headers("eventowner")).json()["short_key"]
+        response = client.get(f"/stats/{key}", headers=auth_headers("someoneelse"))
+        assert response.status_code == 404
+
+
+def test_ring_buffer_drops_oldest_when_full():
+    """Test that a full buffer overwrites the oldest events and counts them"""
+    pipeline = events.ClickEventPipeline(capacity=2, enabled=True)
+    for key in ("a", "b", "c"):
+        pipeline.record(key)
+    assert [event[0] for event in pipeline.buffer] == ["b", "c"]
+    assert pipeline.dropped == 1
+
+
+def test_classify_agent():
+    """Test coarse user agent classes"""
+    assert events.classify_agent("Mozilla/5.0 (Windows NT 10.0; Win64; x64)") == "desktop"
+    assert events.classify_agent("Mozilla/5.0 (iPad; CPU OS 17_0)") == "tablet"
+    assert events.classify_agent("curl/8.0") == "bot"
+    assert events.classify_agent(None) == "unknown"
+
+
+def test_create_all_partitions_click_events():
+    """Test that a Postgres schema built from the models is partitioned like the migration's"""
+    ddl = str(CreateTable(crud.click_events).compile(dialect=postgresql.dialect()))
+    assert "PARTITION BY RANGE (occurred_at)" in ddl
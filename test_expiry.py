@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+import cache
+import crud
+import expiry
+
+
+def expired(shorten, db_session, expires_at) -> str:
+    """A link whose expiry has passed; /shorten only takes future ones, so it is set on the row"""
+    key = shorten()
+    db_session.query(crud.URL).filter_by(short_key=key).update({"expires_at": crud.URLBase.as_naive_utc(expires_at)})
+    db_session.commit()
+    cache.redirect_cache.invalidate(key)
+    return key
+
+
+class TestLinkExpiry:
+    """Test per-link expiry on the redirect path"""
+
+    def test_expired_link_is_gone(self, client: TestClient, shorten, db_session):
+        """Test that an expired link answers 410 and a live one still redirects"""
+        now = datetime.now(timezone.utc)
+        gone = expired(shorten, db_session, now - timedelta(minutes=1))
+        live = shorten(expires_at=now + timedelta(hours=1))
+        assert client.get(f"/{gone}", follow_redirects=False).status_code == 410
+        assert client.get(f"/{live}", follow_redirects=False).status_code == 307
+
+    def test_expiry_read_from_database(self, client: TestClient, shorten, db_session):
+        """Test that expiry survives a cold cache"""
+        key = expired(shorten, db_session, datetime.now(timezone.utc) - timedelta(seconds=1))
+        cache.redirect_cache.clear()
+        assert client.get(f"/{key}", follow_redirects=False).status_code == 410
+        assert cache.redirect_cache.get(key).expires_at is not None
+
+    def test_past_expiry_rejected(self, client: TestClient, auth_headers):
+        """Test that /shorten and /shorten/bulk refuse a link that would already be expired"""
+        headers = auth_headers()
+        past = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+        response = client.post("/shorten", json={"target_url": "https://example.com", "expires_at": past}, headers=headers)
+        assert response.status_code == 422
+        assert "must be in the future" in response.text
+        bulk = client.post("/shorten/bulk", json=[{"target_url": "https://example.com", "expires_at": past}], headers=headers)
+        assert "must be in the future" in bulk.json()["error"]
+
+    def test_max_age_capped_at_expiry(self, client: TestClient, shorten):
+        """Test that Cache-Control never outlives the link"""
+        key = shorten(expires_at=datetime.now(timezone.utc) + timedelta(seconds=60), cache_max_age=86400)
+        max_age = int(client.get(f"/{key}", follow_redirects=False).headers["cache-control"].split("=")[1])
+        assert 0 < max_age <= 60
+
+
+class TestPurge:
+    """Test the batched purge of expired links"""
+
+    def test_purge_deletes_only_expired(self, client: TestClient, shorten, db_session, monkeypatch):
+        """Test that expired links past the grace period are deleted in batches"""
+        now = datetime.now(timezone.utc)
+        gone = [expired(shorten, db_session, now - timedelta(hours=1)) for _ in range(5)]
+        recent = expired(shorten, db_session, now - timedelta(seconds=1))
+        forever = shorten()
+
+        monkeypatch.setattr(expiry.purger, "batch_size", 2)
+        monkeypatch.setattr(expiry.purger, "grace", timedelta(seconds=60))
+        assert expiry.purger.purge() == 5
+
+        remaining = {url.short_key for url in db_session.query(crud.URL)}
+        assert remaining == {recent, forever}
+        assert not remaining & set(gone)
+        assert client.get(f"/{gone[0]}", follow_redirects=False).status_code == 404
@@ -0,0 +1,50 @@
+import pytest
+
+import crud
+import keys
+
+
+@pytest.fixture()
+def owner(db_session):
+    user = crud.USER(username="keytest", hashed_password="x")
+    db_session.add(user)
+    db_session.commit()
+    return user.id
+
+
+class TestKeyStrategies:
+    """Test short key generation"""
+
+    def test_key_for_number_is_unique_and_fixed_length(self):
+        """Test that consecutive numbers map to distinct 7 character keys"""
+        generated = {keys.key_for_number(n) for n in range(10_000)}
+        assert len(generated) == 10_000
+        assert {len(key) for key in generated} == {keys.KEY_LENGTH}
+
+    @pytest.mark.parametrize("keygen", [keys.RandomKeys(), keys.SequenceKeys(), keys.BlockKeys(block_size=3)])
+    def test_strategies_create_distinct_keys(self, db_session, owner, keygen):
+        """Test that every strategy inserts rows with unique keys"""
+        created = [keys.create_url(db_session, f"https://example.com/{i}", owner, keygen) for i in range(7)]
+        assert len({entry.short_key for entry in created}) == 7
+        for entry in created:
+            assert crud.get_url_by_key(db_session, entry.short_key).target_url == entry.target_url
+
+    def test_block_strategy_leases_new_ranges(self, db_session, owner):
+        """Test that workers sharing the table never receive overlapping blocks"""
+        first, second = keys.BlockKeys(block_size=2), keys.BlockKeys(block_size=2)
+        leased = [gen.next_key(db_session) for gen in (first, second, first, second, first)]
+        assert len(set(leased)) == 5
+
+    def test_collision_is_retried(self, db_session, owner):
+        """Test that a key taken by another row is retried without a pre-check read"""
+        taken = keys.create_url(db_session, "https://example.com/a", owner)
+
+        class Colliding:
+            def __init__(self):
+                self.keys = [taken.short_key, "freshkey"]
+
+            def next_key(self, db):
+                return self.keys.pop(0)
+
+        entry = keys.create_url(db_session, "https://example.com/b", owner, Colliding())
+        assert entry.short_key == "freshkey"
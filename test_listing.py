@@ -0,0 +1,70 @@
+import csv
+import io
+
+from fastapi.testclient import TestClient
+
+import clicks
+from conftest import engine
+
+
+class TestListURLs:
+    """Test GET /urls and GET /urls/export"""
+
+    def test_pages_cover_every_link_once(self, client: TestClient, auth_headers, shorten):
+        """Test that following next_cursor walks all links newest first"""
+        headers = auth_headers()
+        created = [shorten(f"https://example.com/{i}") for i in range(7)]
+        shorten("https://other.example", headers=auth_headers("otheruser"))
+
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+            page = client.get("/urls", params=params, headers=headers).json()
+            seen += [item["short_key"] for item in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert seen == list(reversed(created))
+
+    def test_sort_by_clicks(self, client: TestClient, auth_headers, shorten):
+        """Test ordering by click count across pages"""
+        headers = auth_headers()
+        created = [shorten(f"https://example.com/{i}") for i in range(4)]
+        for hits, key in zip((2, 0, 5, 1), created):
+            for _ in range(hits):
+                client.get(f"/{key}", follow_redirects=False)
+        clicks.aggregator.flush()
+
+        first = client.get("/urls", params={"sort": "clicks", "limit": 2}, headers=headers).json()
+        second = client.get("/urls", params={"sort": "clicks", "limit": 2, "cursor": first["next_cursor"]}, headers=headers).json()
+        assert [item["clicks"] for item in first["items"] + second["items"]] == [5, 2, 1, 0]
+        assert second["next_cursor"] is None
+
+    def test_invalid_cursor(self, client: TestClient, auth_headers):
+        """Test that a tampered cursor is rejected"""
+        response = client.get("/urls", params={"cursor": "not-a-cursor"}, headers=auth_headers())
+        assert response.status_code == 400
+
+    def test_export_csv_and_ndjson(self, client: TestClient, auth_headers, shorten):
+        """Test that exports stream every link in both formats"""
+        headers = auth_headers()
+        for i in range(5):
+            shorten(f"https://example.com/{i}")
+
+        ndjson = client.get("/urls/export", headers=headers)
+        assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+        assert len(ndjson.text.splitlines()) == 5
+
+        exported = client.get("/urls/export", params={"format": "csv"}, headers=headers)
+        rows = list(csv.DictReader(io.StringIO(exported.text)))
+        assert len(rows) == 5
+        assert rows[0].keys() == {"id", "short_key", "target_url", "clicks"}
+
+    def test_export_returns_its_connection(self, client: TestClient, auth_headers, shorten):
+        """Test that a finished export leaves no connection checked out of the pool"""
+        headers = auth_headers()
+        for i in range(3):
+            shorten(f"https://example.com/{i}")
+        for _ in range(3):
+            assert len(client.get("/urls/export", headers=headers).text.splitlines()) == 3
+            assert engine.pool.checkedout() == 0
@@ -239,10 +239,8 @@ class TestDataValidation:
         headers = {"Authorization": f"Bearer {token}"}
         url_data = {"target_url": "not-a-valid-url"}
         
-        # This should still work as we're not validating URL format in backend
-        # But in a real app, you might want to add URL validation
         response = client.post("/shorten", json=url_data, headers=headers)
-        assert response.status_code == 200
+        assert response.status_code == 422  # Validation error
 
 
 class TestIntegrationFlow:
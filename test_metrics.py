@@ -0,0 +1,46 @@
+from fastapi.testclient import TestClient
+
+
+def sample(body: str, name: str, labels: str = "") -> float:
+    """Return the value of one sample line from the exposition format"""
+    prefix = f"{name}{{{labels}}} " if labels else f"{name} "
+    for line in body.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+class TestMetricsEndpoint:
+    """Test GET /metrics"""
+
+    def test_exposes_route_latency_and_404s(self, client: TestClient):
+        """Test that redirects are timed by route template and 404s are counted"""
+        before = client.get("/metrics").text
+        client.get("/unknownkey")
+        after = client.get("/metrics").text
+
+        route = 'method="GET",route="/{key}"'
+        assert sample(after, "http_request_duration_seconds_count", route) == sample(before, "http_request_duration_seconds_count", route) + 1
+        assert sample(after, "redirect_not_found_total") == sample(before, "redirect_not_found_total") + 1
+        assert sample(after, "redirect_cache_lookups_total", 'result="miss"') >= 1
+
+    def test_exposes_db_and_pool_metrics(self, client: TestClient):
+        """Test that query timings and pool gauges are published"""
+        client.post("/register", json={"username": "metricsuser", "password": "testpass123"})
+        body = client.get("/metrics").text
+        assert sample(body, "db_query_duration_seconds_count", 'operation="INSERT"') >= 1
+        assert "db_pool_size" in body
+        assert "password_hash_queue_depth" in body
+
+    def test_metrics_do_not_touch_the_database(self, client: TestClient, monkeypatch):
+        """Test that scraping works with every session dependency failing"""
+        import crud
+        from main import app
+
+        def broken_db():
+            raise AssertionError("database used by /metrics")
+
+        monkeypatch.setitem(app.dependency_overrides, crud.get_db, broken_db)
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
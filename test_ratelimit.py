@@ -0,0 +1,76 @@
+from fastapi.testclient import TestClient
+
+import main
+import ratelimit
+from cache import InMemoryRedis
+from ratelimit import MemoryRateStore, RateLimiter, RedisRateStore
+
+
+class TestRateLimiter:
+    """Test the sliding-window limiter on both stores"""
+
+    def test_limits_within_window(self):
+        """Test that requests over the limit are refused until the window moves on"""
+        for store in (MemoryRateStore(), RedisRateStore(InMemoryRedis())):
+            limiter = RateLimiter(store, enabled=True)
+            assert all(limiter.check("ip", "1.2.3.4", (3, 60), now=600) == 0 for _ in range(3))
+            assert limiter.check("ip", "1.2.3.4", (3, 60), now=610) == 50
+            assert limiter.check("ip", "5.6.7.8", (3, 60), now=610) == 0
+
+    def test_previous_window_is_weighted(self):
+        """Test that hits late in one window still count early in the next"""
+        limiter = RateLimiter(MemoryRateStore(), enabled=True)
+        for _ in range(3):
+            limiter.check("user", "1", (3, 60), now=650)
+        # 3 * 0.75 from the previous window + 1 now is over the limit
+        assert limiter.check("user", "1", (3, 60), now=675) > 0
+        # Two windows on, the old hits no longer count
+        assert limiter.check("user", "1", (3, 60), now=780) == 0
+
+    def test_redis_store_shared_between_replicas(self):
+        """Test that two limiters on one Redis share the counts"""
+        shared = InMemoryRedis()
+        first = RateLimiter(RedisRateStore(shared), enabled=True)
+        second = RateLimiter(RedisRateStore(shared), enabled=True)
+        first.check("ip", "1.2.3.4", (2, 60), now=600)
+        first.check("ip", "1.2.3.4", (2, 60), now=600)
+        assert second.check("ip", "1.2.3.4", (2, 60), now=601) > 0
+
+
+class TestRateLimitedRoutes:
+    """Test 429 responses from the app"""
+
+    def test_token_limited_per_ip(self, client: TestClient, monkeypatch):
+        """Test that /token answers 429 with Retry-After once an IP is over its limit"""
+        monkeypatch.setattr(ratelimit, "IP_LIMIT", (2, 60))
+        form = {"username": "nobody", "password": "wrongpass"}
+        assert client.post("/token", data=form).status_code == 401
+        assert client.post("/token", data=form).status_code == 401
+        response = client.post("/token", data=form)
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) >= 1
+        # Another client is unaffected
+        other = TestClient(main.app, client=("203.0.113.8", 50000))
+        assert other.post("/token", data=form).status_code == 401
+
+    def test_real_ip_only_from_trusted_proxies(self, client: TestClient, monkeypatch):
+        """Test that X-Real-IP is ignored unless the peer is a configured proxy"""
+        monkeypatch.setattr(ratelimit, "IP_LIMIT", (2, 60))
+        monkeypatch.setattr(ratelimit, "RATE_LIMIT_TRUST_PROXY", True)
+        monkeypatch.setattr(ratelimit, "TRUSTED_PROXIES", ratelimit.parse_networks("10.0.0.0/8"))
+        form = {"username": "nobody", "password": "wrongpass"}
+        direct = TestClient(main.app, client=("203.0.113.7", 50000))
+        statuses = [direct.post("/token", data=form, headers={"X-Real-IP": f"198.51.100.{i}"}).status_code for i in range(3)]
+        assert statuses == [401, 401, 429]
+
+        proxy = TestClient(main.app, client=("10.1.2.3", 50000))
+        for i in range(3):
+            assert proxy.post("/token", data=form, headers={"X-Real-IP": f"198.51.100.{i}"}).status_code == 401
+
+    def test_shorten_limited_per_user(self, client: TestClient, auth_headers, monkeypatch):
+        """Test that one user's writes are limited regardless of IP"""
+        monkeypatch.setattr(ratelimit, "USER_LIMIT", (2, 60))
+        headers = auth_headers()
+        for i, expected in enumerate([200, 200, 429]):
+            response = client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+            assert response.status_code == expected
@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture(params=[False, True], ids=["response", "prebuilt"])
+def prebuilt(request, monkeypatch):
+    monkeypatch.setattr(main, "REDIRECT_PREBUILT", request.param)
+    return request.param
+
+
+class TestRedirectPolicy:
+    """Test per-link redirect status and caching headers"""
+
+    def test_permanent_redirect_with_max_age(self, client: TestClient, shorten, prebuilt):
+        """Test that a 301 link is served with its Cache-Control"""
+        key = shorten("https://example.com/a b", redirect_status=301, cache_max_age=86400)
+        for _ in range(2):
+            response = client.get(f"/{key}", follow_redirects=False)
+            assert response.status_code == 301
+            assert response.headers["location"] == "https://example.com/a%20b"
+            assert response.headers["cache-control"] == "public, max-age=86400"
+
+    def test_default_policy(self, client: TestClient, shorten, prebuilt):
+        """Test that links without a policy keep the 307 without caching headers"""
+        key = shorten("https://example.com/a b")
+        response = client.get(f"/{key}", follow_redirects=False)
+        assert response.status_code == 307
+        assert "cache-control" not in response.headers
+
+    def test_invalid_status_rejected(self, client: TestClient, auth_headers):
+        """Test that only redirect status codes are accepted"""
+        response = client.post(
+            "/shorten",
+            json={"target_url": "https://example.com", "redirect_status": 200},
+            headers=auth_headers(),
+        )
+        assert response.status_code == 422
+
+
+def test_prebuilt_headers_match_redirect_response(monkeypatch):
+    """Test that prebuilt header bytes equal what RedirectResponse produces"""
+    entry = main.cache.CachedURL("https://example.com/ü?q=1", 302, 60)
+    monkeypatch.setattr(main, "REDIRECT_PREBUILT", False)
+    built = main.redirect_response(entry)
+    prebuilt = main.PrebuiltRedirect(entry)
+    assert prebuilt.status_code == built.status_code == 302
+    assert sorted(prebuilt.raw_headers) == sorted(built.raw_headers)
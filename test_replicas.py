@@ -0,0 +1,83 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, select
+
+import cache
+import crud
+from conftest import engine
+
+
+@pytest.fixture()
+def replica(client, tmp_path, monkeypatch):
+    """A second SQLite file standing in for a read replica (with no replication)"""
+    url = f"sqlite:///{tmp_path / 'replica.db'}"
+    replicas = crud.ReplicaSet([url])
+    monkeypatch.setattr(crud, "replicas", replicas)
+    replica = replicas.replicas[0]
+    crud.Base.metadata.create_all(bind=replica.engine())
+    yield replica
+    crud.recent_writers.clear()
+    replica.engine().dispose()
+    crud.engines.remove(replica.engine())
+
+
+class TestReplicaRouting:
+    """Test read/write routing between the primary and a replica"""
+
+    def test_redirect_reads_from_replica(self, client: TestClient, replica):
+        """Test that a redirect lookup is answered by the replica"""
+        with replica.engine().begin() as conn:
+            conn.execute(crud.URL.__table__.insert().values(short_key="onreplica", target_url="https://replica.example", owner_id=1, clicks=0))
+        response = client.get("/onreplica", follow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["location"] == "https://replica.example"
+
+    def test_writes_go_to_primary(self, client: TestClient, auth_headers, replica, db_session):
+        """Test that shortening inserts on the primary only"""
+        key = client.post("/shorten", json={"target_url": "https://example.com"}, headers=auth_headers()).json()["short_key"]
+        assert db_session.query(crud.URL).filter_by(short_key=key).count() == 1
+        with replica.engine().connect() as conn:
+            assert conn.execute(crud.URL.__table__.select()).all() == []
+
+    def test_lagging_replica_falls_back_to_primary(self, client: TestClient, auth_headers, replica):
+        """Test that a key the replica hasn't seen yet is found on the primary"""
+        key = client.post("/shorten", json={"target_url": "https://example.com"}, headers=auth_headers()).json()["short_key"]
+        cache.redirect_cache.clear()
+        assert client.get(f"/{key}", follow_redirects=False).status_code == 307
+
+    def test_read_your_writes(self, client: TestClient, auth_headers, replica):
+        """Test that a user's listing comes from the primary right after they shorten"""
+        headers = auth_headers()
+        client.post("/shorten", json={"target_url": "https://example.com"}, headers=headers)
+        assert len(client.get("/urls", headers=headers).json()["items"]) == 1
+
+        # Once the sticky window has passed the listing is served by the (empty) replica
+        crud.recent_writers.clear()
+        assert client.get("/urls", headers=headers).json()["items"] == []
+
+    def test_flush_stays_on_primary(self, client: TestClient, replica):
+        """Test that a read-only session sends what runs during a flush to the primary"""
+        db = crud.SessionLocal(bind=engine, info={"read_only": True})
+        binds = []
+        event.listen(db, "before_flush", lambda session, *args: binds.append(crud._replica_bind(session, select(1), is_async=False)))
+        try:
+            db.add(crud.URL(short_key="flushed", target_url="https://example.com", owner_id=1, clicks=0))
+            db.flush()
+            assert binds == [None]
+            assert crud._replica_bind(db, select(1), is_async=False) is replica.engine()
+        finally:
+            db.rollback()
+            db.close()
+
+
+def test_unreachable_replica_is_skipped(client: TestClient, monkeypatch):
+    """Test that a failing replica is marked down and the primary answers"""
+    replicas = crud.ReplicaSet(["sqlite:////nonexistent/dir/replica.db"])
+    monkeypatch.setattr(crud, "replicas", replicas)
+    user_data = {"username": "replicadown", "password": "testpass123"}
+    client.post("/register", json=user_data)
+    assert client.post("/token", data=user_data).status_code == 200
+    replica = replicas.replicas[0]
+    assert replica.failures == 1 and not replica.healthy
+    assert replicas.choose() is None
+    crud.engines.remove(replica.engine())
@@ -0,0 +1,156 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+import cache
+import crud
+import sharding
+from rebalance import Rebalancer
+
+
+def shard_urls(tmp_path, *names) -> dict:
+    return {name: f"sqlite:///{tmp_path / name}.db" for name in names}
+
+
+def use_shards(monkeypatch, shards: sharding.ShardSet) -> sharding.ShardSet:
+    monkeypatch.setattr(crud, "shards", shards)
+    crud.create_shard_schema()
+    return shards
+
+
+def dispose(shards: sharding.ShardSet):
+    for shard in shards:
+        if shard._engine is not None:
+            shard.engine.dispose()
+            crud.engines.remove(shard.engine)
+
+
+@pytest.fixture()
+def shards(client, tmp_path, monkeypatch):
+    """Three SQLite files standing in for three shard databases"""
+    shards = use_shards(monkeypatch, sharding.ShardSet(shard_urls(tmp_path, "a", "b", "c"), crud.make_engine))
+    yield shards
+    dispose(shards)
+
+
+def keys_on(shard: sharding.Shard) -> set:
+    with shard.engine.connect() as conn:
+        return set(conn.execute(select(crud.URL.short_key)).scalars())
+
+
+class TestHashRing:
+    """Test key placement on the consistent-hash ring"""
+
+    def test_parse_shards(self):
+        """Test named and unnamed shard lists"""
+        assert sharding.parse_shards("a=sqlite:///a.db, b=sqlite:///b.db") == {"a": "sqlite:///a.db", "b": "sqlite:///b.db"}
+        assert sharding.parse_shards("sqlite:///a.db,sqlite:///b.db") == {"shard0": "sqlite:///a.db", "shard1": "sqlite:///b.db"}
+
+    def test_adding_a_node_moves_few_keys(self):
+        """Test that a fourth node takes about a quarter of the keys, all from the others"""
+        keys = [f"key{i}" for i in range(10000)]
+        before = sharding.HashRing(["a", "b", "c"])
+        after = sharding.HashRing(["a", "b", "c", "d"])
+        moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+        assert all(after.node_for(key) == "d" for key in moved)
+        assert 0.15 < len(moved) / len(keys) < 0.35
+
+
+class TestShardRouting:
+    """Test that links are stored on and read from their key's shard"""
+
+    def test_shorten_and_redirect(self, client: TestClient, auth_headers, shards, db_session):
+        """Test that a new link lands on its shard only and redirects from there"""
+        key = client.post("/shorten", json={"target_url": "https://example.com"}, headers=auth_headers()).json()["short_key"]
+        assert db_session.query(crud.URL).count() == 0
+        assert [shard.name for shard in shards if key in keys_on(shard)] == [shards.for_key(key).name]
+
+        cache.redirect_cache.clear()
+        response = client.get(f"/{key}", follow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["location"] == "https://example.com"
+
+    def test_bulk_shorten_spreads_links(self, client: TestClient, auth_headers, shards):
+        """Test that a bulk chunk is split by shard"""
+        targets = [f"https://example.com/{i}" for i in range(30)]
+        response = client.post("/shorten/bulk", json=targets, headers=auth_headers())
+        assert response.status_code == 200
+        for shard in shards:
+            assert all(shards.for_key(key) is shard for key in keys_on(shard))
+        assert sum(len(keys_on(shard)) for shard in shards) == 30
+
+    def test_listing_gathers_every_shard(self, client: TestClient, auth_headers, shards):
+        """Test that paging through a user's links visits every shard once"""
+        headers = auth_headers()
+        created = {client.post("/shorten", json={"target_url": f"https://example.com/{i}"}, headers=headers).json()["short_key"] for i in range(7)}
+        for sort in ("created", "clicks"):
+            listed, cursor = [], None
+            while True:
+                params = {"limit": 3, "sort": sort, **({"cursor": cursor} if cursor else {})}
+                page = client.get("/urls", params=params, headers=headers).json()
+                listed += [item["short_key"] for item in page["items"]]
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    break
+            assert sorted(listed) == sorted(created)
+
+
+class TestRebalance:
+    """Test moving links after a shard is added"""
+
+    def test_rebalance_moves_and_resumes(self, client: TestClient, auth_headers, tmp_path, monkeypatch):
+        """Test that an interrupted rebalance resumes and leaves every key on its new shard"""
+        old = shard_urls(tmp_path, "a", "b")
+        before = use_shards(monkeypatch, sharding.ShardSet(old, crud.make_engine))
+        headers = auth_headers()
+        response = client.post("/shorten/bulk", json=[f"https://example.com/{i}" for i in range(40)], headers=headers)
+        created = {json.loads(line)["short_key"] for line in response.text.splitlines()}
+        dispose(before)
+
+        after = use_shards(monkeypatch, sharding.ShardSet({**old, **shard_urls(tmp_path, "c")}, crud.make_engine, previous=old))
+        try:
+            moving = [key for key in created if after.for_key(key).name == "c"]
+            assert moving
+
+            # Before anything moves, keys are still found on their old shard
+            cache.redirect_cache.clear()
+            assert client.get(f"/{moving[0]}", follow_redirects=False).status_code == 307
+
+            state = str(tmp_path / "rebalance.json")
+            Rebalancer(after, batch_size=5, state_path=state).run(max_batches=2)
+            resumed = Rebalancer(after, batch_size=5, state_path=state)
+            assert resumed.state
+            resumed.run()
+
+            assert keys_on(after.shards["c"]) == set(moving)
+            assert set().union(*(keys_on(shard) for shard in after)) == created
+            for shard in after:
+                assert all(after.for_key(key) is shard for key in keys_on(shard))
+            cache.redirect_cache.clear()
+            assert client.get(f"/{moving[0]}", follow_redirects=False).status_code == 307
+        finally:
+            dispose(after)
+
+    def test_conflicting_key_is_kept(self, client: TestClient, auth_headers, tmp_path, monkeypatch):
+        """Test that a row whose key is another link on the new shard is reported, not deleted"""
+        old = shard_urls(tmp_path, "a", "b")
+        before = use_shards(monkeypatch, sharding.ShardSet(old, crud.make_engine))
+        response = client.post("/shorten/bulk", json=[f"https://example.com/{i}" for i in range(20)], headers=auth_headers())
+        created = {json.loads(line)["short_key"] for line in response.text.splitlines()}
+        dispose(before)
+
+        after = use_shards(monkeypatch, sharding.ShardSet({**old, **shard_urls(tmp_path, "c")}, crud.make_engine, previous=old))
+        try:
+            taken, *moving = [key for key in created if after.for_key(key).name == "c"]
+            with after.shards["c"].engine.begin() as conn:
+                conn.execute(crud.URL.__table__.insert().values(short_key=taken, target_url="https://other.example", owner_id=1, clicks=0))
+
+            rebalancer = Rebalancer(after, batch_size=5)
+            rebalancer.run()
+            assert [key for _, _, key in rebalancer.conflicts] == [taken]
+            assert taken in keys_on(after.shards["a"]) | keys_on(after.shards["b"])
+            assert keys_on(after.shards["c"]) == {taken, *moving}
+        finally:
+            dispose(after)
@@ -0,0 +1,92 @@
+import os
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import cache
+import snapshot
+from conftest import TestingSessionLocal
+
+
+@pytest.fixture()
+def store(client, tmp_path, monkeypatch):
+    """Snapshot redirects from a file in tmp_path"""
+    store = snapshot.SnapshotStore(str(tmp_path / "urls.snap"))
+    monkeypatch.setattr(snapshot, "store", store)
+    return store
+
+
+class TestSnapshotFile:
+    """Test exporting and reading snapshot files"""
+
+    def test_round_trip(self, client: TestClient, shorten, store):
+        """Test that every link and its redirect policy comes back from the file"""
+        plain = shorten(target_url="https://example.com/plain")
+        cached = shorten(target_url="https://example.com/cached", redirect_status=301, cache_max_age=600)
+        expires_at = (datetime.now(timezone.utc) + timedelta(days=1)).replace(microsecond=0)
+        expiring = shorten(target_url="https://example.com/expiring", expires_at=expires_at)
+
+        assert snapshot.export_from_db(store.path, TestingSessionLocal, batch_size=2) == 3
+        file = snapshot.Snapshot(store.path)
+        assert len(file) == 3
+        assert file.get(plain) == cache.CachedURL("https://example.com/plain")
+        assert file.get(cached) == cache.CachedURL("https://example.com/cached", 301, 600)
+        assert file.get(expiring).expires_at == expires_at.timestamp()
+        assert file.get("nosuchkey") is None
+
+    def test_rejects_unsorted_rows(self, tmp_path):
+        """Test that export refuses rows out of key order and leaves no file behind"""
+        rows = [
+            SimpleNamespace(short_key=key, target_url="https://example.com", redirect_status=None, cache_max_age=None, expires_at=None)
+            for key in ("b", "a")
+        ]
+        with pytest.raises(ValueError):
+            snapshot.export(str(tmp_path / "urls.snap"), rows)
+        assert os.listdir(tmp_path) == []
+
+
+class TestSnapshotRedirects:
+    """Test redirecting from a snapshot"""
+
+    def test_redirects_without_the_database(self, client: TestClient, shorten, store, monkeypatch):
+        """Test that a key in the snapshot is answered without a query"""
+        key = shorten(target_url="https://example.com")
+        snapshot.export_from_db(store.path, TestingSessionLocal)
+        assert store.reload()
+        cache.redirect_cache.clear()
+
+        def no_database(*args, **kwargs):
+            raise AssertionError("the database was queried")
+
+        monkeypatch.setattr("crud.run_read", no_database)
+        response = client.get(f"/{key}", follow_redirects=False)
+        assert response.status_code == 307
+        assert response.headers["location"] == "https://example.com"
+        assert store.stats["hits"] == 1
+
+    def test_newer_keys_fall_back_to_the_database(self, client: TestClient, shorten, store):
+        """Test that a key created after the export is still found"""
+        shorten(target_url="https://example.com/old")
+        snapshot.export_from_db(store.path, TestingSessionLocal)
+        store.reload()
+        key = shorten(target_url="https://example.com/new")
+        cache.redirect_cache.clear()
+        assert client.get(f"/{key}", follow_redirects=False).headers["location"] == "https://example.com/new"
+        assert store.stats["misses"] == 1
+
+    def test_hot_swap(self, client: TestClient, shorten, store):
+        """Test that a new export is picked up while the old mapping stays readable"""
+        first = shorten(target_url="https://example.com/1")
+        snapshot.export_from_db(store.path, TestingSessionLocal)
+        assert store.reload()
+        old = store.current
+        assert not store.reload()
+
+        second = shorten(target_url="https://example.com/2")
+        snapshot.export_from_db(store.path, TestingSessionLocal)
+        assert store.reload()
+        assert store.current.get(second) is not None
+        assert old.get(first) == cache.CachedURL("https://example.com/1")
+        assert store.stats["reloads"] == 2
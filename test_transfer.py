@@ -0,0 +1,93 @@
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import transfer
+from conftest import TestingSessionLocal
+
+
+CSV = """short_key,target_url,owner,redirect_status,cache_max_age,expires_at,clicks,created_at
+old-1,https://example.com/1,,301,600,,12,2020-01-02T03:04:05Z
+old-2,https://example.com/2,importer,,,,,
+old-2,https://example.com/again,,,,,,
+bad key,https://example.com/3,,,,,,
+old-4,https://example.com/4,,299,,,,
+old-5,https://example.com/5,nobody,,,,,
+old-6,https://example.com/6,,302,,,-1,
+"""
+
+
+def run_import(text: str, format: str = "csv", **options) -> tuple:
+    rejects = io.StringIO()
+    importer = transfer.Importer(TestingSessionLocal, owner="importer", rejects=rejects, **options)
+    result = importer.run(transfer.read_records(io.StringIO(text), format))
+    return result, [json.loads(line) for line in rejects.getvalue().splitlines()]
+
+
+@pytest.fixture()
+def headers(auth_headers):
+    return auth_headers("importer")
+
+
+class TestImport:
+    """Test bulk importing links"""
+
+    def test_valid_rows_are_imported_and_the_rest_rejected(self, client: TestClient, headers):
+        """Test that each bad record is reported with its line and reason"""
+        result, rejects = run_import(CSV, chunk_size=3)
+        assert (result["records"], result["imported"], result["rejected"]) == (7, 2, 5)
+        assert [reject["record"] for reject in rejects] == [3, 4, 5, 6, 7]
+        assert "appears earlier" in rejects[0]["error"]
+        assert rejects[1]["error"].startswith("short_key")
+        assert rejects[2]["error"].startswith("redirect_status")
+        assert "no user named 'nobody'" in rejects[3]["error"]
+        assert rejects[4]["error"].startswith("clicks")
+
+        links = {item["short_key"]: item for item in client.get("/urls", headers=headers).json()["items"]}
+        assert links["old-1"]["clicks"] == 12
+        assert set(links) == {"old-1", "old-2"}
+
+        response = client.get("/old-1", follow_redirects=False)
+        assert response.status_code == 301
+        assert response.headers["location"] == "https://example.com/1"
+
+    def test_reimport_counts_rows_as_present(self, client: TestClient, headers):
+        """Test that importing the same file twice changes nothing"""
+        run_import(CSV)
+        result, _ = run_import(CSV)
+        assert (result["imported"], result["present"]) == (0, 2)
+
+    def test_conflicting_key(self, client: TestClient, headers):
+        """Test that a key taken by another link is rejected, or stops the run"""
+        key = client.post("/shorten", json={"target_url": "https://example.com/mine"}, headers=headers).json()["short_key"]
+        record = json.dumps({"short_key": key, "target_url": "https://example.com/theirs"}) + "\n"
+        result, rejects = run_import(record, "ndjson")
+        assert result["rejected"] == 1
+        assert "already taken" in rejects[0]["error"]
+        with pytest.raises(transfer.ImportConflict):
+            run_import(record, "ndjson", on_conflict="fail")
+
+    def test_resume(self, client: TestClient, headers, tmp_path):
+        """Test that a rerun with the same state file skips what the last run got through"""
+        state = str(tmp_path / "import.json")
+        lines = [json.dumps({"short_key": f"k{i}", "target_url": f"https://example.com/{i}"}) for i in range(5)]
+        first, _ = run_import("\n".join(lines[:3]), "ndjson", state_path=state, chunk_size=2)
+        second, _ = run_import("\n".join(lines), "ndjson", state_path=state, chunk_size=2)
+        assert first["records"] == 3
+        assert (second["records"], second["imported"], second["present"]) == (5, 5, 0)
+
+
+class TestExport:
+    """Test bulk exporting links"""
+
+    @pytest.mark.parametrize("format", ["csv", "ndjson"])
+    def test_round_trip(self, client: TestClient, headers, format):
+        """Test that an export imports back as already present"""
+        run_import(CSV)
+        out = io.StringIO()
+        assert transfer.export(out, format, TestingSessionLocal, batch_size=1)["exported"] == 2
+        result, rejects = run_import(out.getvalue(), format)
+        assert rejects == []
+        assert (result["records"], result["present"]) == (2, 2)
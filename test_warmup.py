@@ -0,0 +1,54 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import cache
+import crud
+import warmup
+from cache import LocalCache, RedirectCache
+from conftest import TestingSessionLocal
+from test_cache import OffLoopRedis
+from warmup import Warmup
+
+
+class TestWarmup:
+    """Test startup warmup and the probe endpoints"""
+
+    def test_readiness_follows_warmup(self, client: TestClient, monkeypatch):
+        """Test that /readyz is 503 until warmup has run and /healthz is always 200"""
+        state = Warmup(session_factory=TestingSessionLocal, connections=2)
+        monkeypatch.setattr(warmup, "warmup", state)
+        assert client.get("/healthz").status_code == 200
+        assert client.get("/readyz").status_code == 503
+
+        asyncio.run(state.run())
+        response = client.get("/readyz")
+        assert response.status_code == 200
+        steps = response.json()["steps"]
+        assert all(step["ok"] for step in steps.values())
+        assert steps["connections"]["opened"] == 2
+
+    def test_primes_most_clicked_links(self, client: TestClient, shorten, monkeypatch):
+        """Test that the redirect cache is filled with the top links by clicks, off the event loop"""
+        monkeypatch.setattr(cache, "redirect_cache", RedirectCache(LocalCache(), OffLoopRedis()))
+        popular = shorten("https://example.com/popular")
+        quiet = shorten("https://example.com/quiet")
+        db = TestingSessionLocal()
+        try:
+            crud.add_click_counts(db, {popular: 5})
+        finally:
+            db.close()
+        cache.redirect_cache.clear()
+
+        state = Warmup(session_factory=TestingSessionLocal, top_keys=1, connections=1)
+        asyncio.run(state.run())
+        assert state.steps["redirect_cache"]["keys"] == 1
+        assert cache.redirect_cache.local.get(popular).target_url == "https://example.com/popular"
+        assert cache.redirect_cache.local.get(quiet) is cache.MISSING
+        assert cache.redirect_cache.redis.get(f"redirect:{popular}") is not None
+
+    def test_disabled_is_ready_immediately(self):
+        """Test that with warmup off the worker is ready without doing anything"""
+        state = Warmup(enabled=False)
+        asyncio.run(state.run())
+        assert state.ready and state.steps == {}
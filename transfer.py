@@ -0,0 +1,325 @@
+"""Bulk import and export of links, for migrating from another shortener.
+
+Import reads CSV (with a header row) or NDJSON records with the fields
+
+    short_key, target_url, owner, redirect_status, cache_max_age, expires_at, clicks, created_at
+
+of which short_key and target_url are required and owner is a username
+(--owner gives the default). Records are validated and written in chunks:
+COPY on Postgres, one executemany elsewhere. The keys of a chunk are
+checked with one query first. A key that already holds the same target for
+the same owner counts as already present, so re-running an import is
+harmless; any other taken key is rejected, or stops the run with
+--on-conflict fail. Rejected records go to --rejects as NDJSON.
+
+With --state, the number of records consumed is saved after every chunk
+and a rerun skips them. Memory use depends on the chunk size, not the
+input size. Export writes every link in the same format:
+
+    python transfer.py import links.csv --owner migrated --state import.json --rejects rejects.ndjson
+    python transfer.py export links.ndjson
+
+Keys imported while KEY_FILTER is on without REDIS_HOST are only known to
+workers started afterwards.
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Optional
+
+from pydantic import ValidationError, conint, constr, field_validator
+from sqlalchemy.exc import IntegrityError
+
+import bloom
+import cache
+import crud
+
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "10000"))
+
+FIELDS = ["short_key", "target_url", "owner", "redirect_status", "cache_max_age", "expires_at", "clicks", "created_at"]
+# Fixed paths that a key of the same name would be hidden behind
+RESERVED_KEYS = frozenset({"urls", "healthz", "readyz", "metrics", "docs", "redoc", "static"})
+
+logger = logging.getLogger(__name__)
+
+
+class ImportRecord(crud.URLBase):
+    short_key: constr(pattern=r"^[A-Za-z0-9_-]{1,64}$")
+    owner: Optional[str] = None
+    clicks: conint(ge=0) = 0
+    created_at: Optional[datetime] = None
+
+    @field_validator("created_at")
+    @classmethod
+    def created_as_naive_utc(cls, value):
+        return crud.URLBase.as_naive_utc(value)
+
+
+class ImportConflict(Exception):
+    """A short key in the input is already taken by a different link"""
+
+
+def describe(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'record'}: {e['msg']}" for e in error.errors())
+
+
+def read_records(stream, format: str):
+    """Yield (record number, dict or error message) for each input record"""
+    if format == "csv":
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            # Empty cells are missing values; CSV has no other way to write them
+            yield number, {name: value for name, value in row.items() if value not in ("", None)}
+        return
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield number, f"invalid JSON: {exc}"
+            continue
+        yield number, record if isinstance(record, dict) else "record must be a JSON object"
+
+
+def parse_record(item) -> ImportRecord:
+    if isinstance(item, str):
+        raise ValueError(item)
+    status = item.get("redirect_status")
+    if isinstance(status, str) and status.isdigit():
+        item = {**item, "redirect_status": int(status)}
+    try:
+        record = ImportRecord.model_validate(item)
+    except ValidationError as exc:
+        raise ValueError(describe(exc)) from None
+    if record.short_key in RESERVED_KEYS:
+        raise ValueError(f"short_key: {record.short_key!r} is a reserved path")
+    return record
+
+
+class Importer:
+    def __init__(
+        self,
+        session_factory=None,
+        chunk_size: int = IMPORT_CHUNK_SIZE,
+        owner: str = None,
+        on_conflict: str = "skip",
+        state_path: str = None,
+        rejects=None,
+    ):
+        self.session_factory = session_factory or crud.SessionLocal
+        self.chunk_size = chunk_size
+        self.owner = owner
+        self.on_conflict = on_conflict
+        self.state_path = state_path
+        self.rejects = rejects
+        self.owners = cache.LocalCache(maxsize=100_000, ttl=math.inf)
+        self.stats = {"records": 0, "imported": 0, "present": 0, "rejected": 0}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.stats.update(json.load(f))
+
+    def save_state(self):
+        if self.state_path:
+            with open(self.state_path + ".tmp", "w") as f:
+                json.dump(self.stats, f)
+            os.replace(self.state_path + ".tmp", self.state_path)
+
+    def run(self, records) -> dict:
+        """Import records, skipping those a previous run got through; return the counts"""
+        records = islice(records, self.stats["records"], None)
+        started = time.perf_counter()
+        imported = self.stats["imported"]
+        last_report = started
+        db = self.session_factory()
+        try:
+            while True:
+                chunk = list(islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                self.import_chunk(db, chunk)
+                self.stats["records"] += len(chunk)
+                self.save_state()
+                if time.perf_counter() - last_report >= 5:
+                    last_report = time.perf_counter()
+                    logger.info("%s, %.0f rows/s", self.stats, (self.stats["imported"] - imported) / (last_report - started))
+        finally:
+            db.close()
+        seconds = time.perf_counter() - started
+        return {**self.stats, "seconds": seconds, "rows_per_sec": (self.stats["imported"] - imported) / seconds if seconds else 0}
+
+    def reject(self, number: int, error: str):
+        self.stats["rejected"] += 1
+        if self.rejects is not None:
+            self.rejects.write(json.dumps({"record": number, "error": error}) + "\n")
+
+    def import_chunk(self, db, chunk: list):
+        parsed = {}
+        for number, item in chunk:
+            try:
+                record = parse_record(item)
+            except ValueError as exc:
+                self.reject(number, str(exc))
+                continue
+            if record.short_key in parsed:
+                self.reject(number, f"short_key: {record.short_key!r} appears earlier in the input")
+                continue
+            parsed[record.short_key] = (number, record)
+        owner_ids = self.resolve_owners(db, {record.owner or self.owner for _, record in parsed.values()} - {None})
+        for _ in range(2):
+            taken = crud.targets_by_key(db, list(parsed))
+            rows, present, rejected = [], 0, []
+            for key, (number, record) in parsed.items():
+                owner = record.owner or self.owner
+                owner_id = owner_ids.get(owner)
+                if owner_id is None:
+                    rejected.append((number, f"owner: no user named {owner!r}"))
+                elif key not in taken:
+                    rows.append({
+                        "short_key": key,
+                        "target_url": record.target_url,
+                        "owner_id": owner_id,
+                        "clicks": record.clicks,
+                        "redirect_status": record.redirect_status,
+                        "cache_max_age": record.cache_max_age,
+                        "expires_at": record.expires_at,
+                        "created_at": record.created_at or crud.utcnow(),
+                    })
+                elif taken[key] == (record.target_url, owner_id):
+                    present += 1
+                elif self.on_conflict == "fail":
+                    raise ImportConflict(f"record {number}: short key {key!r} is already taken")
+                else:
+                    rejected.append((number, f"short_key: {key!r} is already taken"))
+            try:
+                crud.copy_urls(db, rows)
+            except IntegrityError:
+                # A key was taken between the check and the insert; check the chunk again
+                db.rollback()
+                continue
+            bloom.key_filter.add(*(row["short_key"] for row in rows))
+            self.stats["imported"] += len(rows)
+            self.stats["present"] += present
+            for number, error in rejected:
+                self.reject(number, error)
+            return
+        raise RuntimeError("keys in the chunk kept being taken while it was imported")
+
+    def resolve_owners(self, db, names: set) -> dict:
+        missing = [name for name in names if self.owners.get(name) is cache.MISSING]
+        if missing:
+            found = crud.user_ids(db, missing)
+            for name in missing:
+                self.owners.set(name, found.get(name))
+        return {name: self.owners.get(name, None) for name in names}
+
+
+def export(out, format: str, session_factory=None, batch_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    """Write every link to `out` in the import format; return the count and rows/sec"""
+    owners = cache.LocalCache(maxsize=100_000, ttl=math.inf)
+    started = time.perf_counter()
+    count = 0
+    writer = csv.writer(out) if format == "csv" else None
+    if writer:
+        writer.writerow(FIELDS)
+    db = (session_factory or crud.SessionLocal)()
+    try:
+        for rows in crud.iter_url_rows(db, batch_size):
+            missing = list({row.owner_id for row in rows if owners.get(row.owner_id) is cache.MISSING})
+            if missing:
+                found = crud.usernames(db, missing)
+                for owner_id in missing:
+                    owners.set(owner_id, found.get(owner_id))
+            for row in rows:
+                values = [
+                    row.short_key,
+                    row.target_url,
+                    owners.get(row.owner_id, None),
+                    row.redirect_status,
+                    row.cache_max_age,
+                    row.expires_at and row.expires_at.isoformat(),
+                    row.clicks,
+                    row.created_at and row.created_at.isoformat(),
+                ]
+                if writer:
+                    writer.writerow(["" if value is None else value for value in values])
+                else:
+                    out.write(json.dumps({name: value for name, value in zip(FIELDS, values) if value is not None}) + "\n")
+            count += len(rows)
+    finally:
+        db.close()
+    seconds = time.perf_counter() - started
+    return {"exported": count, "seconds": seconds, "rows_per_sec": count / seconds if seconds else 0}
+
+
+def guess_format(path: str, format: Optional[str]) -> str:
+    if format:
+        return format
+    return "csv" if path.endswith(".csv") else "ndjson"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    importing = commands.add_parser("import", help="load links from a CSV or NDJSON file ('-' for stdin)")
+    importing.add_argument("path")
+    importing.add_argument("--format", choices=["csv", "ndjson"], help="default: from the file extension")
+    importing.add_argument("--owner", help="username for records without an owner")
+    importing.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    importing.add_argument("--on-conflict", choices=["skip", "fail"], default="skip")
+    importing.add_argument("--state", help="checkpoint file to resume from and update")
+    importing.add_argument("--rejects", help="NDJSON file for rejected records (default: stderr)")
+    exporting = commands.add_parser("export", help="write every link to a CSV or NDJSON file ('-' for stdout)")
+    exporting.add_argument("path")
+    exporting.add_argument("--format", choices=["csv", "ndjson"], help="default: from the file extension")
+    exporting.add_argument("--batch-size", type=int, default=IMPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    format = guess_format(args.path, args.format)
+
+    if args.command == "export":
+        out = sys.stdout if args.path == "-" else open(args.path, "w", newline="" if format == "csv" else None)
+        try:
+            result = export(out, format, batch_size=args.batch_size)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        logger.info("exported %(exported)d links in %(seconds).1fs, %(rows_per_sec).0f rows/s", result)
+        return
+
+    source = sys.stdin if args.path == "-" else open(args.path, newline="" if format == "csv" else None)
+    rejects = open(args.rejects, "a") if args.rejects else sys.stderr
+    try:
+        importer = Importer(
+            chunk_size=args.chunk_size,
+            owner=args.owner,
+            on_conflict=args.on_conflict,
+            state_path=args.state,
+            rejects=rejects,
+        )
+        result = importer.run(read_records(source, format))
+    except ImportConflict as exc:
+        parser.exit(1, f"{exc}\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if rejects is not sys.stderr:
+            rejects.close()
+    logger.info(
+        "%(records)d records: %(imported)d imported, %(present)d already present, %(rejected)d rejected "
+        "in %(seconds).1fs, %(rows_per_sec).0f rows/s",
+        result,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+import auth
+import cache
+import crud
+
+
+WARMUP = crud.env_flag("WARMUP", "true")
+WARMUP_TOP_KEYS = int(os.getenv("WARMUP_TOP_KEYS", "1000"))
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", str(crud.DB_POOL_SIZE)))
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """Gets a fresh worker ready before it is marked ready for traffic.
+
+    Opens pool connections, primes the redirect cache with the most clicked
+    links and loads the bcrypt backend. A failed step is logged and skipped:
+    warming up is an optimisation, and everything it does also happens
+    lazily on the first requests.
+    """
+
+    def __init__(
+        self,
+        session_factory=None,
+        top_keys: int = WARMUP_TOP_KEYS,
+        connections: int = WARMUP_CONNECTIONS,
+        enabled: bool = WARMUP,
+    ):
+        self.session_factory = session_factory
+        self.top_keys = top_keys
+        self.connections = connections
+        self.enabled = enabled
+        self.ready = False
+        self.steps = {}
+        self.seconds = None
+        self.started = time.monotonic()
+
+    async def run(self):
+        started = time.perf_counter()
+        if self.enabled:
+            for name, step in (
+                ("connections", self.open_connections),
+                ("redirect_cache", self.prime_redirect_cache),
+                ("password_hasher", self.load_hasher),
+            ):
+                step_started = time.perf_counter()
+                try:
+                    detail = await step()
+                    self.steps[name] = {"ok": True, "seconds": time.perf_counter() - step_started, **(detail or {})}
+                except Exception as exc:
+                    logger.exception("warmup step %s failed", name)
+                    self.steps[name] = {"ok": False, "error": str(exc)}
+        self.seconds = time.perf_counter() - started
+        self.ready = True
+        logger.info("warm after %.3fs: %s", self.seconds, self.steps)
+
+    async def open_connections(self) -> dict:
+        """Hold `connections` sessions' connections at once so the pool is full before traffic"""
+        if crud.DB_ASYNC and self.session_factory is None:
+            sessions = [crud.AsyncSessionLocal() for _ in range(self.connections)]
+            try:
+                for session in sessions:
+                    await session.connection()
+            finally:
+                await asyncio.gather(*(session.close() for session in sessions))
+        else:
+            await run_in_threadpool(self._open_sync_connections)
+        return {"opened": self.connections}
+
+    def _open_sync_connections(self):
+        sessions = [(self.session_factory or crud.SessionLocal)() for _ in range(self.connections)]
+        try:
+            for session in sessions:
+                session.connection()
+        finally:
+            for session in sessions:
+                session.close()
+
+    async def prime_redirect_cache(self) -> dict:
+        # Each set may be a Redis round trip, so the whole step stays off the event loop
+        return await run_in_threadpool(self._prime_redirect_cache)
+
+    def _prime_redirect_cache(self) -> dict:
+        urls = self._top_urls()
+        now = time.time()
+        primed = 0
+        for url in urls:
+            entry = cache.CachedURL.from_url(url)
+            if entry.expires_at is None or entry.expires_at > now:
+                cache.redirect_cache.set(url.short_key, entry)
+                primed += 1
+        return {"keys": primed}
+
+    def _top_urls(self) -> list:
+        db = (self.session_factory or crud.SessionLocal)()
+        try:
+            return crud.top_urls(db, self.top_keys)
+        finally:
+            db.close()
+
+    async def load_hasher(self):
+        # The first hash loads passlib's bcrypt backend and starts the pool threads
+        await auth.hasher.hash("warmup")
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "uptime_seconds": time.monotonic() - self.started,
+            "warmup_seconds": self.seconds,
+            "steps": self.steps,
+        }
+
+
+warmup = Warmup()
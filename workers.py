@@ -0,0 +1,57 @@
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicWorker:
+    """Calls `run_once` every `interval` seconds on a daemon thread.
+
+    `stop` runs one final pass after the thread exits so buffered work is not
+    lost on shutdown.
+    """
+
+    name = "worker"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self._run_safely()
+
+    def wake(self):
+        """Run the next pass now instead of waiting for the interval"""
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            self._run_safely()
+
+    def _run_safely(self):
+        try:
+            self.run_once()
+        except Exception:
+            logger.exception("%s pass failed", self.name)